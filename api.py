@@ -1,43 +1,219 @@
+import asyncio
+import os
+import random
+import threading
 import requests
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from loguru import logger
 
+from llmPool import LLMPool
+from metrics import LLM_ATTEMPTS, LLM_FAILURES, LLM_RETRIES
+
 logger.add("./log/app.log", format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}", level="DEBUG")
-session = requests.Session()
 
+# 多个副本时以逗号分隔列在 LLM_URLS 中，发往其中任一地址的调用由多节点池分发（见 llmPool.py），LLM_URL 默认取第一个
+LLM_URLS = [url.strip() for url in os.environ.get("LLM_URLS", "").split(",") if url.strip()]
+# 大模型服务地址与模型，可通过同名环境变量覆盖（如指向 llmStub.py 启动的本地桩服务）
+LLM_URL = os.environ.get("LLM_URL", LLM_URLS[0] if LLM_URLS else "http://100.100.20.144:9997/v1/chat/completions")
+LLM_MODEL = os.environ.get("LLM_MODEL", "qwen3")
 
-def chat_with_requests(url, model, message, max_retries=3):
+# 大模型客户端配置，同样可通过同名环境变量覆盖
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))  # 同时发往大模型服务的请求数上限
+LLM_MAX_STREAMS = int(os.environ.get("LLM_MAX_STREAMS", LLM_MAX_CONCURRENCY))  # 同时进行的流式调用数上限
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", 3.05))  # 建立连接超时（秒）
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 60))  # 等待响应超时（秒）
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", 0.5))  # 重试退避基数（秒）
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", 8.0))  # 单次退避上限（秒）
+LLM_HEDGE = os.environ.get("LLM_HEDGE", "1") != "0"  # 多节点池：超过节点 p95 延迟时向另一节点发送对冲请求
+LLM_HEDGE_MAX_RATIO = float(os.environ.get("LLM_HEDGE_MAX_RATIO", 0.1))  # 多节点池：对冲请求数占请求数的上限
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))  # 多节点池：节点连续失败多少次后熔断
+LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", 30))  # 多节点池：熔断后多久放行探测请求（秒）
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 30))  # 多节点池：在线程池中排队超过该时长（秒）的尝试失败
+
+
+class AsyncLLMClient:
+    """异步大模型客户端
+
+    - 连接池：共享一个 requests.Session，连接数与并发上限一致
+    - 超时：每次调用都带连接/读取超时，可按调用覆盖
+    - 重试：带随机抖动的指数退避，退避期间通过 asyncio.sleep 让出，不占用请求线程
+    - 并发：阻塞的 HTTP 调用在固定大小的线程池中执行，线程池大小即发往大模型服务的并发上限；
+      流式调用在调用方线程中执行，另有独立的并发上限 max_streams，超过时排队等待
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, connect_timeout=LLM_CONNECT_TIMEOUT,
+                 read_timeout=LLM_READ_TIMEOUT, backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX,
+                 max_streams=LLM_MAX_STREAMS):
+        self.max_concurrency = max_concurrency
+        self.max_streams = max_streams
+        self.timeout = (connect_timeout, read_timeout)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._in_flight = 0  # 已提交到线程池、尚未完成的调用数（含排队中的）
+        self._in_flight_lock = threading.Lock()
+        self._stream_slots = threading.BoundedSemaphore(max_streams)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def _post(self, url, payload, timeout, stream=False):
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer "  # 替换为你的API密钥
+        }
+        return self.session.post(url, headers=headers, data=payload, timeout=timeout, stream=stream)
+
+    def submit(self, fn, *args):
+        """提交到线程池执行，记入未完成调用数"""
+        with self._in_flight_lock:
+            self._in_flight += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def free_slots(self):
+        """线程池中空闲的并发名额数（未完成调用数达到并发上限时为0）"""
+        with self._in_flight_lock:
+            return max(self.max_concurrency - self._in_flight, 0)
+
+    def _backoff(self, attempt, response=None):
+        """全抖动指数退避；限流响应（429）带 Retry-After 时至少等待该时长（不超过退避上限）"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if response is not None and response.status_code == 429:
+            try:
+                delay = max(delay, min(self.backoff_max, float(response.headers.get("Retry-After", 0))))
+            except ValueError:
+                pass
+        return delay
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer "  # 替换为你的API密钥
-    }
-    data = {
-        "model": model,
-        "messages": message
-    }
+    async def chat(self, url, model, message, max_retries=3, timeout=None):
+        """发送对话请求，返回模型回复内容，所有重试均失败时返回 None"""
+        payload = json.dumps({"model": model, "messages": message})
+        for attempt in range(1, max_retries + 1):
+            response = None
+            try:
+                response = await asyncio.wrap_future(self.submit(self._post, url, payload, timeout or self.timeout))
+                LLM_ATTEMPTS.inc(outcome=response.status_code)
+                if response.status_code == 200:
+                    return response.json()["choices"][0]["message"]["content"]
+                logger.error(f"Attempt {attempt}/{max_retries} failed: {response.content}")
+            except Exception as e:
+                if response is None:
+                    LLM_ATTEMPTS.inc(outcome="error")
+                logger.error(f"Attempt {attempt}/{max_retries} failed: {str(e)}")
+            if attempt < max_retries:
+                LLM_RETRIES.inc()
+                await asyncio.sleep(self._backoff(attempt, response))
+        LLM_FAILURES.inc()
+        return None
+
+    def stream(self, url, model, message, max_retries=3, timeout=None, on_start=None):
+        """流式对话：逐段产出模型回复内容
+
+        只在收到首个数据前重试；调用方关闭生成器（如客户端断开）时立即关闭上游连接，取消模型请求
+        每次尝试前占用一个流式名额（已达 max_streams 时排队），流结束或尝试失败时释放；
+        流式调用在调用方线程中同步执行（不经过事件循环），重试退避在调用方线程中阻塞等待，等待期间不占用名额
+        :param on_start: 占到名额、开始发送请求时调用（供调用方排除排队时间）
+        """
+        payload = json.dumps({"model": model, "messages": message, "stream": True})
+        response = None
+        for attempt in range(1, max_retries + 1):
+            failed = None
+            connected = False  # 成功时名额交给下面读取回复的部分，流结束时释放
+            self._stream_slots.acquire()
+            try:
+                if on_start is not None:
+                    on_start()
+                try:
+                    response = self._post(url, payload, timeout or self.timeout, stream=True)
+                    LLM_ATTEMPTS.inc(outcome=response.status_code)
+                    if response.status_code == 200:
+                        connected = True
+                        break
+                    logger.error(f"Attempt {attempt}/{max_retries} failed: {response.content}")
+                    response.close()
+                    failed = response
+                except Exception as e:
+                    LLM_ATTEMPTS.inc(outcome="error")
+                    logger.error(f"Attempt {attempt}/{max_retries} failed: {str(e)}")
+            finally:
+                if not connected:
+                    self._stream_slots.release()
+            response = None
+            if attempt < max_retries:
+                LLM_RETRIES.inc()
+                time.sleep(self._backoff(attempt, failed))
+        if response is None:
+            LLM_FAILURES.inc()
+            raise RuntimeError("大模型流式调用失败")
 
-    for attempt in range(1, max_retries + 1):
         try:
-            response = session.post(url, headers=headers, data=json.dumps(data))
-            if response.status_code == 200:
-                return response.json()["choices"][0]["message"]["content"]
-            else:
-                error_msg = f"Attempt {attempt}/{max_retries} failed: {response.content}"
-                logger.error(error_msg)
-                time.sleep(2 ** attempt)
-        except Exception as e:
-            error_msg = f"Attempt {attempt}/{max_retries} failed: {str(e)}"
-            logger.error(error_msg)
-            time.sleep(2 ** attempt)
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content:
+                    yield content
+        finally:
+            response.close()
+            self._stream_slots.release()
+
+    def _ensure_loop(self):
+        """启动供同步调用使用的后台事件循环"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-loop", daemon=True).start()
+            return self._loop
+
+    def chat_sync(self, url, model, message, max_retries=3, timeout=None):
+        """同步包装：在后台事件循环中执行 chat 并等待结果"""
+        future = asyncio.run_coroutine_threadsafe(
+            self.chat(url, model, message, max_retries, timeout), self._ensure_loop())
+        return future.result()
+
+
+# 全局客户端；配置了 LLM_URLS 时另建多节点池，共用客户端的连接池、线程池与退避策略
+llm_client = AsyncLLMClient()
+llm_pool = LLMPool(LLM_URLS, llm_client, LLM_HEDGE, hedge_max_ratio=LLM_HEDGE_MAX_RATIO,
+                   failure_threshold=LLM_BREAKER_FAILURES,
+                   reset_timeout=LLM_BREAKER_RESET, queue_timeout=LLM_QUEUE_TIMEOUT) if LLM_URLS else None
+
+
+def chat_with_requests(url, model, message, max_retries=3):
+    """同步调用大模型，供 get_llm_explanation 等阻塞调用方使用；url 属于多节点池时由池分发"""
+    if llm_pool is not None and llm_pool.handles(url):
+        return llm_pool.chat(model, message, max_retries)
+    return llm_client.chat_sync(url, model, message, max_retries)
+
+
+def stream_chat(url, model, message, max_retries=3):
+    """流式调用大模型，逐段返回回复内容；url 属于多节点池时由池分发"""
+    if llm_pool is not None and llm_pool.handles(url):
+        return llm_pool.stream(model, message, max_retries)
+    return llm_client.stream(url, model, message, max_retries)
 
 if __name__ == '__main__':
-    url = "http://100.100.20.144:9997/v1/chat/completions"
-    model = "qwen3"
+    url = LLM_URL
+    model = LLM_MODEL
     messages = [
         {'role': 'system', 'content': "you are a helpful assistant"},
         {'role': 'user', 'content': "1+1="}
     ]
     content = chat_with_requests(url, model, messages)
-    print(content)
\ No newline at end of file
+    print(content)
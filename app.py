@@ -1,65 +1,755 @@
+import argparse
+import hmac
+import queue
+import time
 import requests
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from riskIndicatorDescription import *
+from explanationCache import ExplanationCache
+from explanationBatcher import ExplanationBatcher
+from explanationJobs import ExplanationJobs, JobQueueFull
+from explanationTemplates import DEFAULT_EXPLAIN_MODE, EXPLAIN_MODES, build_summary, select_template_explanation
+from evaluationSession import EvaluationSessions
+from ruleStore import RuleStore
+from ruleSnapshot import RuleSnapshots
+import api
+import metrics
+import rulePlan
+from stepStatistics import step_statistics
 app = Flask(__name__)
 # 全局配置：JSON序列化时保留中文
 app.config['JSON_AS_ASCII'] = False
 
+# 大模型服务配置：默认取 api.py 中的 LLM_URL、LLM_MODEL（可由同名环境变量覆盖），也可通过启动参数指定
+LLM_URL = api.LLM_URL
+LLM_MODEL = api.LLM_MODEL
+# 批量接口中并发调用大模型的线程数
+LLM_MAX_WORKERS = 8
+llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS)
+
+# 语义描述缓存配置
+EXPLANATION_CACHE_SIZE = 10000
+EXPLANATION_CACHE_TTL = 24 * 3600  # 秒
+EXPLANATION_CACHE_DB = None  # 设为文件路径（如 "data/explanations.db"）启用重启后仍有效的磁盘缓存
+EXPLANATION_CACHE_DIGITS = 3  # 缓存键中特征值保留的有效数字位数（描述会引用特征值，缓存键总是包含特征值），None 表示按原值区分
+explanation_cache = ExplanationCache(EXPLANATION_CACHE_SIZE, EXPLANATION_CACHE_TTL,
+                                     EXPLANATION_CACHE_DB, EXPLANATION_CACHE_DIGITS)
+
+# 异步语义描述任务配置
+EXPLANATION_JOB_WORKERS = 4
+EXPLANATION_JOB_MAX_PENDING = 1000  # 待处理任务上限，超出时返回503
+EXPLANATION_JOB_TTL = 600  # 任务完成后可查询的时间（秒）
+# 允许的回调主机名：设置环境变量 RISK_CALLBACK_HOSTS（逗号分隔）后 callback_url 只能指向其中的主机，
+# 未设置时只允许解析为公网地址的 http/https 地址
+CALLBACK_HOSTS = [host.strip() for host in os.environ["RISK_CALLBACK_HOSTS"].split(",") if host.strip()] \
+    if os.environ.get("RISK_CALLBACK_HOSTS") else None
+explanation_jobs = ExplanationJobs(EXPLANATION_JOB_WORKERS, EXPLANATION_JOB_MAX_PENDING, EXPLANATION_JOB_TTL,
+                                   callback_hosts=CALLBACK_HOSTS)
+
+# 语义描述合并调用配置：批量接口和异步任务中，时间窗口内的申报合并为一次大模型调用（见 explanationBatcher.py）
+EXPLANATION_BATCH_WINDOW_MS = 20  # 第一条申报到达后等待合并的时间（毫秒）
+EXPLANATION_BATCH_MAX_ITEMS = 8  # 每次合并的申报数上限，设为1时不合并
+EXPLANATION_BATCH_TOKEN_BUDGET = 6000  # 合并后提示词的估算 token 上限
+explanation_batcher = ExplanationBatcher(EXPLANATION_BATCH_WINDOW_MS, EXPLANATION_BATCH_MAX_ITEMS,
+                                         EXPLANATION_BATCH_TOKEN_BUDGET) if EXPLANATION_BATCH_MAX_ITEMS > 1 else None
+
+# 语义描述方式：template 只用模板；llm 只用大模型；auto 模板置信度达到 TEMPLATE_MIN_CONFIDENCE 时用模板，否则调用大模型
+# 请求体中的 "explain_mode" 可覆盖默认方式；默认方式与 TEMPLATE_MIN_CONFIDENCE 定义在 explanationTemplates.py（与 pipeline.py 共用）
+EXPLAIN_MODE = DEFAULT_EXPLAIN_MODE
+
+# 增量评估会话配置：按申报ID保存上次的计算结构与语义描述（见 evaluationSession.py）
+EVALUATION_SESSION_MAX = 10000  # 会话数上限，超出时淘汰最久未访问的会话
+EVALUATION_SESSION_TTL = 3600  # 会话超过该时间（秒）未更新即过期
+evaluation_sessions = EvaluationSessions(EVALUATION_SESSION_MAX, EVALUATION_SESSION_TTL)
+
+# 规则库配置：createRuleData.py 生成的规则文件，存在时在启动时加载
+# 列式二进制文件（createRuleData.py --binary）优先，内存映射加载，多个工作进程共享同一份页缓存
+RULES_CSV = "data/rules.csv"
+RULES_BINARY = "data/rules.bin"
+# 规则库以只读快照提供服务，重新加载、编辑规则时在后台构建新快照后整体替换（见 ruleSnapshot.py）
+RULE_SNAPSHOT_WARM_PLANS = True  # 构建快照时预先编译每条规则的计划（内存映射规则库不预编译）
+# 内存映射规则库也在发布快照前构建规则DAG与阈值索引（包括启动时）；为 False 时只在上一版本已经建好时预先构建
+RULE_SNAPSHOT_WARM_INDEX = False
+# 管理接口令牌：设置环境变量 RISK_ADMIN_TOKEN 后，/admin 接口需要在请求头 X-Admin-Token 中给出；
+# 未设置时 /admin 接口只接受本机（回环地址）的请求
+ADMIN_TOKEN = os.environ.get("RISK_ADMIN_TOKEN")
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1")
+# /admin/rules/reload 只能加载该目录（及其子目录）中的规则文件，可通过环境变量 RISK_RULES_DIR 覆盖
+RULES_DIR = os.environ.get("RISK_RULES_DIR", os.path.dirname(RULES_CSV))
+
+def default_rules_path():
+    if os.path.exists(RULES_BINARY):
+        return RULES_BINARY
+    if os.path.exists(RULES_CSV):
+        return RULES_CSV
+    return None
+
+def load_rule_store(path=None):
+    """加载规则库：未指定路径时按默认路径，列式二进制文件优先，都不存在时为空规则库"""
+    path = path or default_rules_path()
+    return RuleStore.load(path) if path else RuleStore()
+
+rule_snapshots = RuleSnapshots(load_rule_store, default_rules_path(), RULE_SNAPSHOT_WARM_PLANS,
+                               warm_index=RULE_SNAPSHOT_WARM_INDEX)
+
+def current_rule_store():
+    """本次请求使用的规则库：请求开始时取定的快照，同一请求内各处看到同一版本"""
+    return g.rule_snapshot.store
+
+@app.before_request
+def start_request_metrics():
+    """开始计时，并为本次请求开启阶段耗时记录"""
+    g.request_start = time.perf_counter()
+    g.rule_snapshot = rule_snapshots.current
+    metrics.start_timings()
+
+@app.after_request
+def record_request_metrics(response):
+    """记录请求数与耗时（流式接口为返回首字节前的耗时）"""
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    if "request_start" in g:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    if "rule_snapshot" in g:
+        response.headers["X-Rule-Snapshot-Version"] = str(g.rule_snapshot.version)
+    return response
+
+def collect_component_metrics():
+    """规则计划缓存、语义描述缓存与后台任务的已有统计，导出 /metrics 时读取"""
+    plan_stats = rulePlan.plan_cache.stats()
+    cache_stats = explanation_cache.stats()
+    job_stats = explanation_jobs.stats()
+    return [
+        ("risk_rule_plan_cache_total", "counter", "规则计划缓存查找次数",
+         [({"result": "hit"}, plan_stats["hits"]), ({"result": "miss"}, plan_stats["misses"])]),
+        ("risk_explanation_cache_total", "counter", "语义描述缓存查找次数（按命中层级）",
+         [({"result": "memory_hit"}, cache_stats["memory_hits"]), ({"result": "disk_hit"}, cache_stats["disk_hits"]),
+          ({"result": "miss"}, cache_stats["misses"])]),
+        ("risk_explanation_cache_entries", "gauge", "语义描述缓存条目数", [({}, cache_stats["size"])]),
+        ("risk_explanation_jobs_pending", "gauge", "待处理的异步语义描述任务数", [({}, job_stats["pending"])]),
+        ("risk_rule_store_rules", "gauge", "规则库规则数", [({}, len(rule_snapshots.current.store))]),
+        ("risk_rule_snapshot_version", "gauge", "当前规则库快照版本", [({}, rule_snapshots.current.version)]),
+    ] + collect_llm_pool_metrics()
+
+def collect_llm_pool_metrics():
+    """多节点大模型服务池中各节点的未完成请求数、熔断状态与 p95 延迟"""
+    if api.llm_pool is None:
+        return []
+    endpoints = api.llm_pool.stats()["endpoints"]
+    return [
+        ("risk_llm_endpoint_outstanding", "gauge", "大模型服务节点的未完成请求数",
+         [({"endpoint": e["url"]}, e["outstanding"]) for e in endpoints]),
+        ("risk_llm_endpoint_healthy", "gauge", "大模型服务节点是否可用（熔断器关闭为1）",
+         [({"endpoint": e["url"]}, int(e["healthy"])) for e in endpoints]),
+        ("risk_llm_endpoint_p95_seconds", "gauge", "大模型服务节点最近成功请求的 p95 延迟（秒）",
+         [({"endpoint": e["url"]}, e["p95_ms"] / 1000) for e in endpoints if e["p95_ms"] is not None]),
+    ]
+
+metrics.registry.register_collector(collect_component_metrics)
+
+def with_timings(data, response_data):
+    """请求体 "timings": true 时在响应中附带本次请求各阶段耗时（毫秒，不含响应序列化）"""
+    if data.get('timings'):
+        timings = dict(metrics.current_timings() or {})
+        if "request_start" in g:
+            timings["total"] = round((time.perf_counter() - g.request_start) * 1000, 3)
+        response_data["timings"] = timings
+    return response_data
+
 def json_response(data, status_code=200):
     """自定义JSON响应，确保中文不转义"""
-    json_str = json.dumps(data, ensure_ascii=False, indent=2)  # 关键：ensure_ascii=False
+    with metrics.timed("serialize"):
+        json_str = json.dumps(data, ensure_ascii=False, indent=2)  # 关键：ensure_ascii=False
     return Response(
         json_str,
         status=status_code,
         mimetype='application/json; charset=utf-8'  # 明确指定UTF-8编码
     )
 
+def request_rules(data):
+    """请求中的规则：直接给出的 rules，或按 rule_id 从规则库中取出；rule_id 不存在时返回 None"""
+    rules = data.get('rules', [])
+    if not rules and data.get('rule_id'):
+        stored = current_rule_store().get(data['rule_id'])
+        return stored.rules if stored is not None else None
+    return rules
+
+def request_plan(data, rules):
+    """
+    规则的编译计划：按 rule_id 引用规则库时用快照中已编译的计划（不经过全局计划缓存，规则库更新后不会残留旧版本），
+    否则从计划缓存获取；无法编译时抛出 ValueError
+    """
+    if not data.get('rules') and data.get('rule_id'):
+        stored = current_rule_store().get(data['rule_id'])
+        if stored is not None:
+            return stored.plan
+    return rulePlan.get_plan(rules)
+
+def request_rule_type(data):
+    """请求中的规则类型：直接给出的 rule_type，或按 rule_id 取规则库中的规则类型"""
+    if data.get('rule_type'):
+        return data['rule_type']
+    if data.get('rule_id'):
+        stored = current_rule_store().get(data['rule_id'])
+        return stored.rule_type if stored is not None else None
+    return None
+
+def template_explanation(data, multi_dimensional_structure):
+    """
+    按 explain_mode 决定是否使用模板描述
+    :return: (模板描述, 置信度)；需要调用大模型时描述为 None，llm 方式不计算置信度
+    """
+    mode = data.get('explain_mode', EXPLAIN_MODE)
+    rule_type = request_rule_type(data) if mode != "llm" else None
+    template, confidence = select_template_explanation(multi_dimensional_structure, mode, rule_type)
+    metrics.EXPLANATIONS.inc(source="template" if template is not None else "llm")
+    return template, confidence
+
+def explanation_fields(template, confidence):
+    """响应中的描述来源字段"""
+    return {"explanation_source": "template" if template is not None else "llm", "template_confidence": confidence}
+
 @app.route('/explain_risk', methods=['POST'])
 def explain_risk():
-    """多维特征提取接口：输入单维指标，输出多维计算结构+大模型语义描述"""
+    """多维特征提取接口：输入单维指标，输出多维计算结构+大模型语义描述
+
+    请求体中 "timings": true 时响应附带 timings（各阶段耗时，毫秒）；
+    "explain_mode" 为 template / llm / auto，模板描述可用时不调用大模型（异步模式也直接返回描述）
+    """
     # 从请求中获取参数
-    data = request.json
-    risk_features = data.get('risk_features', {})
-    rules = data.get('rules', [])
+    with metrics.timed("parse_request"):
+        data = request.json
+        risk_features = data.get('risk_features', {})
+        rules = request_rules(data)
 
     # 验证输入
+    if rules is None:
+        return json_response({"error": f"规则 {data['rule_id']} 不存在"}, 404)
     if not risk_features or not rules:
         return json_response({"error": "缺少必要参数"}, 400)
+    if data.get('explain_mode', EXPLAIN_MODE) not in EXPLAIN_MODES:
+        return json_response({"error": f"不支持的 explain_mode: {data['explain_mode']}"}, 400)
 
     try:
         # 生成多维计算结构
-        multi_dimensional_structure = generate_risk_indicator(risk_features, rules)
+        with metrics.timed("generate_risk_indicator"):
+            multi_dimensional_structure = request_plan(data, rules).evaluate(risk_features, rules)
         print(f"多维计算结构: {multi_dimensional_structure}")
 
+        # 有可用的模板描述时直接返回，不调用大模型
+        with metrics.timed("render_template"):
+            template, confidence = template_explanation(data, multi_dimensional_structure)
+        if template is not None:
+            return json_response(with_timings(data, {
+                "multi_dimensional_structure": multi_dimensional_structure,
+                "semantic_description": template,
+                "summary": build_summary(risk_features, multi_dimensional_structure),
+                **explanation_fields(template, confidence)
+            }))
+
+        # 异步模式：立即返回计算结构和任务ID，语义描述由后台任务生成
+        if data.get('async'):
+            try:
+                job_id = explanation_jobs.submit(
+                    get_llm_explanation, risk_features, rules, multi_dimensional_structure,
+                    LLM_URL, LLM_MODEL, explanation_cache, explanation_batcher, callback_url=data.get('callback_url'))
+            except JobQueueFull as e:
+                return json_response({"error": str(e)}, 503)
+            except ValueError as e:
+                return json_response({"error": str(e)}, 400)
+            return json_response(with_timings(data, {
+                "multi_dimensional_structure": multi_dimensional_structure,
+                "summary": build_summary(risk_features, multi_dimensional_structure),
+                **explanation_fields(None, confidence),
+                "job_id": job_id,
+                "status": "pending"
+            }), 202)
+
         # 获取大模型详细语义描述
-        url = "http://100.100.20.144:9997/v1/chat/completions"
-        model = "qwen3"
-        semantic_description = get_llm_explanation(risk_features, rules, multi_dimensional_structure, url, model)
+        semantic_description = get_llm_explanation(risk_features, rules, multi_dimensional_structure, LLM_URL, LLM_MODEL, explanation_cache)
         print(f"语义描述: {semantic_description}")
 
         # 构建完整响应
         response_data = {
             "multi_dimensional_structure": multi_dimensional_structure,
             "semantic_description": semantic_description,
-            "summary": {
-                "risk_indicator": multi_dimensional_structure["final_risk_indicator"],
-                "risk_level": "高风险" if multi_dimensional_structure["final_risk_indicator"] == 1 else "低风险",
-                "features_count": len(risk_features),
-                "calculation_steps": len(multi_dimensional_structure["calculation_steps"])
-            }
+            "summary": build_summary(risk_features, multi_dimensional_structure),
+            **explanation_fields(None, confidence)
         }
 
-        return json_response(response_data)
+        return json_response(with_timings(data, response_data))
         
     except Exception as e:
         print(f"处理错误: {str(e)}")
         return json_response({"error": str(e)}, 500)
 
+@app.route('/explain_risk/jobs/<job_id>', methods=['GET'])
+def explain_risk_job(job_id):
+    """查询异步语义描述任务"""
+    job = explanation_jobs.get(job_id)
+    if job is None:
+        return json_response({"error": "任务不存在或已过期"}, 404)
+    return json_response(job)
+
+def sse_event(event, data):
+    """Server-Sent Events 格式的单个事件"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/explain_risk/stream', methods=['POST'])
+def explain_risk_stream():
+    """流式多维特征提取接口：先推送计算结构，再随大模型输出逐段推送语义描述（SSE）
+
+    事件依次为 structure（多维计算结构和摘要）、若干 description（描述片段）、done；出错时推送 error。
+    客户端断开时关闭生成器，同时关闭到大模型服务的连接
+    """
+    data = request.json or {}
+    risk_features = data.get('risk_features', {})
+    rules = request_rules(data)
+
+    if rules is None:
+        return json_response({"error": f"规则 {data['rule_id']} 不存在"}, 404)
+    if not risk_features or not rules:
+        return json_response({"error": "缺少必要参数"}, 400)
+    if data.get('explain_mode', EXPLAIN_MODE) not in EXPLAIN_MODES:
+        return json_response({"error": f"不支持的 explain_mode: {data['explain_mode']}"}, 400)
+
+    try:
+        with metrics.timed("generate_risk_indicator"):
+            multi_dimensional_structure = request_plan(data, rules).evaluate(risk_features, rules)
+        with metrics.timed("render_template"):
+            template, confidence = template_explanation(data, multi_dimensional_structure)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+    def generate():
+        yield sse_event("structure", {
+            "multi_dimensional_structure": multi_dimensional_structure,
+            "summary": build_summary(risk_features, multi_dimensional_structure),
+            **explanation_fields(template, confidence)
+        })
+        if template is not None:
+            yield sse_event("description", {"content": template})
+            yield sse_event("done", {})
+            return
+        chunks = stream_llm_explanation(risk_features, rules, multi_dimensional_structure, LLM_URL, LLM_MODEL, explanation_cache)
+        try:
+            for chunk in chunks:
+                yield sse_event("description", {"content": chunk})
+            yield sse_event("done", {})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            chunks.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream; charset=utf-8',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def ndjson_line(data):
+    """单行JSON，不缩进，保留中文"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+@app.route('/explain_risk_batch', methods=['POST'])
+def explain_risk_batch():
+    """批量多维特征提取接口：一次提交多条申报，按完成顺序逐行返回NDJSON结果
+
+    请求体：{"declarations": [{"id": ..., "risk_features": {...}, "rules": [...], "explain": true}], "explain": false}
+    每条申报的 explain 控制是否生成语义描述，未指定时使用顶层 explain（默认 false）；
+    explain_mode 同样可在每条申报或顶层指定，模板描述可用的申报不调用大模型；
+    不需要语义描述的申报在计算完成后立即输出，不等待大模型；大模型描述完成后在处理下一条申报前输出，不等到全部申报计算完
+    """
+    data = request.json or {}
+    declarations = data.get('declarations')
+    default_explain = bool(data.get('explain', False))
+
+    if not isinstance(declarations, list) or not declarations:
+        return json_response({"error": "缺少必要参数"}, 400)
+
+    def explain_item(index, item, risk_features, rules, multi_dimensional_structure, confidence):
+        result = {"index": index, "id": item.get('id')}
+        try:
+            semantic_description = get_llm_explanation(risk_features, rules, multi_dimensional_structure, LLM_URL, LLM_MODEL,
+                                                       explanation_cache, explanation_batcher)
+            result.update({
+                "multi_dimensional_structure": multi_dimensional_structure,
+                "semantic_description": semantic_description,
+                "summary": build_summary(risk_features, multi_dimensional_structure),
+                **explanation_fields(None, confidence)
+            })
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    def generate():
+        futures = []
+        completed = queue.Queue()  # 已完成的大模型描述任务，按完成顺序
+        emitted = 0
+        try:
+            for index, item in enumerate(declarations):
+                while not completed.empty():
+                    emitted += 1
+                    yield ndjson_line(completed.get().result())
+                if not isinstance(item, dict):
+                    yield ndjson_line({"index": index, "id": None, "error": "申报格式错误"})
+                    continue
+                result = {"index": index, "id": item.get('id')}
+                risk_features = item.get('risk_features', {})
+                rules = request_rules(item)
+                if rules is None:
+                    result["error"] = f"规则 {item['rule_id']} 不存在"
+                    yield ndjson_line(result)
+                    continue
+                if not risk_features or not rules:
+                    result["error"] = "缺少必要参数"
+                    yield ndjson_line(result)
+                    continue
+                explain = item.get('explain', default_explain)
+                try:
+                    with metrics.timed("generate_risk_indicator"):
+                        multi_dimensional_structure = request_plan(item, rules).evaluate(risk_features, rules)
+                    if explain:
+                        with metrics.timed("render_template"):
+                            template, confidence = template_explanation(
+                                {"explain_mode": data.get('explain_mode', EXPLAIN_MODE), **item}, multi_dimensional_structure)
+                except Exception as e:
+                    result["error"] = str(e)
+                    yield ndjson_line(result)
+                    continue
+
+                if explain and template is not None:
+                    result.update({
+                        "multi_dimensional_structure": multi_dimensional_structure,
+                        "semantic_description": template,
+                        "summary": build_summary(risk_features, multi_dimensional_structure),
+                        **explanation_fields(template, confidence)
+                    })
+                    yield ndjson_line(result)
+                elif explain:
+                    future = llm_executor.submit(
+                        explain_item, index, item, risk_features, rules, multi_dimensional_structure, confidence)
+                    future.add_done_callback(completed.put)
+                    futures.append(future)
+                else:
+                    result.update({
+                        "multi_dimensional_structure": multi_dimensional_structure,
+                        "summary": build_summary(risk_features, multi_dimensional_structure)
+                    })
+                    yield ndjson_line(result)
+
+            for _ in range(len(futures) - emitted):
+                yield ndjson_line(completed.get().result())
+        finally:
+            # 客户端断开时取消尚未开始的大模型调用
+            for future in futures:
+                future.cancel()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson; charset=utf-8'
+    )
+
+@app.route('/evaluate_rules', methods=['POST'])
+def evaluate_rules():
+    """用规则库中的规则评估一条申报（不调用大模型）
+
+    请求体：{"risk_features": {...}, "rule_ids": [...]} 按ID评估指定规则，
+    或 {"risk_features": {...}, "rule_type": "价格风险", "rule_status": "启用"} 评估符合条件、且所需属性都在 risk_features 中的规则
+    （通过属性倒排索引选出，缺少属性的规则不参与评估，计入 skipped）；
+    再给出 "attribute" 时只保留引用该属性的规则；"detail": true 时每条结果附带完整的多维计算结构；
+    "fired_only": true 时通过阈值有序索引只返回触发的规则（以及计算出错的规则），不逐条求值未触发的规则；
+    响应中的 snapshot_version 为评估所用的规则库快照版本
+    """
+    data = request.json or {}
+    rule_store = current_rule_store()
+    risk_features = data.get('risk_features', {})
+    detail = bool(data.get('detail', False))
+    if not risk_features:
+        return json_response({"error": "缺少必要参数"}, 400)
+
+    if data.get('fired_only') and not data.get('rule_ids') and not data.get('attribute'):
+        fired_rules, errors = rule_store.fired_rules(risk_features, data.get('rule_type'), data.get('rule_status'))
+        results = [{"rule_id": rule.rule_id, "rule_type": rule.rule_type, "rule_status": rule.rule_status,
+                    "final_risk_indicator": 1} for rule in fired_rules]
+        for rule_id, error in errors.items():
+            rule = rule_store.get(rule_id)
+            results.append({"rule_id": rule_id, "rule_type": rule.rule_type, "rule_status": rule.rule_status,
+                            "error": error})
+        return json_response({"snapshot_version": g.rule_snapshot.version, "fired": len(fired_rules),
+                              "errors": len(errors), "results": results})
+
+    skipped = 0
+    if data.get('rule_ids'):
+        rules = [rule_store.get(rule_id) for rule_id in data['rule_ids']]
+        missing = [rule_id for rule_id, rule in zip(data['rule_ids'], rules) if rule is None]
+        if missing:
+            return json_response({"error": f"规则 {', '.join(missing)} 不存在"}, 404)
+    else:
+        rules = rule_store.candidates(risk_features, data.get('rule_type'), data.get('rule_status'))
+        if data.get('attribute'):
+            rules = [rule for rule in rules if data['attribute'] in rule.attributes]
+        skipped = rule_store.count(data.get('rule_type'), data.get('rule_status'), data.get('attribute')) - len(rules)
+
+    results = []
+    if detail:
+        for rule in rules:
+            result = {"rule_id": rule.rule_id, "rule_type": rule.rule_type, "rule_status": rule.rule_status}
+            try:
+                multi_dimensional_structure = rule.evaluate(risk_features)
+            except Exception as e:
+                result["error"] = str(e)
+            else:
+                result["final_risk_indicator"] = multi_dimensional_structure["final_risk_indicator"]
+                result["multi_dimensional_structure"] = multi_dimensional_structure
+            results.append(result)
+    else:
+        # 不需要计算结构时通过规则DAG求值，多条规则共用的子表达式只计算一次
+        indicators, errors = rule_store.evaluate_many(rules, risk_features)
+        for rule in rules:
+            result = {"rule_id": rule.rule_id, "rule_type": rule.rule_type, "rule_status": rule.rule_status}
+            if rule.rule_id in indicators:
+                result["final_risk_indicator"] = indicators[rule.rule_id]
+            else:
+                result["error"] = errors[rule.rule_id]
+            results.append(result)
+    fired = sum(1 for result in results if result.get("final_risk_indicator") == 1)
+
+    return json_response({"snapshot_version": g.rule_snapshot.version, "matched": len(rules), "skipped": skipped,
+                          "fired": fired, "results": results})
+
+@app.route('/rules/<rule_id>', methods=['GET'])
+def get_rule(rule_id):
+    """查询规则库中的规则"""
+    rule = current_rule_store().get(rule_id)
+    if rule is None:
+        return json_response({"error": f"规则 {rule_id} 不存在"}, 404)
+    return json_response({**rule.to_dict(), "snapshot_version": g.rule_snapshot.version})
+
+def admin_denied():
+    """设置了 ADMIN_TOKEN 时校验请求头 X-Admin-Token，未设置时只允许本机请求"""
+    if ADMIN_TOKEN is None:
+        return request.remote_addr not in LOOPBACK_ADDRESSES
+    return not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode())
+
+def rules_file_path(path):
+    """
+    重新加载用的规则文件路径：解析符号链接与相对路径后须位于 RULES_DIR 中，否则抛出 ValueError；None 表示默认路径
+    """
+    if path is None:
+        return None
+    if not isinstance(path, str) or not path:
+        raise ValueError("path 应为非空字符串")
+    rules_dir = os.path.realpath(RULES_DIR)
+    resolved = os.path.realpath(path)
+    if os.path.commonpath([rules_dir, resolved]) != rules_dir:
+        raise ValueError(f"规则文件须位于规则目录 {RULES_DIR} 中")
+    if not os.path.isfile(resolved):
+        raise ValueError(f"规则文件 {path} 不存在")
+    return resolved
+
+def build_response(build_id, data):
+    """"wait": true 时等待快照构建完成（最多 wait_timeout 秒）后返回构建记录，否则立即返回 202"""
+    if data.get('wait'):
+        record = rule_snapshots.wait(build_id, data.get('wait_timeout'))
+        return json_response(record, 200 if record["status"] in ("done", "failed") else 202)
+    return json_response(rule_snapshots.build(build_id), 202)
+
+@app.route('/admin/rules/reload', methods=['POST'])
+def reload_rules():
+    """
+    后台重新加载规则库并发布新快照，请求不中断：{"path": 规则文件路径（默认按启动时的路径）, "wait": false}
+    """
+    if admin_denied():
+        return json_response({"error": "管理令牌无效"}, 403)
+    data = request.json or {}
+    try:
+        path = rules_file_path(data.get('path'))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    return build_response(rule_snapshots.reload(path), data)
+
+@app.route('/admin/rules/edit', methods=['POST'])
+def edit_rules():
+    """
+    编辑规则并发布新快照：{"edits": [{"rule_id": ..., "rule_status": "禁用"}, {"rule_id": ..., "thresholds": [1.3]}, ...]}
+    可修改 rule_name、rule_type、rule_status、rule_structure、thresholds，"delete": true 删除规则，
+    不存在的规则ID给出 rule_type、rule_status、rule_structure 时新增；编辑按顺序应用，格式错误时返回 400
+    可选 "base_version"：编辑所基于的快照版本，当前快照不是该版本时返回 400（构建前被其他构建抢先时构建失败）
+    """
+    if admin_denied():
+        return json_response({"error": "管理令牌无效"}, 403)
+    data = request.json or {}
+    base_version = data.get('base_version')
+    if base_version is not None and (isinstance(base_version, bool) or not isinstance(base_version, int)):
+        return json_response({"error": "base_version 应为整数"}, 400)
+    try:
+        build_id = rule_snapshots.edit(data.get('edits'), base_version)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    return build_response(build_id, data)
+
+@app.route('/admin/rules/snapshot', methods=['GET'])
+def rule_snapshot():
+    """当前规则库快照与最近的构建记录"""
+    if admin_denied():
+        return json_response({"error": "管理令牌无效"}, 403)
+    return json_response(rule_snapshots.stats())
+
+@app.route('/admin/rules/builds/<int:build_id>', methods=['GET'])
+def rule_snapshot_build(build_id):
+    """查询快照构建记录"""
+    if admin_denied():
+        return json_response({"error": "管理令牌无效"}, 403)
+    record = rule_snapshots.build(build_id)
+    if record is None:
+        return json_response({"error": "构建记录不存在"}, 404)
+    return json_response(record)
+
+def explain_session(session, changes):
+    """
+    会话的语义描述：模板描述包含特征取值且开销很小，每次重新生成；
+    大模型描述只在步骤结果或最终风险指标翻转时重新请求，否则沿用上次的描述
+    :return: 是否沿用了上次的描述
+    """
+    if not session.explain:
+        session.clear_explanation()
+        return False
+    if not changes["results_changed"] and session.explanation_source == "llm" and session.semantic_description:
+        metrics.EXPLANATIONS.inc(source="reused")
+        return True
+    data = {"explain_mode": session.explain_mode or EXPLAIN_MODE, "rule_type": session.rule_type}
+    with metrics.timed("render_template"):
+        template, confidence = template_explanation(data, session.structure)
+    if template is None:
+        # 大模型调用在 get_llm_explanation 中按 cache_lookup / build_prompt / llm_call 分阶段计时
+        semantic_description = get_llm_explanation(session.risk_features, session.rules, session.structure,
+                                                   LLM_URL, LLM_MODEL, explanation_cache)
+        session.set_explanation(semantic_description, "llm", confidence)
+    else:
+        session.set_explanation(template, "template", confidence)
+    return False
+
+def session_response(session, risk_features, data):
+    """用新的特征评估会话（调用方持有 session.lock），返回会话状态与本次的增量信息"""
+    try:
+        with metrics.timed("generate_risk_indicator"):
+            changes = session.evaluate(risk_features)
+        changes["explanation_reused"] = explain_session(session, changes)
+    except Exception as e:
+        session.clear_explanation()
+        print(f"处理错误: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+    evaluation_sessions.record(changes, changes["explanation_reused"])
+    response_data = session.to_dict()
+    response_data["summary"] = build_summary(risk_features, session.structure)
+    response_data["changes"] = changes
+    return json_response(with_timings(data, response_data))
+
+@app.route('/sessions/<declaration_id>', methods=['PUT'])
+def create_session(declaration_id):
+    """
+    创建（或替换）申报的评估会话并完整计算一次，请求体同 /explain_risk；
+    "explain": false 时不生成语义描述
+    """
+    data = request.json or {}
+    risk_features = data.get('risk_features', {})
+    rules = request_rules(data)
+    if rules is None:
+        return json_response({"error": f"规则 {data['rule_id']} 不存在"}, 404)
+    if not isinstance(risk_features, dict) or not risk_features or not rules:
+        return json_response({"error": "缺少必要参数"}, 400)
+    if data.get('explain_mode', EXPLAIN_MODE) not in EXPLAIN_MODES:
+        return json_response({"error": f"不支持的 explain_mode: {data['explain_mode']}"}, 400)
+    try:
+        session = evaluation_sessions.create(declaration_id, rules, request_rule_type(data),
+                                             data.get('explain', True), data.get('explain_mode'),
+                                             request_plan(data, rules))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    with session.lock:
+        return session_response(session, dict(risk_features), data)
+
+@app.route('/sessions/<declaration_id>', methods=['PATCH'])
+def amend_session(declaration_id):
+    """
+    修改申报的部分特征：{"risk_features": {变化的特征}, "removed_features": [删除的特征]}；
+    只重算输入特征有变化的步骤，可同时修改 explain、explain_mode
+    """
+    data = request.json or {}
+    session = evaluation_sessions.get(declaration_id)
+    if session is None:
+        return json_response({"error": "会话不存在或已过期"}, 404)
+    updates = data.get('risk_features', {})
+    removed = data.get('removed_features', [])
+    if not isinstance(updates, dict) or not isinstance(removed, list):
+        return json_response({"error": "risk_features 应为对象，removed_features 应为列表"}, 400)
+    explain_mode = data.get('explain_mode', session.explain_mode)
+    if (explain_mode or EXPLAIN_MODE) not in EXPLAIN_MODES:
+        return json_response({"error": f"不支持的 explain_mode: {explain_mode}"}, 400)
+
+    # 同一申报的修改依次处理，每次都在上一次修改后的特征上合并
+    with session.lock:
+        if explain_mode != session.explain_mode:
+            session.explain_mode = explain_mode
+            session.clear_explanation()
+        session.explain = data.get('explain', session.explain)
+        risk_features = {**session.risk_features, **updates}
+        for name in removed:
+            risk_features.pop(name, None)
+        return session_response(session, risk_features, data)
+
+@app.route('/sessions/<declaration_id>', methods=['GET'])
+def get_session(declaration_id):
+    """查询申报的评估会话"""
+    session = evaluation_sessions.get(declaration_id)
+    if session is None:
+        return json_response({"error": "会话不存在或已过期"}, 404)
+    return json_response(session.to_dict())
+
+@app.route('/sessions/<declaration_id>', methods=['DELETE'])
+def delete_session(declaration_id):
+    """结束申报的评估会话"""
+    if not evaluation_sessions.remove(declaration_id):
+        return json_response({"error": "会话不存在或已过期"}, 404)
+    return json_response({"declaration_id": declaration_id, "status": "deleted"})
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """规则计划缓存与语义描述缓存的命中统计，规则树步骤的运行统计，增量评估会话统计"""
+    return json_response({
+        "rule_plan_cache": rulePlan.plan_cache.stats(),
+        "step_statistics": step_statistics.stats(),
+        "explanation_cache": explanation_cache.stats(),
+        "explanation_jobs": explanation_jobs.stats(),
+        "explanation_batcher": explanation_batcher.stats() if explanation_batcher is not None else None,
+        "llm_pool": api.llm_pool.stats() if api.llm_pool is not None else None,
+        "rule_store": current_rule_store().stats(),
+        "rule_snapshot": rule_snapshots.current.stats(),
+        "evaluation_sessions": evaluation_sessions.stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 文本格式的运行指标"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
     return json_response({"status": "healthy", "message": "多维特征提取服务运行正常"})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=True)
+    parser = argparse.ArgumentParser(description="多维特征提取与描述服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--llm-url", default=LLM_URL, help="大模型服务地址（/v1/chat/completions）")
+    parser.add_argument("--llm-model", default=LLM_MODEL, help="大模型名称")
+    parser.add_argument("--no-debug", action="store_true", help="关闭调试模式（压测时使用）")
+    args = parser.parse_args()
+    LLM_URL, LLM_MODEL = args.llm_url, args.llm_model
+
+    app.run(host=args.host, port=args.port, debug=not args.no_debug)
@@ -0,0 +1,656 @@
+import argparse
+import csv
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import numpy as np
+
+import batchOperators as batch_ops
+from ruleCorpus import MappedRuleCorpus, is_rule_corpus
+from ruleDAG import CONJUNCTIVE_COMBINERS, OPERAND_KERNELS
+from rulePlan import bind, parse_combiner, parse_step, resolve_operator
+from ruleStore import corpus_rules, peak_rss_mb
+
+# ==============================
+# 离线回测：在历史申报上评估规则库中的全部规则，输出每条规则的命中数（有标注时附带误报率）和稀疏命中矩阵
+# 规则按属性集合的哈希分片到各工作进程，每个进程流式读取申报文件，每 chunk_size 条申报转换为特征列后向量化求值：
+# 相同的操作数（如 A-B、A/B）在一块申报上只计算一次；单步规则按阈值排序，二分查找得到每条申报满足的阈值前缀
+# （与 ruleDAG.ThresholdIndex 相同）；多步规则按所用操作数分组，组内规则的阈值排成矩阵一次比较
+# 内存占用只与规则分片大小、块大小和操作数个数有关，与申报总数无关，命中对边算边写入文件
+# python backtest.py --rules data/rules.bin --declarations data/declarations.ndjson --output data/backtest --workers 8
+# ==============================
+
+DEFAULT_CHUNK_SIZE = 8192
+# 多步规则组每次比较的“规则数 × 申报数”上限，单步规则组每次展开的命中对上限
+BLOCK_ELEMENTS = 1 << 22
+
+# 稀疏命中矩阵的记录格式：申报行号（在申报文件中的顺序，从0开始）、规则序号（在规则库中的顺序，从0开始）
+HIT_DTYPE = np.dtype([("declaration", "<i8"), ("rule", "<i4")])
+
+# 每条规则的计数：有结果的申报数、缺少特征的申报数、计算出错的申报数、命中数；
+# 有标注时另计有结果的正例、负例数及命中中的正例（真阳性）、负例（误报）数
+COUNTERS = ("evaluated", "missing", "errors", "hits", "positives", "negatives", "true_positives", "false_positives")
+EVALUATED, MISSING, ERRORS, HITS, POSITIVES, NEGATIVES, TRUE_POSITIVES, FALSE_POSITIVES = range(len(COUNTERS))
+
+# 输入为集合或向量（而非数值）的算子；加权算子的第一个特征（权重列表）同样按原值传入
+OBJECT_OPERATORS = {"subset_operator", "cosine_similarity_3d"}
+SET_OPERATORS = {"subset_operator"}
+
+NUMERIC_TYPES = (int, float, bool)
+
+
+def _ratio(A, B):
+    zero = B == 0
+    return np.divide(A, B, out=np.zeros_like(A), where=~zero), zero
+
+
+def _diff_ratio(A, B):
+    zero = B == 0
+    return np.divide(A - B, B, out=np.zeros_like(A), where=~zero) * 100, zero
+
+
+def _variance(A, B):
+    mean = (A + B) / 2
+    return ((A - mean) ** 2 + (B - mean) ** 2) / 2, None
+
+
+# ruleDAG.OPERAND_KERNELS 中各操作数的向量化计算：(操作数, 错误掩码)，计算公式与标量版本一致
+VECTOR_OPERANDS = {
+    "diff": lambda A, B: (A - B, None),
+    "mul": lambda A, B: (A * B, None),
+    "ratio": _ratio,
+    "diff_ratio": _diff_ratio,
+    "mean": lambda A, B: ((A + B) / 2, None),
+    "variance": _variance,
+}
+
+
+# ==============================
+# 一、规则库与申报的读取
+# ==============================
+
+def iter_corpus(path):
+    """按文件顺序产出 (规则序号, 规则ID, 规则类型, 规则状态, 规则结构)，CSV 与列式二进制规则库均可"""
+    if is_rule_corpus(path):
+        corpus = MappedRuleCorpus(path)
+        rule_types = corpus.dictionaries["rule_type"]
+        rule_statuses = corpus.dictionaries["rule_status"]
+        for position, structure in corpus.iter_structures():
+            yield (position, corpus.rule_id_at(position), rule_types[corpus.rule_type[position]],
+                   rule_statuses[corpus.rule_status[position]], structure)
+        return
+    with open(path, newline='', encoding='utf-8') as f:
+        for position, row in enumerate(csv.DictReader(f)):
+            yield position, row["rule_id"], row["rule_type"], row["rule_status"], json.loads(row["rule_structure"])
+
+
+def rule_shard(structure, shards):
+    """按规则引用的属性集合分片，属性集合相同的规则（共用操作数）分到同一进程"""
+    attributes = sorted({attribute for _, step_attributes, _ in structure for attribute in step_attributes})
+    return zlib.crc32("\x1f".join(attributes).encode("utf-8")) % shards
+
+
+def parse_cell(text):
+    """CSV 单元格的取值：空为缺失，数值转换为 int/float，以 [ 或 { 开头的按 JSON 解析，其余保留字符串"""
+    if text is None:
+        return None
+    text = text.strip()
+    if not text:
+        return None
+    if text[0] in "[{":
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def parse_label(value):
+    """标注取值：1/true/是 为正例（有风险），0/false/否 为负例，缺失为 -1"""
+    if value is None or value == "":
+        return -1
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ("true", "yes", "是"):
+            return 1
+        if value in ("false", "no", "否"):
+            return 0
+        value = float(value)
+    return 1 if value else 0
+
+
+class DeclarationChunk:
+    """一块申报：起始行号、申报ID、标注（-1 为无标注）和规则用到的特征，特征列在首次使用时按需转换"""
+
+    def __init__(self, start, ids, labels, columns):
+        self.start = start
+        self.ids = ids
+        self.size = len(ids)
+        self.labels = labels
+        self.labeled = bool(np.any(labels >= 0))
+        self._columns = columns
+        self._numeric = {}
+        self._objects = {}
+
+    @classmethod
+    def from_records(cls, start, records, features, id_field, label_field, textual):
+        """
+        :param records: 申报记录；textual 为 True 时是 CSV 行（取值为字符串），否则是 NDJSON 对象，
+                        特征取自其中的 "risk_features"，没有该字段时整行即特征
+        """
+        ids = []
+        labels = np.empty(len(records), dtype=np.int8)
+        rows = []
+        for i, record in enumerate(records):
+            label = record.get(label_field)
+            if textual:
+                label = parse_cell(label)
+                rows.append(record)
+            else:
+                features_row = record.get("risk_features")
+                rows.append(features_row if isinstance(features_row, dict) else record)
+            declaration_id = record.get(id_field)
+            ids.append(str(start + i) if declaration_id in (None, "") else str(declaration_id))
+            labels[i] = parse_label(label)
+        if textual:
+            columns = {name: [parse_cell(row.get(name)) for row in rows] for name in features}
+        else:
+            columns = {name: [row.get(name) for row in rows] for name in features}
+        return cls(start, ids, labels, columns)
+
+    def numeric(self, name):
+        """数值列：(float64 数组, 缺失掩码, 非数值掩码)，缺失与非数值处为 NaN"""
+        column = self._numeric.get(name)
+        if column is None:
+            raw = self._columns[name]
+            missing = np.fromiter((value is None for value in raw), dtype=bool, count=self.size)
+            values = np.array([value if type(value) in NUMERIC_TYPES else np.nan for value in raw], dtype=np.float64)
+            bad = ~missing & np.fromiter((type(value) not in NUMERIC_TYPES for value in raw), dtype=bool, count=self.size)
+            column = self._numeric[name] = (values, missing, bad)
+        return column
+
+    def objects(self, name, as_set):
+        """原值列：(object 数组, 缺失掩码, 无法转换掩码)；as_set 时数组转换为 frozenset，其他取值记为无法转换"""
+        key = (name, as_set)
+        column = self._objects.get(key)
+        if column is None:
+            raw = self._columns[name]
+            values = np.empty(self.size, dtype=object)
+            missing = np.zeros(self.size, dtype=bool)
+            bad = np.zeros(self.size, dtype=bool)
+            for i, value in enumerate(raw):
+                if value is None:
+                    missing[i] = True
+                elif as_set:
+                    try:
+                        values[i] = frozenset(value) if isinstance(value, (list, tuple, set, frozenset)) else None
+                    except TypeError:
+                        values[i] = None
+                    bad[i] = values[i] is None
+                else:
+                    values[i] = value
+            column = self._objects[key] = (values, missing, bad)
+        return column
+
+
+def iter_declaration_chunks(path, features, chunk_size=DEFAULT_CHUNK_SIZE, id_field="id", label_field="label"):
+    """按块读取申报文件：.csv 按表头读取，其他按 NDJSON（每行一个 JSON 对象）读取"""
+    textual = path.lower().endswith(".csv")
+    with open(path, newline='', encoding='utf-8') as f:
+        records = csv.DictReader(f) if textual else (json.loads(line) for line in f if line.strip())
+        start = 0
+        while True:
+            batch = list(islice(records, chunk_size))
+            if not batch:
+                return
+            yield DeclarationChunk.from_records(start, batch, features, id_field, label_field, textual)
+            start += len(batch)
+
+
+# ==============================
+# 二、回测计划：操作数去重、规则按操作数分组
+# ==============================
+
+class Operand:
+    """一个操作数：算术操作数（如 A-B）与阈值比较；其他算子整体作为 0/1 结果，与阈值 1 比较"""
+    __slots__ = ("feature_names", "arithmetic", "operator_name", "kind", "threshold")
+
+    def __init__(self, feature_names, arithmetic=None, operator_name=None, kind=None, threshold=None):
+        self.feature_names = feature_names
+        self.arithmetic = arithmetic
+        self.operator_name = operator_name
+        self.kind = kind
+        self.threshold = threshold
+
+
+class RuleGroup:
+    """组合方式和操作数都相同的规则：thresholds 为 (规则数, 步骤数) 矩阵；单步规则按阈值升序排列"""
+
+    def __init__(self, combiner_name, operands, rules, thresholds):
+        self.combiner_name = combiner_name
+        self.operands = operands
+        if combiner_name is None:
+            order = np.argsort(thresholds[:, 0], kind="stable")
+            rules, thresholds = rules[order], thresholds[order]
+        self.rules = rules  # 计划内的规则编号
+        self.thresholds = thresholds
+        self.combiner = None if combiner_name is None or combiner_name in CONJUNCTIVE_COMBINERS \
+            else resolve_operator(combiner_name, batch_ops)
+
+
+class BacktestPlan:
+    """一个规则分片的回测计划"""
+
+    def __init__(self):
+        self.operands = []
+        self.rule_indices = []  # 计划内规则编号 -> 规则序号
+        self.invalid = {}  # 无法编译的规则序号 -> 错误信息
+        self.groups = []
+        self._operand_index = {}
+        self._groups = {}  # (组合算子名称, 操作数序号元组) -> ([计划内规则编号], [阈值元组])
+
+    def __len__(self):
+        return len(self.rule_indices)
+
+    @property
+    def features(self):
+        return sorted({name for operand in self.operands for name in operand.feature_names})
+
+    def _operand(self, key, operand):
+        index = self._operand_index.get(key)
+        if index is None:
+            index = self._operand_index[key] = len(self.operands)
+            self.operands.append(operand)
+        return index
+
+    def _step(self, index, rule):
+        operator_name, feature_names, threshold, kind, _ = parse_step(index, rule)
+        if operator_name in OPERAND_KERNELS:
+            if not isinstance(threshold, (int, float)) or isinstance(threshold, bool):
+                raise ValueError(f"第{index + 1}条规则的阈值不是数值: {threshold}")
+            name = OPERAND_KERNELS[operator_name][0]
+            return self._operand((name, feature_names), Operand(feature_names, arithmetic=name)), float(threshold)
+        # 与 RuleDAG 相同：不使用阈值的算子忽略阈值
+        key = (operator_name, feature_names) if kind == "plain" else (operator_name, feature_names, repr(threshold))
+        return self._operand(key, Operand(feature_names, operator_name=operator_name, kind=kind,
+                                          threshold=threshold)), 1.0
+
+    def add_rule(self, rule_index, rules):
+        """加入一条规则（generate_risk_indicator 格式），无法编译时记录到 invalid"""
+        try:
+            combiner_name, _ = parse_combiner(rules)
+            step_rules = rules if combiner_name is None else rules[:-1]
+            steps = [self._step(i, rule) for i, rule in enumerate(step_rules)]
+        except ValueError as e:
+            self.invalid[rule_index] = str(e)
+            return
+        key = (combiner_name, tuple(operand for operand, _ in steps))
+        members, thresholds = self._groups.setdefault(key, ([], []))
+        members.append(len(self.rule_indices))
+        thresholds.append([threshold for _, threshold in steps])
+        self.rule_indices.append(rule_index)
+
+    def finalize(self):
+        """加入全部规则后调用，生成规则组"""
+        self.groups = [RuleGroup(combiner_name, operands, np.array(members, dtype=np.int64),
+                                 np.array(thresholds, dtype=np.float64))
+                       for (combiner_name, operands), (members, thresholds) in self._groups.items()]
+        self._groups = {}
+        self.rule_indices = np.array(self.rule_indices, dtype=np.int64)
+        return self
+
+    # ---------- 求值 ----------
+
+    def _operand_values(self, chunk, operand):
+        """操作数在一块申报上的取值：(float64 数组, 缺失掩码, 错误掩码)"""
+        if operand.arithmetic is not None:
+            columns = [chunk.numeric(name) for name in operand.feature_names]
+            missing = np.logical_or.reduce([column[1] for column in columns])
+            errors = np.logical_or.reduce([column[2] for column in columns])
+            with np.errstate(all="ignore"):
+                values, kernel_errors = VECTOR_OPERANDS[operand.arithmetic](*(column[0] for column in columns))
+            if kernel_errors is not None:
+                errors = errors | kernel_errors
+            return values, missing, errors & ~missing
+
+        columns = []
+        for position, name in enumerate(operand.feature_names):
+            if operand.operator_name in OBJECT_OPERATORS or (operand.kind == "weighted" and position == 0):
+                columns.append(chunk.objects(name, operand.operator_name in SET_OPERATORS))
+            else:
+                columns.append(chunk.numeric(name))
+        missing = np.logical_or.reduce([column[1] for column in columns])
+        errors = np.logical_or.reduce([column[2] for column in columns]) & ~missing
+        values = np.zeros(chunk.size, dtype=np.float64)
+        rows = np.flatnonzero(~(missing | errors))
+        if rows.size:
+            inputs = [column[0][rows] for column in columns]
+            kernel = bind(operand.kind, resolve_operator(operand.operator_name, batch_ops), operand.threshold)
+            try:
+                result, kernel_errors = kernel(inputs)
+            except Exception:
+                result, kernel_errors = self._evaluate_rowwise(operand, inputs, rows.size)
+            values[rows] = result
+            if kernel_errors is not None:
+                errors[rows] |= kernel_errors
+        return values, missing, errors
+
+    @staticmethod
+    def _evaluate_rowwise(operand, inputs, count):
+        """批量算子不接受该列（如取值类型不一致）时逐行调用标量算子，出错的行记为错误"""
+        call = bind(operand.kind, resolve_operator(operand.operator_name), operand.threshold)
+        result = np.zeros(count, dtype=np.int8)
+        errors = np.zeros(count, dtype=bool)
+        for i in range(count):
+            try:
+                result[i] = call([column[i] for column in inputs])
+            except Exception:
+                errors[i] = True
+        return result, errors
+
+    def evaluate_chunk(self, chunk, counts, sink=None):
+        """
+        在一块申报上求值全部规则组
+        :param counts: (规则数, len(COUNTERS)) 的计数数组，按计划内规则编号累加
+        :param sink: sink(申报行号数组, 规则序号数组)，接收命中对，None 表示不输出命中矩阵
+        """
+        cache = {}
+        positive = chunk.labels == 1
+        negative = chunk.labels == 0
+        for group in self.groups:
+            values = []
+            for operand in group.operands:
+                if operand not in cache:
+                    cache[operand] = self._operand_values(chunk, self.operands[operand])
+                values.append(cache[operand])
+            # 与逐条求值一致：按步骤顺序，行在第一个缺少特征或出错的步骤处确定为缺失或错误
+            missing, errors = values[0][1], values[0][2]
+            for value in values[1:]:
+                decided = missing | errors
+                missing = missing | (value[1] & ~decided)
+                errors = errors | (value[2] & ~decided)
+            rows = np.flatnonzero(~(missing | errors))
+            rules = group.rules
+            counts[rules, EVALUATED] += rows.size
+            counts[rules, MISSING] += int(np.count_nonzero(missing))
+            counts[rules, ERRORS] += int(np.count_nonzero(errors))
+            labels = chunk.labels[rows] if chunk.labeled else None
+            if labels is not None:
+                counts[rules, POSITIVES] += int(np.count_nonzero(positive[rows]))
+                counts[rules, NEGATIVES] += int(np.count_nonzero(negative[rows]))
+            if rows.size == 0:
+                continue
+            operand_values = [value[0][rows] for value in values]
+            if group.combiner_name is None:
+                self._evaluate_sorted(group, operand_values[0], rows, labels, chunk.start, counts, sink)
+            else:
+                self._evaluate_matrix(group, operand_values, rows, labels, chunk.start, counts, sink)
+
+    def _evaluate_sorted(self, group, values, rows, labels, start, counts, sink):
+        """单步规则：阈值升序排列，每条申报满足的规则是阈值不超过操作数的前缀"""
+        rule_count = len(group.rules)
+        fired = np.searchsorted(group.thresholds[:, 0], values, side="right")
+        fired[np.isnan(values)] = 0
+
+        def prefix_counts(fired_counts):
+            # 第 j 条规则的命中数 = 前缀长度大于 j 的申报数
+            return np.bincount(fired_counts, minlength=rule_count + 1)[::-1].cumsum()[::-1][1:]
+
+        counts[group.rules, HITS] += prefix_counts(fired)
+        if labels is not None:
+            counts[group.rules, TRUE_POSITIVES] += prefix_counts(fired[labels == 1])
+            counts[group.rules, FALSE_POSITIVES] += prefix_counts(fired[labels == 0])
+        if sink is None:
+            return
+        # 分段展开命中对，每段不超过 BLOCK_ELEMENTS 对
+        step = max(1, BLOCK_ELEMENTS // rule_count)
+        rule_indices = self.rule_indices[group.rules]
+        for offset in range(0, len(rows), step):
+            part = fired[offset:offset + step]
+            total = int(part.sum())
+            if total == 0:
+                continue
+            declarations = np.repeat(rows[offset:offset + step], part) + start
+            positions = np.arange(total) - np.repeat(np.cumsum(part) - part, part)
+            sink(declarations, rule_indices[positions])
+
+    def _evaluate_matrix(self, group, values, rows, labels, start, counts, sink):
+        """多步规则：组内规则分块，阈值矩阵与各操作数逐步比较后按组合算子合并"""
+        block = max(1, BLOCK_ELEMENTS // len(rows))
+        for offset in range(0, len(group.rules), block):
+            thresholds = group.thresholds[offset:offset + block]
+            rules = group.rules[offset:offset + block]
+            masks = [values[i][None, :] >= thresholds[:, i:i + 1] for i in range(len(values))]
+            if group.combiner is None:
+                fired = masks[0]
+                for mask in masks[1:]:
+                    fired &= mask
+            else:
+                fired = group.combiner(*(mask.view(np.int8) for mask in masks)) == 1
+            counts[rules, HITS] += np.count_nonzero(fired, axis=1)
+            if labels is not None:
+                counts[rules, TRUE_POSITIVES] += np.count_nonzero(fired[:, labels == 1], axis=1)
+                counts[rules, FALSE_POSITIVES] += np.count_nonzero(fired[:, labels == 0], axis=1)
+            if sink is not None:
+                rule_positions, columns = np.nonzero(fired)
+                if rule_positions.size:
+                    sink(rows[columns] + start, self.rule_indices[rules[rule_positions]])
+
+
+# ==============================
+# 三、分片执行与结果汇总
+# ==============================
+
+def _selected(rule_type, rule_status, rule_types, rule_statuses):
+    return (rule_types is None or rule_type in rule_types) and (rule_statuses is None or rule_status in rule_statuses)
+
+
+def run_shard(shard, shards, rules_path, declarations_path, output_dir, chunk_size=DEFAULT_CHUNK_SIZE,
+              rule_types=None, rule_statuses=None, id_field="id", label_field="label", write_matrix=True):
+    """
+    在一个规则分片上回测（工作进程中执行）
+    :return: 计划内规则的序号与计数、无法编译的规则及本分片的运行统计
+    """
+    start_time = time.time()
+    plan = BacktestPlan()
+    for rule_index, _, rule_type, rule_status, structure in iter_corpus(rules_path):
+        if _selected(rule_type, rule_status, rule_types, rule_statuses) and rule_shard(structure, shards) == shard:
+            plan.add_rule(rule_index, corpus_rules(structure))
+    plan.finalize()
+    compile_seconds = time.time() - start_time
+
+    counts = np.zeros((len(plan), len(COUNTERS)), dtype=np.int64)
+    hit_part = f"hits-{shard:05d}.bin" if write_matrix else None
+    rows = labeled_rows = pairs = 0
+    hit_file = open(os.path.join(output_dir, hit_part), "wb") if hit_part else None
+    # 申报ID由第一个分片写出，其余分片没有规则时不读取申报文件
+    ids_file = open(os.path.join(output_dir, "declaration_ids.txt"), "w", encoding="utf-8") if shard == 0 else None
+
+    def sink(declarations, rule_indices):
+        nonlocal pairs
+        records = np.empty(len(declarations), dtype=HIT_DTYPE)
+        records["declaration"] = declarations
+        records["rule"] = rule_indices
+        records.tofile(hit_file)
+        pairs += len(records)
+
+    try:
+        if len(plan) or ids_file is not None:
+            for chunk in iter_declaration_chunks(declarations_path, plan.features, chunk_size, id_field, label_field):
+                plan.evaluate_chunk(chunk, counts, sink if hit_file is not None else None)
+                if ids_file is not None:
+                    ids_file.writelines(f"{declaration_id}\n" for declaration_id in chunk.ids)
+                rows += chunk.size
+                labeled_rows += int(np.count_nonzero(chunk.labels >= 0))
+                if rows // 1000000 != (rows - chunk.size) // 1000000:
+                    print(f"分片 {shard}: 已处理 {rows} 条申报", flush=True)
+    finally:
+        for f in (hit_file, ids_file):
+            if f is not None:
+                f.close()
+
+    elapsed = time.time() - start_time
+    return {
+        "shard": shard,
+        "rule_indices": plan.rule_indices,
+        "counts": counts,
+        "invalid": plan.invalid,
+        "stats": {
+            "shard": shard,
+            "rules": len(plan),
+            "invalid_rules": len(plan.invalid),
+            "groups": len(plan.groups),
+            "operands": len(plan.operands),
+            "declarations": rows,
+            "labeled_declarations": labeled_rows,
+            "hits": pairs if write_matrix else int(counts[:, HITS].sum()),
+            "hit_part": hit_part,
+            "compile_seconds": round(compile_seconds, 2),
+            "seconds": round(elapsed, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1)
+        }
+    }
+
+
+def _ratio_or_none(numerator, denominator):
+    return round(numerator / denominator, 6) if denominator else None
+
+
+def write_rule_hits(path, rules_path, rule_indices, counts, invalid, labeled, rule_types=None, rule_statuses=None):
+    """按规则库顺序写出每条规则的计数；rule_indices 为升序的规则序号，counts 与之对应"""
+    fields = ["rule_index", "rule_id", "rule_type", "rule_status"] + list(COUNTERS[:HITS + 1]) + ["hit_rate"]
+    if labeled:
+        fields += list(COUNTERS[HITS + 1:]) + ["precision", "recall", "false_positive_rate"]
+    fields.append("error")
+    cursor = 0
+    with open(path, "w", newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for rule_index, rule_id, rule_type, rule_status, _ in iter_corpus(rules_path):
+            if not _selected(rule_type, rule_status, rule_types, rule_statuses):
+                continue
+            row = [rule_index, rule_id, rule_type, rule_status]
+            if cursor < len(rule_indices) and rule_indices[cursor] == rule_index:
+                c = counts[cursor].tolist()
+                cursor += 1
+                row += c[:HITS + 1] + [_ratio_or_none(c[HITS], c[EVALUATED])]
+                if labeled:
+                    row += c[HITS + 1:] + [_ratio_or_none(c[TRUE_POSITIVES], c[HITS]),
+                                           _ratio_or_none(c[TRUE_POSITIVES], c[POSITIVES]),
+                                           _ratio_or_none(c[FALSE_POSITIVES], c[NEGATIVES])]
+                row.append("")
+            else:
+                row += [""] * (len(fields) - len(row) - 1) + [invalid.get(rule_index, "")]
+            writer.writerow(row)
+
+
+def run_backtest(rules_path, declarations_path, output_dir, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                 rule_types=None, rule_statuses=None, id_field="id", label_field="label", write_matrix=True):
+    """
+    回测规则库并将结果写入 output_dir：
+    rule_hits.csv（每条规则的计数、命中率，有标注时附带精确率、召回率、误报率）、
+    hits-NNNNN.bin（稀疏命中矩阵，每个分片一个文件，记录格式见 HIT_DTYPE）、
+    declaration_ids.txt（申报行号对应的申报ID）、manifest.json（运行统计）
+    :param workers: 工作进程数，即规则分片数；1 表示在当前进程中执行
+    :param rule_types: 只回测这些类型的规则，None 表示全部
+    :param rule_statuses: 只回测这些状态的规则（如 {"测试"}），None 表示全部
+    :return: 运行统计（与 manifest.json 相同）
+    """
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    options = {"chunk_size": chunk_size, "rule_types": rule_types, "rule_statuses": rule_statuses,
+               "id_field": id_field, "label_field": label_field, "write_matrix": write_matrix}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_shard_with_options, range(workers), repeat(workers),
+                                    repeat(rules_path), repeat(declarations_path), repeat(output_dir), repeat(options)))
+    else:
+        results = [run_shard(0, 1, rules_path, declarations_path, output_dir, **options)]
+
+    rule_indices = np.concatenate([result["rule_indices"] for result in results])
+    counts = np.vstack([result["counts"] for result in results])
+    order = np.argsort(rule_indices, kind="stable")
+    rule_indices, counts = rule_indices[order], counts[order]
+    invalid = {}
+    for result in results:
+        invalid.update(result["invalid"])
+    shard_stats = [result["stats"] for result in results]
+    declarations = shard_stats[0]["declarations"]
+    labeled_declarations = shard_stats[0]["labeled_declarations"]
+    write_rule_hits(os.path.join(output_dir, "rule_hits.csv"), rules_path, rule_indices.tolist(), counts, invalid,
+                    labeled_declarations > 0, rule_types, rule_statuses)
+
+    elapsed = time.time() - start_time
+    summary = {
+        "rules_file": rules_path,
+        "declarations_file": declarations_path,
+        "declarations": declarations,
+        "labeled_declarations": labeled_declarations,
+        "rules": len(rule_indices),
+        "invalid_rules": len(invalid),
+        "hits": int(counts[:, HITS].sum()),
+        "workers": workers,
+        "chunk_size": chunk_size,
+        "elapsed_seconds": round(elapsed, 2),
+        "declarations_per_second": round(declarations / elapsed, 1) if elapsed > 0 else None,
+        "rule_evaluations_per_second": round(declarations * len(rule_indices) / elapsed) if elapsed > 0 else None,
+        "hit_matrix": {
+            "dtype": [list(field) for field in HIT_DTYPE.descr],
+            "parts": [stats["hit_part"] for stats in shard_stats if stats["hit_part"]]
+        } if write_matrix else None,
+        "shards": shard_stats
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def _run_shard_with_options(shard, shards, rules_path, declarations_path, output_dir, options):
+    return run_shard(shard, shards, rules_path, declarations_path, output_dir, **options)
+
+
+def iter_hit_matrix(output_dir):
+    """逐个分片产出稀疏命中矩阵（内存映射的结构化数组，字段为 declaration、rule），分片内不保证顺序"""
+    with open(os.path.join(output_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    for part in (manifest["hit_matrix"] or {}).get("parts", []):
+        path = os.path.join(output_dir, part)
+        if os.path.getsize(path):
+            yield np.memmap(path, dtype=HIT_DTYPE, mode="r")
+
+
+def _split_option(value):
+    return set(item for item in value.split(",") if item) if value else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="在历史申报上回测规则库")
+    parser.add_argument("--rules", default="data/rules.csv", help="规则库文件（CSV 或列式二进制）")
+    parser.add_argument("--declarations", required=True,
+                        help="历史申报文件：.csv（表头为特征名称）或 NDJSON（每行一个申报）")
+    parser.add_argument("--output", default="data/backtest", help="输出目录")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数（规则分片数）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每块申报条数")
+    parser.add_argument("--type", default=None, help="只回测这些类型的规则，逗号分隔")
+    parser.add_argument("--status", default=None, help="只回测这些状态的规则，逗号分隔，如 测试")
+    parser.add_argument("--id-field", default="id", help="申报ID字段")
+    parser.add_argument("--label-field", default="label", help="标注字段（1 为确有风险），用于计算误报率")
+    parser.add_argument("--no-matrix", action="store_true", help="只统计命中数，不输出稀疏命中矩阵")
+    args = parser.parse_args()
+
+    summary = run_backtest(args.rules, args.declarations, args.output, args.workers, args.chunk_size,
+                           _split_option(args.type), _split_option(args.status), args.id_field, args.label_field,
+                           not args.no_matrix)
+    summary.pop("shards")
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
@@ -0,0 +1,197 @@
+import numpy as np
+
+# ==============================
+# 批量算子：与 operators.py 同名同语义，输入为特征列，输出为 0/1 掩码
+# 属性算子返回 (结果掩码, 错误掩码)，错误掩码为 None 表示该算子不会出错；
+# 标量版本抛出 ValueError 的行（如除数为0）在错误掩码中标记为 True，结果记为 0
+# 逻辑算子只返回结果掩码
+# ==============================
+
+def _num(col):
+    """将特征列转换为 float64 数组"""
+    return np.asarray(col, dtype=np.float64)
+
+def _mask(cond):
+    return cond.astype(np.int8)
+
+def _bits(col):
+    return np.asarray(col) == 1
+
+def _vectors(col, dim):
+    """将每行一个向量的特征列转换为 (n, dim) 数组，维数不符的行记为错误"""
+    try:
+        arr = np.asarray(col, dtype=np.float64)
+    except ValueError:
+        arr = None  # 各行长度不一
+    if arr is not None and arr.ndim == 2:
+        if arr.shape[1] == dim:
+            return arr, None
+        return np.zeros((arr.shape[0], dim)), np.ones(arr.shape[0], dtype=bool)
+    n = len(col)
+    out = np.zeros((n, dim))
+    bad = np.zeros(n, dtype=bool)
+    for i, vec in enumerate(col):
+        if len(vec) == dim:
+            out[i] = vec
+        else:
+            bad[i] = True
+    return out, bad
+
+# ==============================
+# 一、属性算子
+# ==============================
+
+def cmp_operator(A, B):
+    """大小比较算子：A >= B"""
+    return _mask(_num(A) >= _num(B)), None
+
+def diff_operator(A, B, threshold):
+    """差值算子：A-B >= threshold"""
+    return _mask((_num(A) - _num(B)) >= threshold), None
+
+def mul_operator(A, B, threshold):
+    """乘法算子：A*B >= threshold"""
+    return _mask((_num(A) * _num(B)) >= threshold), None
+
+def ratio_operator(A, B, threshold):
+    """比值算子：A/B >= threshold，B为0的行记为错误"""
+    A, B = _num(A), _num(B)
+    zero = B == 0
+    ratio = np.divide(A, B, out=np.zeros_like(A), where=~zero)
+    return _mask((ratio >= threshold) & ~zero), zero
+
+def diff_ratio_operator(A, B, threshold):
+    """差分比率算子：(A-B)/B*100% >= threshold，B为0的行记为错误"""
+    A, B = _num(A), _num(B)
+    zero = B == 0
+    ratio = np.divide(A - B, B, out=np.zeros_like(A), where=~zero) * 100
+    return _mask((ratio >= threshold) & ~zero), zero
+
+def subset_operator(A, B):
+    """子集判断算子：A是B的子集"""
+    return np.fromiter((a.issubset(b) for a, b in zip(A, B)), dtype=np.int8, count=len(A)), None
+
+def avg_operator(A, B, threshold):
+    """均值算子：(A+B)/2 >= threshold"""
+    return _mask((_num(A) + _num(B)) / 2 >= threshold), None
+
+def var_operator(A, B, threshold):
+    """方差算子：两个值的方差 >= threshold"""
+    A, B = _num(A), _num(B)
+    mean = (A + B) / 2
+    variance = ((A - mean) ** 2 + (B - mean) ** 2) / 2
+    return _mask(variance >= threshold), None
+
+def euclidean_distance_2d(x1, y1, x2, y2, threshold):
+    """二维欧几里得距离算子：距离 >= threshold"""
+    distance = np.hypot(_num(x2) - _num(x1), _num(y2) - _num(y1))
+    return _mask(distance >= threshold), None
+
+def weighted_avg_operator(weights, values, threshold):
+    """加权组合算子：加权和 >= threshold，权重个数与特征值个数不一致的行记为错误"""
+    W, bad = _vectors(weights, len(values))
+    V = np.column_stack([_num(v) for v in values]) if values else np.zeros((len(W), 0))
+    weighted_sum = (W * V).sum(axis=1)
+    if bad is None:
+        return _mask(weighted_sum >= threshold), None
+    return _mask((weighted_sum >= threshold) & ~bad), bad
+
+def cross_deviation_operator(A, B, C, threshold):
+    """交叉偏差算子：|A-B|+|B-C|+|C-A| >= threshold"""
+    A, B, C = _num(A), _num(B), _num(C)
+    deviation = np.abs(A - B) + np.abs(B - C) + np.abs(C - A)
+    return _mask(deviation >= threshold), None
+
+def multivariate_var_operator(A, B, C, threshold):
+    """多变量方差算子：三个值的方差 >= threshold"""
+    A, B, C = _num(A), _num(B), _num(C)
+    mean = (A + B + C) / 3
+    variance = ((A - mean) ** 2 + (B - mean) ** 2 + (C - mean) ** 2) / 3
+    return _mask(variance >= threshold), None
+
+def euclidean_distance_3d(x1, y1, z1, x2, y2, z2, threshold):
+    """三维欧几里得距离算子：距离 >= threshold"""
+    distance = np.sqrt((_num(x2) - _num(x1)) ** 2 + (_num(y2) - _num(y1)) ** 2 + (_num(z2) - _num(z1)) ** 2)
+    return _mask(distance >= threshold), None
+
+def joint_probability_operator(P_A, P_B_given_A, P_C_given_AB, threshold):
+    """联合概率算子：P(A)*P(B|A)*P(C|AB) >= threshold"""
+    joint_prob = _num(P_A) * _num(P_B_given_A) * _num(P_C_given_AB)
+    return _mask(joint_prob >= threshold), None
+
+def cosine_similarity_3d(A, B, threshold):
+    """三维余弦相似性算子：余弦相似度 >= threshold，零向量相似度为0，非三维向量的行记为错误"""
+    VA, bad_a = _vectors(A, 3)
+    VB, bad_b = _vectors(B, 3)
+    dot_product = (VA * VB).sum(axis=1)
+    norms = np.sqrt((VA ** 2).sum(axis=1)) * np.sqrt((VB ** 2).sum(axis=1))
+    nonzero = norms != 0
+    cos_sim = np.divide(dot_product, norms, out=np.zeros_like(dot_product), where=nonzero)
+    result = (cos_sim >= threshold) & nonzero
+    if bad_a is None and bad_b is None:
+        return _mask(result), None
+    bad = np.zeros(len(VA), dtype=bool)
+    for b in (bad_a, bad_b):
+        if b is not None:
+            bad |= b
+    return _mask(result & ~bad), bad
+
+# ==============================
+# 二、二元异常指标算子
+# ==============================
+
+def and_operator(A, B):
+    """逻辑与算子"""
+    return _mask(_bits(A) & _bits(B))
+
+def or_operator(A, B):
+    """逻辑或算子"""
+    return _mask(_bits(A) | _bits(B))
+
+def xor_operator(A, B):
+    """逻辑异或算子"""
+    return _mask(np.asarray(A) != np.asarray(B))
+
+def implication_operator(A, B):
+    """逻辑蕴含算子：¬A∨B"""
+    return _mask(~(_bits(A) & (np.asarray(B) == 0)))
+
+def nand_operator(A, B):
+    """逻辑与非算子：¬(A∧B)"""
+    return _mask(~(_bits(A) & _bits(B)))
+
+def nor_operator(A, B):
+    """逻辑或非算子：A和B均为0"""
+    return _mask((np.asarray(A) == 0) & (np.asarray(B) == 0))
+
+def equivalence_operator(A, B):
+    """逻辑等价算子：A≡B"""
+    return _mask(np.asarray(A) == np.asarray(B))
+
+# ==============================
+# 三、三元异常指标算子
+# ==============================
+
+def and3_operator(A, B, C):
+    """三元逻辑与算子"""
+    return _mask(_bits(A) & _bits(B) & _bits(C))
+
+def or3_operator(A, B, C):
+    """三元逻辑或算子"""
+    return _mask(_bits(A) | _bits(B) | _bits(C))
+
+def xor3_operator(A, B, C):
+    """三元逻辑异或算子：奇数个1"""
+    return _mask((np.asarray(A) + np.asarray(B) + np.asarray(C)) % 2 == 1)
+
+def implication3_operator(A, B, C):
+    """三元逻辑蕴含算子：¬(A∧B∧¬C)"""
+    return _mask(~(_bits(A) & _bits(B) & (np.asarray(C) == 0)))
+
+# ==============================
+# 四、一元异常指标算子
+# ==============================
+
+def not_operator(A):
+    """逻辑非算子"""
+    return _mask(np.asarray(A) == 0)
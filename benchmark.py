@@ -0,0 +1,291 @@
+import argparse
+import contextlib
+import gc
+import inspect
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import operators as ops
+from ruleStore import peak_rss_mb
+
+# ==============================
+# 性能基准测试：算子微基准、generate_risk_indicator 吞吐与延迟、/explain_risk 端到端延迟（大模型替换为桩）
+# 结果输出为 JSON（每秒次数、p50/p95/p99 延迟、峰值常驻内存），可用 --compare 与另一版本的结果对比
+# python benchmark.py --output bench.json
+# python benchmark.py --quick --compare bench.json
+# ==============================
+
+# 每个算子的基准输入
+OPERATOR_ARGS = {
+    "cmp_operator": (55, 50),
+    "diff_operator": (55, 50, 0),
+    "mul_operator": (55, 50, 1000),
+    "ratio_operator": (100, 80, 1.2),
+    "diff_ratio_operator": (100, 80, 10),
+    "subset_operator": ({"化学试剂"}, {"化学试剂", "危险化学品"}),
+    "avg_operator": (55, 50, 40),
+    "var_operator": (55, 50, 3),
+    "euclidean_distance_2d": (0, 0, 3, 4, 5),
+    "weighted_avg_operator": ([0.2, 0.3, 0.5], [1, 2, 3], 2),
+    "cross_deviation_operator": (1, 2, 4, 5),
+    "multivariate_var_operator": (1, 2, 4, 1),
+    "euclidean_distance_3d": (0, 0, 0, 1, 2, 2, 3),
+    "joint_probability_operator": (0.5, 0.4, 0.3, 0.05),
+    "cosine_similarity_3d": ([1, 0, 0], [1, 1, 0], 0.5),
+    "and_operator": (1, 0),
+    "or_operator": (1, 0),
+    "xor_operator": (1, 0),
+    "implication_operator": (1, 0),
+    "nand_operator": (1, 0),
+    "nor_operator": (1, 0),
+    "equivalence_operator": (1, 0),
+    "and3_operator": (1, 1, 0),
+    "or3_operator": (1, 1, 0),
+    "xor3_operator": (1, 1, 0),
+    "implication3_operator": (1, 1, 0),
+    "not_operator": (1,),
+}
+
+# 规则规模：单步、二元（两步 + 与）、三元（三步 + 三元与）
+RULE_SETS = {
+    "single": [
+        ["diff_operator", ["申报重量", "限重"], 0],
+    ],
+    "binary": [
+        ["diff_operator", ["申报重量", "限重"], 0],
+        ["ratio_operator", ["申报价格", "参考价格"], 1.2],
+        ["and_operator", [], None],
+    ],
+    "ternary": [
+        ["diff_operator", ["申报重量", "限重"], 0],
+        ["ratio_operator", ["申报价格", "参考价格"], 1.2],
+        ["var_operator", ["净重", "毛重"], 3],
+        ["and3_operator", [], None],
+    ],
+}
+BASE_FEATURES = {"申报重量": 55, "限重": 50, "申报价格": 100, "参考价格": 80, "净重": 48, "毛重": 52}
+FEATURE_COUNTS = (6, 32, 128)
+
+
+def percentile(sorted_samples, q):
+    """已排序样本的 q 分位数（线性插值）"""
+    if not sorted_samples:
+        return 0.0
+    position = (len(sorted_samples) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (position - lower)
+
+
+def measure(func, iterations, warmup=None):
+    """
+    测量 func() 的吞吐与单次延迟
+    吞吐按连续调用 iterations 次的总耗时计算（不含计时开销），延迟逐次计时后取分位数
+    :return: {"iterations", "ops_per_sec", "mean_us", "p50_us", "p95_us", "p99_us"}
+    """
+    for _ in range(warmup if warmup is not None else max(1, iterations // 10)):
+        func()
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+
+        samples = []
+        clock = time.perf_counter_ns
+        for _ in range(iterations):
+            t0 = clock()
+            func()
+            samples.append(clock() - t0)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / elapsed, 1) if elapsed > 0 else None,
+        "mean_us": round(sum(samples) / len(samples) / 1000, 3),
+        "p50_us": round(percentile(samples, 0.50) / 1000, 3),
+        "p95_us": round(percentile(samples, 0.95) / 1000, 3),
+        "p99_us": round(percentile(samples, 0.99) / 1000, 3),
+    }
+
+
+def bench_operators(iterations):
+    """operators.py 中每个算子的微基准"""
+    results = []
+    for name, func in inspect.getmembers(ops, inspect.isfunction):
+        if func.__module__ != ops.__name__:
+            continue
+        args = OPERATOR_ARGS.get(name)
+        if args is None:
+            results.append({"group": "operators", "name": name, "skipped": "没有基准输入"})
+            continue
+        results.append({"group": "operators", "name": name, **measure(lambda: func(*args), iterations)})
+    return results
+
+
+def make_features(count):
+    """包含规则所需特征、总数为 count 的特征字典"""
+    features = dict(BASE_FEATURES)
+    for i in range(count - len(features)):
+        features[f"附加特征{i}"] = i
+    return features
+
+
+def bench_rules(iterations):
+    """generate_risk_indicator 在不同规则规模与特征数量下的吞吐与延迟"""
+    from riskIndicatorDescription import generate_risk_indicator
+
+    results = []
+    for rule_name, rules in RULE_SETS.items():
+        for feature_count in FEATURE_COUNTS:
+            features = make_features(feature_count)
+            results.append({
+                "group": "generate_risk_indicator",
+                "name": f"{rule_name}/features={feature_count}",
+                **measure(lambda: generate_risk_indicator(features, rules), iterations)
+            })
+    return results
+
+
+class _StubResponse:
+    """替代大模型服务响应"""
+    status_code = 200
+
+    def __init__(self, content):
+        self._content = content
+
+    def json(self):
+        return {"choices": [{"message": {"content": self._content}}]}
+
+
+def bench_endpoint(iterations, llm_latency_ms, llm_server=False):
+    """
+    /explain_risk 端到端延迟：Flask 测试客户端 + 大模型桩
+    默认用进程内的桩替换 api.llm_client 的 HTTP 调用，请求仍经过客户端线程池与事件循环；
+    llm_server 为 True 时改为在本进程启动 llmStub.py 的桩服务，包含真实的 HTTP 往返；
+    语义描述缓存替换为容量为0的缓存，每次都调用桩
+    """
+    import api
+    import app as service
+    from explanationCache import ExplanationCache
+    from llmStub import LLMStub, StubConfig
+
+    def stub_post(url, payload, timeout, stream=False):
+        if llm_latency_ms:
+            time.sleep(llm_latency_ms / 1000)
+        return _StubResponse("风险类型：重量风险。风险表现：申报重量超过限重。")
+
+    original_post, original_cache, original_url = api.llm_client._post, service.explanation_cache, service.LLM_URL
+    stub_server = None
+    if llm_server:
+        stub_server = LLMStub(StubConfig(latency_ms=llm_latency_ms)).start()
+        service.LLM_URL = stub_server.url
+    else:
+        api.llm_client._post = stub_post
+    service.explanation_cache = ExplanationCache(maxsize=0)
+    client = service.app.test_client()
+    label = "llm_server" if llm_server else "llm_stub"
+    results = []
+    try:
+        # 接口会打印计算结构与描述，测量期间丢弃标准输出
+        with contextlib.redirect_stdout(io.StringIO()):
+            for rule_name, rules in RULE_SETS.items():
+                # 固定走大模型路径，不使用模板描述
+                body = {"risk_features": make_features(len(BASE_FEATURES)), "rules": rules, "explain_mode": "llm"}
+
+                def call():
+                    response = client.post("/explain_risk", json=body)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"/explain_risk 返回 {response.status_code}: {response.get_data(as_text=True)}")
+
+                results.append({"group": "explain_risk", "name": f"{rule_name}/{label}/llm_latency_ms={llm_latency_ms}",
+                                **measure(call, iterations)})
+    finally:
+        api.llm_client._post = original_post
+        service.explanation_cache = original_cache
+        service.LLM_URL = original_url
+        if stub_server is not None:
+            stub_server.stop()
+    return results
+
+
+def environment():
+    """运行环境信息，便于对比不同版本的结果"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def compare(current, baseline):
+    """按 (group, name) 对比两次结果的每秒次数与 p99 延迟"""
+    previous = {(r["group"], r["name"]): r for r in baseline["results"] if "ops_per_sec" in r}
+    rows = []
+    for result in current["results"]:
+        before = previous.get((result["group"], result["name"]))
+        if before is None or "ops_per_sec" not in result or not before["ops_per_sec"]:
+            continue
+        rows.append({
+            "group": result["group"],
+            "name": result["name"],
+            "ops_per_sec_ratio": round(result["ops_per_sec"] / before["ops_per_sec"], 3),
+            "p99_us_before": before["p99_us"],
+            "p99_us_after": result["p99_us"]
+        })
+    return rows
+
+
+def run(groups, quick=False, llm_latency_ms=0, llm_server=False):
+    scale = 10 if quick else 1
+    results = []
+    if "operators" in groups:
+        results += bench_operators(200000 // scale)
+    if "rules" in groups:
+        results += bench_rules(20000 // scale)
+    if "endpoint" in groups:
+        results += bench_endpoint(2000 // scale, llm_latency_ms, llm_server)
+    return {"environment": environment(), "results": results, "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="性能基准测试")
+    parser.add_argument("--only", default="operators,rules,endpoint",
+                        help="要运行的基准组，逗号分隔：operators, rules, endpoint")
+    parser.add_argument("--quick", action="store_true", help="迭代次数减为十分之一")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="大模型桩的固定响应延迟（毫秒）")
+    parser.add_argument("--llm-server", action="store_true", help="端到端基准改用 llmStub.py 的本地桩服务（含 HTTP 往返）")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果 JSON 对比")
+    args = parser.parse_args()
+
+    report = run(set(args.only.split(",")), args.quick, args.llm_latency_ms, args.llm_server)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"结果已保存到 {args.output}", file=sys.stderr)
+    else:
+        print(output)
@@ -1,7 +1,11 @@
+import argparse
 import csv
+import os
 import random
+import shutil
 import time
 import json
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
 # 分类定义海关相关的属性字段，并分组相关属性
@@ -127,63 +131,99 @@ rule_types = ["重量风险", "价格风险", "品类风险", "产地风险", "
 rule_statuses = ["启用", "禁用", "测试"]
 operators = ["管理员", "系统", "审核员", "专家"]
 
+# 规则描述
+rule_descriptions = {
+    "重量风险": "检测货物的申报重量与限重关系，防止超重申报或低报重量",
+    "价格风险": "检测货物的申报价格与市场参考价格偏差，防止低报或高报价格",
+    "品类风险": "检测货物品类与申报是否一致，防止伪报品名或瞒报品类",
+    "产地风险": "检测货物原产国与申报是否一致，防止伪报产地逃避关税",
+    "企业信用风险": "检测货物申报企业的信用等级和历史违规情况，评估企业风险",
+    "税收风险": "检测货物的关税、增值税和消费税申报准确性，防止偷逃税款",
+    "检疫风险": "检测货物是否符合检疫要求和许可证要求，防止疫情传播",
+    "数量风险": "检测货物申报数量与实际数量的一致性，防止瞒报或少报",
+    "时间风险": "检测货物生产日期、有效期和清关时限，防止过期或违规"
+}
+
+# 每种规则类型最相关的属性组
+rule_type_groups = {
+    "重量风险": "weight_related",
+    "价格风险": "price_related",
+    "品类风险": "goods_related",
+    "产地风险": "location_related",
+    "企业信用风险": "enterprise_related",
+    "税收风险": "tax_related",
+    "数量风险": "quantity_related",
+    "时间风险": "time_related",
+    "检疫风险": "process_related"
+}
+
+# 每种规则类型的基础算子
+rule_type_operators = {
+    "重量风险": ["diff_operator", "comparison_operator", "ratio_operator"],
+    "价格风险": ["ratio_operator", "comparison_operator", "multiplication_operator", "mean_operator"],
+    "品类风险": ["subset_judgment_operator", "joint_probability_operator"],
+    "产地风险": ["subset_judgment_operator", "joint_probability_operator"],
+    "企业信用风险": ["comparison_operator", "variance_operator"],
+    "税收风险": ["ratio_operator", "comparison_operator", "multiplication_operator"],
+    "数量风险": ["diff_operator", "comparison_operator", "ratio_operator"],
+    "时间风险": ["comparison_operator", "diff_operator"],
+    "检疫风险": ["subset_judgment_operator", "joint_probability_operator"]
+}
+
+# 属性组名称 -> 组内属性
+group_attributes = {**numeric_attribute_groups, **categorical_attribute_groups}
+
+# 预先计算 (算子, 规则类型) -> 首选兼容组，没有首选组时使用所有兼容组
+preferred_compatible_groups = {}
+for _operator_key, _op_info in operators_info.items():
+    for _rule_type, _group_key in rule_type_groups.items():
+        _compatible_groups = _op_info.get("compatible_groups", [])
+        preferred_compatible_groups[_operator_key, _rule_type] = \
+            [g for g in _compatible_groups if _group_key in g] or _compatible_groups
+
+# 指定种子时使用固定的基础时间戳（2024-01-01 00:00:00 UTC），保证输出可复现
+SEEDED_BASE_TIME = 1704067200
+
+CSV_FIELDNAMES = [
+    "rule_id", "rule_name", "rule_description", "rule_type", "rule_status",
+    "rule_structure", "calculation_method",
+    "created_time", "updated_time", "operator"
+]
+
 
 # 根据算子类型和规则类型选择兼容的属性，确保不重复
-def select_compatible_attributes(operator_key, rule_type, used_attributes):
+def select_compatible_attributes(operator_key, rule_type, used_attributes, rng=random):
     op_info = operators_info[operator_key]
-    compatible_groups = op_info.get("compatible_groups", [])
 
-    if not compatible_groups:
+    if not op_info.get("compatible_groups"):
         # 如果没有定义兼容组，则回退到随机选择
-        return select_attributes_by_type(op_info["attribute_types"], used_attributes)
+        return select_attributes_by_type(op_info["attribute_types"], used_attributes, rng)
 
     # 根据规则类型选择最相关的属性组
-    if rule_type == "重量风险":
-        preferred_groups = [g for g in compatible_groups if "weight_related" in g]
-    elif rule_type == "价格风险":
-        preferred_groups = [g for g in compatible_groups if "price_related" in g]
-    elif rule_type == "品类风险":
-        preferred_groups = [g for g in compatible_groups if "goods_related" in g]
-    elif rule_type == "产地风险":
-        preferred_groups = [g for g in compatible_groups if "location_related" in g]
-    elif rule_type == "企业信用风险":
-        preferred_groups = [g for g in compatible_groups if "enterprise_related" in g]
-    elif rule_type == "税收风险":
-        preferred_groups = [g for g in compatible_groups if "tax_related" in g]
-    elif rule_type == "数量风险":
-        preferred_groups = [g for g in compatible_groups if "quantity_related" in g]
-    elif rule_type == "时间风险":
-        preferred_groups = [g for g in compatible_groups if "time_related" in g]
-    else:  # 检疫风险
-        preferred_groups = [g for g in compatible_groups if "process_related" in g]
-
-    # 如果没有找到首选组，使用所有兼容组
-    if not preferred_groups:
-        preferred_groups = compatible_groups
+    preferred_groups = preferred_compatible_groups[operator_key, rule_type]
 
     # 尝试多次找到不重复的属性组合
     max_attempts = 10
     for attempt in range(max_attempts):
         # 随机选择一个兼容组
-        selected_group_pair = random.choice(preferred_groups)
+        selected_group_pair = rng.choice(preferred_groups)
 
         # 从每个组中选择一个属性
         selected_attributes = []
         for group_key in selected_group_pair:
-            group_attributes = []
-            if group_key in numeric_attribute_groups:
-                group_attributes = numeric_attribute_groups[group_key]
-            elif group_key in categorical_attribute_groups:
-                group_attributes = categorical_attribute_groups[group_key]
+            group_attributes_list = group_attributes.get(group_key, [])
 
             # 过滤掉已使用的属性
-            available_attributes = [attr for attr in group_attributes if attr not in used_attributes]
+            if used_attributes:
+                available_attributes = [attr for attr in group_attributes_list if attr not in used_attributes]
+            else:
+                available_attributes = group_attributes_list
 
             if available_attributes:
-                selected_attributes.append(random.choice(available_attributes))
-            elif group_attributes:
+                selected_attributes.append(rng.choice(available_attributes))
+            elif group_attributes_list:
                 # 如果没有可用属性，从整个组中选择
-                selected_attributes.append(random.choice(group_attributes))
+                selected_attributes.append(rng.choice(group_attributes_list))
 
         # 检查是否有重复属性
         if len(selected_attributes) == len(set(selected_attributes)):
@@ -194,57 +234,32 @@ def select_compatible_attributes(operator_key, rule_type, used_attributes):
 
 
 # 根据属性类型选择属性（回退方法），确保不重复
-def select_attributes_by_type(attribute_types, used_attributes):
-    selected_attributes = []
-    for attr_type in attribute_types:
-        if attr_type == "numeric":
-            available_attrs = [attr for attr in numeric_attributes if attr not in used_attributes]
-            if available_attrs:
-                selected_attributes.append(random.choice(available_attrs))
-            else:
-                selected_attributes.append(random.choice(numeric_attributes))
-        elif attr_type == "categorical":
-            available_attrs = [attr for attr in categorical_attributes if attr not in used_attributes]
-            if available_attrs:
-                selected_attributes.append(random.choice(available_attrs))
-            else:
-                selected_attributes.append(random.choice(categorical_attributes))
-
-    # 检查是否有重复属性
-    if len(selected_attributes) != len(set(selected_attributes)):
-        # 如果有重复，重新选择
-        return select_attributes_by_type(attribute_types, used_attributes)
-
-    return selected_attributes
+def select_attributes_by_type(attribute_types, used_attributes, rng=random):
+    while True:
+        selected_attributes = []
+        for attr_type in attribute_types:
+            if attr_type == "numeric":
+                available_attrs = [attr for attr in numeric_attributes if attr not in used_attributes]
+                selected_attributes.append(rng.choice(available_attrs or numeric_attributes))
+            elif attr_type == "categorical":
+                available_attrs = [attr for attr in categorical_attributes if attr not in used_attributes]
+                selected_attributes.append(rng.choice(available_attrs or categorical_attributes))
+
+        # 有重复属性时重新选择
+        if len(selected_attributes) == len(set(selected_attributes)):
+            return selected_attributes
 
 
 # 生成分层规则结构
-def generate_rule_structure(rule_type):
+def generate_rule_structure(rule_type, rng=random):
     # 根据规则类型确定基础算子
-    if rule_type == "重量风险":
-        base_operators = ["diff_operator", "comparison_operator", "ratio_operator"]
-    elif rule_type == "价格风险":
-        base_operators = ["ratio_operator", "comparison_operator", "multiplication_operator", "mean_operator"]
-    elif rule_type == "品类风险":
-        base_operators = ["subset_judgment_operator", "joint_probability_operator"]
-    elif rule_type == "产地风险":
-        base_operators = ["subset_judgment_operator", "joint_probability_operator"]
-    elif rule_type == "企业信用风险":
-        base_operators = ["comparison_operator", "variance_operator"]
-    elif rule_type == "税收风险":
-        base_operators = ["ratio_operator", "comparison_operator", "multiplication_operator"]
-    elif rule_type == "数量风险":
-        base_operators = ["diff_operator", "comparison_operator", "ratio_operator"]
-    elif rule_type == "时间风险":
-        base_operators = ["comparison_operator", "diff_operator"]
-    else:  # 检疫风险
-        base_operators = ["subset_judgment_operator", "joint_probability_operator"]
+    base_operators = rule_type_operators.get(rule_type, rule_type_operators["检疫风险"])
 
     # 确定规则复杂度 (1-3个基础算子)
-    num_base_operators = random.randint(1, min(3, len(base_operators)))
+    num_base_operators = rng.randint(1, min(3, len(base_operators)))
 
     # 选择基础算子
-    selected_operators = random.sample(base_operators, num_base_operators)
+    selected_operators = rng.sample(base_operators, num_base_operators)
 
     # 构建规则结构
     rule_structure = []
@@ -252,11 +267,8 @@ def generate_rule_structure(rule_type):
 
     # 添加基础算子
     for op in selected_operators:
-        op_info = operators_info[op]
-        param_count = op_info["param_count"]
-
         # 选择兼容的属性，确保不重复
-        attributes = select_compatible_attributes(op, rule_type, used_attributes)
+        attributes = select_compatible_attributes(op, rule_type, used_attributes, rng)
 
         if not attributes:
             # 如果找不到合适的属性，跳过这个算子
@@ -267,120 +279,163 @@ def generate_rule_structure(rule_type):
 
         # 设置阈值
         if "diff" in op or "comparison" in op:
-            threshold = round(random.uniform(-100, 100), 2)
+            threshold = round(rng.uniform(-100, 100), 2)
         elif "ratio" in op:
-            threshold = round(random.uniform(0.5, 2.0), 2)
+            threshold = round(rng.uniform(0.5, 2.0), 2)
         elif "subset" in op or "joint" in op:
-            threshold = random.choice([0, 1])
+            threshold = rng.choice([0, 1])
         else:
-            threshold = round(random.uniform(0, 10), 2)
+            threshold = round(rng.uniform(0, 10), 2)
 
         rule_structure.append([op, attributes, threshold])
 
     return rule_structure
 
 
+# 生成一条规则，按 CSV_FIELDNAMES 的顺序返回各列
+def generate_rule_row(i, base_time, rng=random):
+    # 规则ID
+    rule_id = f"CUS_RULE_{i + 1:07d}"
+
+    # 规则类型和名称
+    rule_type = rng.choice(rule_types)
+    rule_name = f"{rule_type}检测规则_{i + 1}"
+
+    # 规则描述
+    rule_description = rule_descriptions.get(rule_type, "海关风险检测规则")
+
+    # 规则状态
+    rule_status = rng.choice(rule_statuses)
+
+    # 生成规则结构
+    rule_structure = generate_rule_structure(rule_type, rng)
+
+    # 如果规则结构为空，重新生成
+    if not rule_structure:
+        rule_structure = generate_rule_structure(rule_type, rng)
+
+    # 如果仍然为空，使用默认结构
+    if not rule_structure:
+        rule_structure = [["comparison_operator", ["申报重量", "限重"], 0]]
+
+    # 计算方法描述
+    calculation_method = f"使用分层规则结构进行{rule_type.lower()}检测，"
+    calculation_method += f"包含{len(rule_structure)}个计算步骤。"
+
+    # 时间戳
+    created_time = base_time + rng.randint(0, 365 * 24 * 60 * 60)
+    updated_time = created_time + rng.randint(0, 30 * 24 * 60 * 60)
+
+    # 操作人
+    operator = rng.choice(operators)
+
+    return [rule_id, rule_name, rule_description, rule_type, rule_status,
+            json.dumps(rule_structure, ensure_ascii=False), calculation_method,
+            created_time, updated_time, operator]
+
+
+# 生成一个分片（规则序号 [start, end)）写入 shard_file，不写表头
+# 每个分片使用由 (种子, 分片序号) 派生的独立随机数生成器，结果与分片由哪个进程执行无关
+def generate_shard(shard_file, shard, start, end, seed, base_time):
+    rng = random.Random(f"{seed}:{shard}") if seed is not None else random.Random()
+    with open(shard_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        for i in range(start, end):
+            writer.writerow(generate_rule_row(i, base_time, rng))
+    return end - start
+
+
 # 生成规则数据
-def generate_rules_data(num_records, output_file):
-    # CSV文件头
-    fieldnames = [
-        "rule_id", "rule_name", "rule_description", "rule_type", "rule_status",
-        "rule_structure", "calculation_method",
-        "created_time", "updated_time", "operator"
-    ]
-
-    # 打开CSV文件准备写入
-    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-
-        # 基础时间戳（一年前）
-        base_time = int(time.time()) - 365 * 24 * 60 * 60
-
-        # 生成每条规则
-        for i in range(num_records):
-            # 规则ID
-            rule_id = f"CUS_RULE_{i + 1:07d}"
-
-            # 规则类型和名称
-            rule_type = random.choice(rule_types)
-            rule_name = f"{rule_type}检测规则_{i + 1}"
-
-            # 规则描述
-            rule_descriptions = {
-                "重量风险": "检测货物的申报重量与限重关系，防止超重申报或低报重量",
-                "价格风险": "检测货物的申报价格与市场参考价格偏差，防止低报或高报价格",
-                "品类风险": "检测货物品类与申报是否一致，防止伪报品名或瞒报品类",
-                "产地风险": "检测货物原产国与申报是否一致，防止伪报产地逃避关税",
-                "企业信用风险": "检测货物申报企业的信用等级和历史违规情况，评估企业风险",
-                "税收风险": "检测货物的关税、增值税和消费税申报准确性，防止偷逃税款",
-                "检疫风险": "检测货物是否符合检疫要求和许可证要求，防止疫情传播",
-                "数量风险": "检测货物申报数量与实际数量的一致性，防止瞒报或少报",
-                "时间风险": "检测货物生产日期、有效期和清关时限，防止过期或违规"
-            }
-            rule_description = rule_descriptions.get(rule_type, "海关风险检测规则")
-
-            # 规则状态
-            rule_status = random.choice(rule_statuses)
-
-            # 生成规则结构
-            rule_structure = generate_rule_structure(rule_type)
-
-            # 如果规则结构为空，重新生成
-            if not rule_structure:
-                rule_structure = generate_rule_structure(rule_type)
-
-            # 如果仍然为空，使用默认结构
-            if not rule_structure:
-                rule_structure = [["comparison_operator", ["申报重量", "限重"], 0]]
-
-            # 计算方法描述
-            calculation_method = f"使用分层规则结构进行{rule_type.lower()}检测，"
-            calculation_method += f"包含{len(rule_structure)}个计算步骤。"
-
-            # 时间戳
-            created_time = base_time + random.randint(0, 365 * 24 * 60 * 60)
-            updated_time = created_time + random.randint(0, 30 * 24 * 60 * 60)
-
-            # 操作人
-            operator = random.choice(operators)
-
-            # 写入一行数据
-            writer.writerow({
-                "rule_id": rule_id,
-                "rule_name": rule_name,
-                "rule_description": rule_description,
-                "rule_type": rule_type,
-                "rule_status": rule_status,
-                "rule_structure": json.dumps(rule_structure, ensure_ascii=False),
-                "calculation_method": calculation_method,
-                "created_time": created_time,
-                "updated_time": updated_time,
-                "operator": operator
-            })
-
-            # 每生成10000条输出进度
-            if (i + 1) % 10000 == 0:
-                print(f"已生成 {i + 1} 条规则")
+def generate_rules_data(num_records, output_file, workers=1, seed=None, chunk_size=100000):
+    """
+    :param num_records: 规则条数
+    :param output_file: 输出 CSV 文件
+    :param workers: 并行进程数，1 表示在当前进程中依次生成
+    :param seed: 随机种子，相同种子与分片大小生成相同的数据（与进程数无关），None 表示不固定
+    :param chunk_size: 每个分片的规则条数
+    :return: 每秒生成的规则条数
+    """
+    start_time = time.time()
+
+    # 基础时间戳（一年前）
+    base_time = SEEDED_BASE_TIME if seed is not None else int(time.time()) - 365 * 24 * 60 * 60
+
+    shards = [(f"{output_file}.part{shard:05d}", shard, start, min(start + chunk_size, num_records), seed, base_time)
+              for shard, start in enumerate(range(0, num_records, chunk_size))]
 
+    generated = 0
+    try:
+        if workers > 1 and len(shards) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for count in pool.map(generate_shard, *zip(*shards)):
+                    generated += count
+                    print(f"已生成 {generated} 条规则")
+        else:
+            for shard in shards:
+                generated += generate_shard(*shard)
+                print(f"已生成 {generated} 条规则")
+
+        # 按分片顺序合并
+        with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+            csv.writer(csvfile).writerow(CSV_FIELDNAMES)
+            for shard in shards:
+                with open(shard[0], newline='', encoding='utf-8') as part:
+                    shutil.copyfileobj(part, csvfile)
+    finally:
+        for shard in shards:
+            if os.path.exists(shard[0]):
+                os.remove(shard[0])
+
+    elapsed = time.time() - start_time
+    records_per_second = num_records / elapsed if elapsed > 0 else 0.0
     print(f"数据生成完成，已保存到 {output_file}")
+    print(f"生成速度: {records_per_second:.0f} 条/秒（{workers} 个进程）")
+    return records_per_second
+
+
+# 将 CSV 规则库导出为列式二进制格式（见 ruleCorpus.py），服务可内存映射加载
+def export_binary(csv_file, binary_file):
+    from ruleCorpus import write_rule_corpus
+
+    start_time = time.time()
+    with open(csv_file, newline='', encoding='utf-8') as csvfile:
+        count = write_rule_corpus(csv.DictReader(csvfile), binary_file)
+    print(f"已导出 {count} 条规则到 {binary_file}，耗时 {time.time() - start_time:.2f} 秒，"
+          f"文件大小 {os.path.getsize(binary_file) / 1024 / 1024:.2f} MB")
+    return count
 
 
 # 主程序
 if __name__ == "__main__":
-    num_records = 1000000  # 100万条记录
-    output_file = "data/rules.csv"
+    parser = argparse.ArgumentParser(description="生成海关风险预警规则数据")
+    parser.add_argument("--num", type=int, default=1000000, help="规则条数，默认100万条")
+    parser.add_argument("--output", default="data/rules.csv", help="输出 CSV 文件")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程数")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，指定后输出可复现")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="每个分片的规则条数")
+    parser.add_argument("--binary", default=None, help="同时导出列式二进制规则库（如 data/rules.bin）")
+    parser.add_argument("--export-only", action="store_true", help="不重新生成，只将已有的 --output 导出到 --binary")
+    args = parser.parse_args()
+
+    if args.export_only:
+        if not args.binary:
+            parser.error("--export-only 需要同时指定 --binary")
+        export_binary(args.output, args.binary)
+        raise SystemExit(0)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
 
     print("开始生成海关风险预警规则数据...")
     start_time = time.time()
 
-    generate_rules_data(num_records, output_file)
+    generate_rules_data(args.num, args.output, args.workers, args.seed, args.chunk_size)
 
     end_time = time.time()
     print(f"总耗时: {end_time - start_time:.2f} 秒")
 
     # 显示文件大小
-    import os
+    file_size = os.path.getsize(args.output)
+    print(f"生成文件大小: {file_size / 1024 / 1024:.2f} MB")
 
-    file_size = os.path.getsize(output_file)
-    print(f"生成文件大小: {file_size / 1024 / 1024:.2f} MB")
\ No newline at end of file
+    if args.binary:
+        export_binary(args.output, args.binary)
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+
+from rulePlan import get_plan
+
+# ==============================
+# 增量评估会话：按申报ID保存上次的特征、多维计算结构和语义描述
+# 申报修改部分特征后只重算输入特征有变化的步骤；各步骤结果和最终风险指标都没有翻转时沿用上次的大模型描述
+# ==============================
+
+
+def feature_dependencies(plan):
+    """特征 -> 使用该特征的步骤下标；嵌套规则树（短路求值，步骤是否执行取决于其他步骤）返回 None"""
+    if not hasattr(plan, "reevaluate"):
+        return None
+    dependencies = {}
+    for index, step in enumerate(plan.steps):
+        for name in step.feature_names:
+            dependencies.setdefault(name, []).append(index)
+    return dependencies
+
+
+def changed_features(previous, current):
+    """新增、删除或取值变化的特征名称"""
+    changed = [name for name, value in current.items() if name not in previous or previous[name] != value]
+    changed.extend(name for name in previous if name not in current)
+    return changed
+
+
+class EvaluationSession:
+    """一条申报的评估状态"""
+
+    def __init__(self, declaration_id, rules, rule_type=None, explain=True, explain_mode=None, plan=None):
+        """
+        :param declaration_id: 申报ID
+        :param rules: 风险规则列表（平铺规则或嵌套规则树）
+        :param rule_type: 规则类型，用于模板描述
+        :param explain: 是否生成语义描述
+        :param explain_mode: 语义描述方式（template / llm / auto），None 表示服务默认方式
+        :param plan: 规则的编译计划（如规则库快照中已编译的计划），None 时从计划缓存获取
+        """
+        self.declaration_id = declaration_id
+        self.rules = rules
+        self.rule_type = rule_type
+        self.explain = explain
+        self.explain_mode = explain_mode
+        self.plan = plan if plan is not None else get_plan(rules)
+        self.dependencies = feature_dependencies(self.plan)
+        self.risk_features = {}
+        self.structure = None  # 上次成功计算的多维计算结构，计算出错后为 None
+        self.semantic_description = None
+        self.explanation_source = None
+        self.template_confidence = None
+        self.version = 0
+        self.updated = time.time()
+        self.lock = threading.Lock()  # 同一申报的修改依次处理
+
+    def evaluate(self, risk_features):
+        """
+        用新的特征计算多维计算结构，能增量时只重算受影响的步骤
+        :return: 本次变化：changed_features 变化的特征，recomputed_steps 重算的步骤编号，reused_steps 沿用的步骤数，
+                 flipped_steps 结果翻转的步骤编号，final_flipped 最终风险指标是否翻转，
+                 results_changed 是否需要重新生成语义描述（有翻转或没有可比较的上次结果）
+        """
+        previous = self.structure
+        changed = changed_features(self.risk_features, risk_features)
+        self.risk_features = risk_features
+        self.structure = None
+        self.version += 1
+        self.updated = time.time()
+
+        incremental = previous is not None and self.dependencies is not None
+        if incremental:
+            step_indices = sorted({index for name in changed for index in self.dependencies.get(name, ())})
+            structure = self.plan.reevaluate(risk_features, self.rules, previous, step_indices)
+            recomputed = [self.plan.steps[index].step for index in step_indices]
+            if len(structure["calculation_steps"]) > len(self.plan.steps):
+                recomputed.append(structure["calculation_steps"][-1]["step"])  # 逻辑组合步骤总是重新组合
+        else:
+            structure = self.plan.evaluate(risk_features, self.rules)
+            recomputed = [step["step"] for step in structure["calculation_steps"]]
+        self.structure = structure
+
+        if previous is None:
+            flipped, final_flipped = [], False
+        else:
+            flipped = [current["step"] for current, before in zip(structure["calculation_steps"], previous["calculation_steps"])
+                       if current["result"] != before["result"]]
+            final_flipped = structure["final_risk_indicator"] != previous["final_risk_indicator"]
+        return {
+            "incremental": incremental,
+            "changed_features": changed,
+            "recomputed_steps": recomputed,
+            "reused_steps": len(structure["calculation_steps"]) - len(recomputed),
+            "flipped_steps": flipped,
+            "final_flipped": final_flipped,
+            "results_changed": previous is None or bool(flipped) or final_flipped
+        }
+
+    def set_explanation(self, semantic_description, explanation_source, template_confidence):
+        self.semantic_description = semantic_description
+        self.explanation_source = explanation_source
+        self.template_confidence = template_confidence
+
+    def clear_explanation(self):
+        self.set_explanation(None, None, None)
+
+    def to_dict(self):
+        return {
+            "declaration_id": self.declaration_id,
+            "version": self.version,
+            "updated": self.updated,
+            "risk_features": self.risk_features,
+            "multi_dimensional_structure": self.structure,
+            "semantic_description": self.semantic_description,
+            "explanation_source": self.explanation_source,
+            "template_confidence": self.template_confidence
+        }
+
+
+class EvaluationSessions:
+    """按申报ID保存评估会话，超过 maxsize 时淘汰最久未访问的会话，超过 ttl 秒未更新的会话过期"""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        """
+        :param maxsize: 会话数上限
+        :param ttl: 会话过期时间（秒），None 表示不过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+        self.updates = 0
+        self.incremental_updates = 0
+        self.steps_recomputed = 0
+        self.steps_reused = 0
+        self.explanations_reused = 0
+
+    def _expired(self, session, now):
+        return self.ttl is not None and now - session.updated > self.ttl
+
+    def create(self, declaration_id, rules, rule_type=None, explain=True, explain_mode=None, plan=None):
+        """创建会话，已有同ID的会话时替换"""
+        session = EvaluationSession(declaration_id, rules, rule_type, explain, explain_mode, plan)
+        with self._lock:
+            self._sessions[declaration_id] = session
+            self._sessions.move_to_end(declaration_id)
+            self.created += 1
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session
+
+    def get(self, declaration_id):
+        """查找会话，不存在或已过期返回 None"""
+        with self._lock:
+            session = self._sessions.get(declaration_id)
+            if session is None:
+                return None
+            if self._expired(session, time.time()):
+                del self._sessions[declaration_id]
+                self.expired += 1
+                return None
+            self._sessions.move_to_end(declaration_id)
+            return session
+
+    def remove(self, declaration_id):
+        with self._lock:
+            return self._sessions.pop(declaration_id, None) is not None
+
+    def record(self, changes, explanation_reused=False):
+        """记录一次评估的增量统计"""
+        with self._lock:
+            self.updates += 1
+            self.incremental_updates += changes["incremental"]
+            self.steps_recomputed += len(changes["recomputed_steps"])
+            self.steps_reused += changes["reused_steps"]
+            self.explanations_reused += explanation_reused
+
+    def stats(self):
+        with self._lock:
+            steps = self.steps_recomputed + self.steps_reused
+            return {
+                "size": len(self._sessions),
+                "maxsize": self.maxsize,
+                "created": self.created,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "updates": self.updates,
+                "incremental_updates": self.incremental_updates,
+                "steps_recomputed": self.steps_recomputed,
+                "steps_reused": self.steps_reused,
+                "step_reuse_rate": round(self.steps_reused / steps, 4) if steps else 0.0,
+                "explanations_reused": self.explanations_reused
+            }
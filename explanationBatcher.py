@@ -0,0 +1,234 @@
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+from loguru import logger
+
+import api
+
+# ==============================
+# 语义描述合并调用：短时间窗口内待生成描述的申报合并为一次大模型调用
+# 系统提示与生成要求只发送一次，各申报按编号列出，模型回复按编号拆分回各申报；
+# 回复无法按编号拆分时，该批申报退回逐条调用；大模型调用失败（返回 None）时该批申报的结果均为 None
+# 每组申报的 Future 总会被设置结果或异常，等待方另有超时，不会被永久阻塞
+# ==============================
+
+SYSTEM_PROMPT = "你是专业的风险分析专家，擅长基于多维特征进行风险识别和语义描述。"
+
+BATCH_INSTRUCTIONS = """请按照以下要求分别为每条申报生成语义描述：
+1. 识别风险类型（如：伪瞒报高危风险、运输违规风险、申报异常风险等）
+2. 分析具体的风险表现（基于计算过程中触发的条件）
+3. 评估潜在威胁和影响（对运输安全、环境安全、贸易安全等的威胁）
+4. 提出应对建议（如：立即触发人工查验、许可证溯源、路径核查等）
+
+示例格式：当[具体条件]时，判定为'[风险类型]'。此类风险可能导致[威胁分析]，需[应对建议]。
+
+输出格式：按编号顺序输出，每条申报以单独一行的“### 申报N”开头（N 为申报编号），其后是该申报的语义描述，不要输出其他内容。"""
+
+# 回复中各申报的标题行，如 “### 申报2”、“【申报2】”、“申报2：”
+ITEM_HEADER = re.compile(r"^[ \t]*(?:#{1,6}[ \t]*)?【?申报[ \t]*(\d+)】?[ \t]*[:：]?[ \t]*$", re.MULTILINE)
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文字符按每字一个 token，其余字符按每4个一个 token"""
+    wide = sum(1 for char in text if ord(char) > 0x2E7F)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def describe_item(number, risk_features, multi_dimensional_structure):
+    """提示词中单条申报的内容：原始风险特征、计算过程和最终风险指标"""
+    calculation_process = "".join(f"步骤{step['step']}: {step['description']}\n"
+                                  for step in multi_dimensional_structure["calculation_steps"])
+    return (f"【申报{number}】\n"
+            f"原始风险特征：{risk_features}\n"
+            f"计算过程：\n{calculation_process}"
+            f"最终风险指标：{multi_dimensional_structure['final_risk_indicator']}\n")
+
+
+def build_batch_messages(items):
+    """
+    构建合并后的对话消息
+    :param items: [(风险特征, 多维计算结构), ...]，编号从1开始
+    """
+    body = "\n".join(describe_item(i + 1, risk_features, structure) for i, (risk_features, structure) in enumerate(items))
+    prompt = f"基于以下{len(items)}条申报的多维风险特征分析，请生成详细的风险语义描述。\n\n{body}\n{BATCH_INSTRUCTIONS}"
+    return [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompt}
+    ]
+
+
+def split_batch_answer(content, count):
+    """
+    按编号拆分合并调用的回复
+    :return: 长度为 count 的描述列表，编号缺失、重复或描述为空时抛出 ValueError
+    """
+    headers = list(ITEM_HEADER.finditer(content))
+    numbers = [int(match.group(1)) for match in headers]
+    if sorted(numbers) != list(range(1, count + 1)):
+        raise ValueError(f"回复中的申报编号 {numbers} 与请求的 {count} 条不符")
+    parts = [None] * count
+    for match, following in zip(headers, headers[1:] + [None]):
+        end = following.start() if following is not None else len(content)
+        text = content[match.end():end].strip()
+        if not text:
+            raise ValueError(f"申报{match.group(1)}的描述为空")
+        parts[int(match.group(1)) - 1] = text
+    return parts
+
+
+class _Pending:
+    __slots__ = ("key", "risk_features", "structure", "tokens", "arrived", "future")
+
+    def __init__(self, key, risk_features, structure, tokens):
+        self.key = key
+        self.risk_features = risk_features
+        self.structure = structure
+        self.tokens = tokens
+        self.arrived = time.monotonic()
+        self.future = Future()
+
+
+class ExplanationBatcher:
+    """语义描述合并调用器：收集线程按时间窗口和 token 预算分组，调用线程池执行合并后的大模型调用"""
+
+    def __init__(self, window_ms=20, max_items=8, token_budget=6000, workers=4, chat=None, timeout=600):
+        """
+        :param window_ms: 第一条申报到达后等待其他申报的时间（毫秒）
+        :param max_items: 每次合并调用的申报数上限，达到后立即发出
+        :param token_budget: 合并后提示词的估算 token 上限，达到后立即发出（单条超出时单独调用）
+        :param workers: 并发执行大模型调用的线程数
+        :param chat: chat(url, model, messages) -> 回复文本（失败时为 None），默认 api.chat_with_requests
+        :param timeout: explain 等待结果的上限（秒），应大于大模型调用含重试的最长耗时
+        """
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.token_budget = token_budget
+        self._chat = chat
+        self.timeout = timeout
+        self._base_tokens = estimate_tokens(SYSTEM_PROMPT + BATCH_INSTRUCTIONS) + 30
+        self._pending = []
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="explain-batch")
+        self._stats_lock = threading.Lock()
+        self._stats = {"items": 0, "calls": 0, "batched_calls": 0, "batched_items": 0, "fallbacks": 0,
+                       "prompt_tokens": 0, "prompt_tokens_saved": 0}
+        self._collector = threading.Thread(target=self._collect, name="explain-batch-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, url, model, risk_features, multi_dimensional_structure):
+        """提交一条申报，返回结果为语义描述的 Future"""
+        tokens = estimate_tokens(describe_item(0, risk_features, multi_dimensional_structure))
+        item = _Pending((url, model), risk_features, multi_dimensional_structure, tokens)
+        with self._condition:
+            self._pending.append(item)
+            self._condition.notify()
+        return item.future
+
+    def explain(self, url, model, risk_features, multi_dimensional_structure):
+        """提交并等待语义描述，超过 timeout 秒未完成时返回 None（与大模型调用失败相同）"""
+        future = self.submit(url, model, risk_features, multi_dimensional_structure)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            logger.error(f"合并调用等待超过 {self.timeout} 秒，放弃该申报的语义描述")
+            return None
+
+    def _group_ready(self, items):
+        """同一 (url, model) 的待处理申报已达到条数上限或 token 预算"""
+        return len(items) >= self.max_items or \
+            self._base_tokens + sum(item.tokens for item in items) >= self.token_budget
+
+    def _take_group(self):
+        """取出最早到达的申报及其后同一 (url, model) 的申报，不超过条数上限和 token 预算"""
+        key = self._pending[0].key
+        group, rest, tokens = [], [], self._base_tokens
+        for item in self._pending:
+            if item.key == key and len(group) < self.max_items and (not group or tokens + item.tokens <= self.token_budget):
+                group.append(item)
+                tokens += item.tokens
+            else:
+                rest.append(item)
+        self._pending = rest
+        return group
+
+    def _collect(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                while True:
+                    first = self._pending[0]
+                    remaining = first.arrived + self.window - time.monotonic()
+                    if remaining <= 0 or self._group_ready([item for item in self._pending if item.key == first.key]):
+                        break
+                    self._condition.wait(remaining)
+                group = self._take_group()
+            self._executor.submit(self._run, group)
+
+    def _call(self, url, model, messages):
+        chat = self._chat or api.chat_with_requests
+        return chat(url, model, messages)
+
+    def _record(self, **counts):
+        with self._stats_lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def _run_single(self, item):
+        from riskIndicatorDescription import build_explanation_messages
+
+        url, model = item.key
+        try:
+            messages = build_explanation_messages(item.risk_features, item.structure)
+            self._record(items=1, calls=1, prompt_tokens=sum(estimate_tokens(m["content"]) for m in messages))
+            item.future.set_result(self._call(url, model, messages))
+        except Exception as e:
+            item.future.set_exception(e)
+
+    def _run(self, group):
+        """执行一组申报：单条时直接调用，多条时合并调用并按编号拆分，拆分失败时逐条调用"""
+        group = [item for item in group if item.future.set_running_or_notify_cancel()]
+        if len(group) <= 1:
+            for item in group:
+                self._run_single(item)
+            return
+
+        try:
+            self._run_batch(group)
+        except Exception as e:
+            # 任何意外错误都要结束该组尚未完成的 Future，否则等待方会一直阻塞
+            for item in group:
+                if not item.future.done():
+                    item.future.set_exception(e)
+
+    def _run_batch(self, group):
+        url, model = group[0].key
+        messages = build_batch_messages([(item.risk_features, item.structure) for item in group])
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        self._record(items=len(group), calls=1, batched_calls=1, batched_items=len(group), prompt_tokens=prompt_tokens,
+                     prompt_tokens_saved=(len(group) - 1) * self._base_tokens)
+        content = self._call(url, model, messages)
+        if content is None:
+            # 重试均失败：与逐条调用失败一样返回 None，不再逐条重试
+            for item in group:
+                item.future.set_result(None)
+            return
+        try:
+            if not isinstance(content, str):
+                raise ValueError(f"回复类型错误: {type(content).__name__}")
+            parts = split_batch_answer(content, len(group))
+        except ValueError:
+            self._record(fallbacks=1, items=-len(group), prompt_tokens_saved=-(len(group) - 1) * self._base_tokens)
+            for item in group:
+                self._executor.submit(self._run_single, item)
+            return
+        for item, part in zip(group, parts):
+            item.future.set_result(part)
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._pending)
+        with self._stats_lock:
+            return {**self._stats, "pending": pending}
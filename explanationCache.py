@@ -0,0 +1,144 @@
+import hashlib
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# ==============================
+# 大模型语义描述缓存：按 (规则, 各步骤结果, 按有效数字取整后的特征值) 的规范形式缓存描述
+# 提示词中含有特征原值，描述会引用这些值，因此缓存键总是包含特征值；
+# 按有效数字（相对精度）取整而不是按固定宽度分桶，比值 1.19 与 1.99、价格 10.2 与 10850 都不会落在同一个键下
+# 进程内 LRU/TTL 为第一级，可选的 SQLite 文件为第二级（重启后仍可命中）；读写 SQLite 不持有内存缓存的锁
+# ==============================
+
+# 特征值在缓存键中保留的有效数字位数
+DEFAULT_SIGNIFICANT_DIGITS = 3
+
+
+def _bucket(value, digits):
+    """数值按 digits 位有效数字取整（None 时取原值），其他类型按字符串比较"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return repr(sorted(value, key=repr)) if isinstance(value, (set, frozenset)) else repr(value)
+    if math.isnan(value) or math.isinf(value):
+        return repr(value)
+    if digits is None:
+        return value
+    return float(f"{value:.{digits}g}")
+
+
+def explanation_key(rules, multi_dimensional_structure, risk_features=None, digits=DEFAULT_SIGNIFICANT_DIGITS):
+    """
+    生成缓存键
+    :param rules: 风险规则列表
+    :param multi_dimensional_structure: generate_risk_indicator 的输出
+    :param risk_features: 风险特征字典
+    :param digits: 特征值保留的有效数字位数，None 表示按原值区分
+    """
+    canonical = {
+        "rules": rules,
+        "results": [step["result"] for step in multi_dimensional_structure["calculation_steps"]],
+        "final": multi_dimensional_structure["final_risk_indicator"]
+    }
+    if risk_features is not None:
+        canonical["features"] = sorted((name, _bucket(value, digits)) for name, value in risk_features.items())
+    payload = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=repr)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ExplanationCache:
+    """语义描述两级缓存"""
+
+    def __init__(self, maxsize=10000, ttl=24 * 3600, db_path=None, digits=DEFAULT_SIGNIFICANT_DIGITS):
+        """
+        :param maxsize: 进程内缓存条目上限
+        :param ttl: 过期时间（秒），None 表示不过期
+        :param db_path: SQLite 文件路径，None 表示不启用磁盘缓存
+        :param digits: 特征值保留的有效数字位数，None 表示缓存键包含特征原值
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.digits = digits
+        self._entries = OrderedDict()  # key -> (写入时间, 描述)
+        self._lock = threading.Lock()  # 保护内存缓存与统计
+        self._db_lock = threading.Lock()  # 串行化 SQLite 连接的使用
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS explanations "
+                             "(key TEXT PRIMARY KEY, created REAL NOT NULL, content TEXT NOT NULL)")
+            self._db.commit()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, rules, multi_dimensional_structure, risk_features=None):
+        return explanation_key(rules, multi_dimensional_structure, risk_features, self.digits)
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, created, content):
+        self._entries[key] = (created, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """查找缓存，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._entries[key]
+            if self._db is None:
+                self.misses += 1
+                return None
+
+        with self._db_lock:
+            row = self._db.execute("SELECT created, content FROM explanations WHERE key = ?", (key,)).fetchone()
+        with self._lock:
+            if row is not None and not self._expired(row[0], now):
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[1]
+            self.misses += 1
+            return None
+
+    def set(self, key, content):
+        """写入缓存，空描述（大模型调用失败）不缓存"""
+        if not content:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, content)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("INSERT OR REPLACE INTO explanations (key, created, content) VALUES (?, ?, ?)",
+                                 (key, now, content))
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM explanations")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,195 @@
+import ipaddress
+import json
+import queue
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from loguru import logger
+
+# ==============================
+# 异步语义描述任务：接口先返回计算结构和任务ID，大模型描述由后台线程生成
+# 待处理队列有上限，已完成任务到期后清理，内存占用不随请求量增长
+# 回调地址只允许 http/https，且须在允许的主机列表中（未配置列表时须解析为公网地址），防止借回调访问内网服务；
+# 发送回调时直接连接校验通过的地址（Host 头与 TLS 证书校验仍用原主机名），不再重新解析，避免 DNS 重绑定
+# ==============================
+
+
+class JobQueueFull(Exception):
+    """待处理任务数已达上限"""
+
+
+def resolve_callback_url(callback_url, allowed_hosts=None):
+    """
+    校验回调地址并解析主机，不合法时抛出 ValueError
+    :param allowed_hosts: 允许的主机名集合；None 时主机名解析出的地址须全部为公网地址
+    :return: 校验通过的地址列表（按解析顺序），发送回调时只连接这些地址
+    """
+    if not isinstance(callback_url, str):
+        raise ValueError("callback_url 应为字符串")
+    parts = urlsplit(callback_url)
+    try:
+        parts.port
+    except ValueError:
+        raise ValueError("callback_url 的端口无效") from None
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url 只支持 http/https 地址")
+    host = parts.hostname.lower()
+    if allowed_hosts is not None and host not in allowed_hosts:
+        raise ValueError(f"callback_url 的主机 {host} 不在允许的回调主机列表中")
+    try:
+        addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)))
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f"callback_url 的主机 {host} 无法解析") from None
+    if allowed_hosts is None:
+        for address in addresses:
+            if not ipaddress.ip_address(address.split("%")[0]).is_global:
+                raise ValueError(f"callback_url 的主机 {host} 解析为非公网地址 {address}")
+    return addresses
+
+
+def check_callback_url(callback_url, allowed_hosts=None):
+    """校验回调地址，不合法时抛出 ValueError（见 resolve_callback_url）"""
+    resolve_callback_url(callback_url, allowed_hosts)
+
+
+def post_pinned(callback_url, addresses, payload, timeout):
+    """
+    向回调地址 POST JSON，只连接 addresses 中的地址（依次尝试，连接失败时换下一个），不重新解析主机名、不跟随重定向；
+    Host 头、https 的 SNI 与证书校验仍使用回调地址中的主机名
+    :return: 响应状态码
+    """
+    parts = urlsplit(callback_url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    headers = {"Host": parts.netloc.rsplit("@", 1)[-1], "Content-Type": "application/json"}
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    if https:
+        pool_class = urllib3.HTTPSConnectionPool
+        tls = {"server_hostname": parts.hostname, "assert_hostname": parts.hostname,
+               "cert_reqs": "CERT_REQUIRED", "ca_certs": requests.certs.where()}
+    else:
+        pool_class, tls = urllib3.HTTPConnectionPool, {}
+    error = None
+    for address in addresses:
+        with pool_class(address, port, timeout=urllib3.Timeout(total=timeout), retries=False, **tls) as pool:
+            try:
+                response = pool.urlopen("POST", path, body=body, headers=headers, redirect=False,
+                                        assert_same_host=False)
+            except (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError) as e:
+                error = e
+                continue
+            return response.status
+    raise error
+
+
+class ExplanationJobs:
+    """语义描述后台任务池"""
+
+    def __init__(self, workers=4, max_pending=1000, ttl=600, max_jobs=10000, callback_timeout=5,
+                 callback_hosts=None):
+        """
+        :param workers: 后台线程数
+        :param max_pending: 待处理队列上限，超出时 submit 抛出 JobQueueFull
+        :param ttl: 任务完成后保留的时间（秒），到期后无法再查询
+        :param max_jobs: 保留的任务记录上限，超出时优先清理最早完成的任务
+        :param callback_timeout: 回调请求超时（秒）
+        :param callback_hosts: 允许的回调主机名列表，None 时只允许解析为公网地址的主机
+        """
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.callback_timeout = callback_timeout
+        self.callback_hosts = {host.lower() for host in callback_hosts} if callback_hosts is not None else None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}  # job_id -> 任务记录
+        self._finished = deque()  # (完成时间, job_id)，按完成顺序
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f"explain-job-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, func, *args, callback_url=None):
+        """提交任务，返回任务ID；func(*args) 的返回值作为语义描述；callback_url 不合法时抛出 ValueError"""
+        if callback_url is not None:
+            check_callback_url(callback_url, self.callback_hosts)
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "pending",
+            "created": time.time(),
+            "finished": None,
+            "semantic_description": None,
+            "error": None
+        }
+        with self._lock:
+            self._purge(time.time())
+            if len(self._jobs) >= self.max_jobs:
+                raise JobQueueFull("语义描述任务数已达上限")
+            self._jobs[job_id] = job
+        try:
+            self._queue.put_nowait((job_id, func, args, callback_url))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            raise JobQueueFull("语义描述任务队列已满") from None
+        return job_id
+
+    def get(self, job_id):
+        """查询任务状态，不存在或已过期返回 None"""
+        with self._lock:
+            self._purge(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _purge(self, now):
+        """清理到期的已完成任务（需持有锁），任务数超过上限时提前清理最早完成的任务"""
+        while self._finished and (now - self._finished[0][0] > self.ttl or len(self._jobs) >= self.max_jobs):
+            _, job_id = self._finished.popleft()
+            self._jobs.pop(job_id, None)
+
+    def _work(self):
+        while True:
+            job_id, func, args, callback_url = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job["status"] = "running"
+            try:
+                description = func(*args)
+                update = {"status": "done" if description is not None else "failed",
+                          "semantic_description": description,
+                          "error": None if description is not None else "大模型调用失败"}
+            except Exception as e:
+                update = {"status": "failed", "error": str(e)}
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.update(update)
+                    job["finished"] = time.time()
+                    self._finished.append((job["finished"], job_id))
+                    result = dict(job)
+            self._queue.task_done()
+            if callback_url and job is not None:
+                self._callback(callback_url, result)
+
+    def _callback(self, callback_url, result):
+        try:
+            # 发送前重新解析并校验，地址可能已改为指向内网；之后只连接校验过的地址
+            addresses = resolve_callback_url(callback_url, self.callback_hosts)
+            post_pinned(callback_url, addresses, result, self.callback_timeout)
+        except Exception as e:
+            logger.error(f"Callback {callback_url} for job {result['job_id']} failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+            return {"pending": self._queue.qsize(), "jobs": len(self._jobs), "by_status": statuses}
@@ -0,0 +1,268 @@
+import math
+from collections import Counter
+
+from createRuleData import group_attributes, rule_descriptions, rule_type_groups
+
+# ==============================
+# 模板化语义描述：按算子模板描述各步骤的计算结果，按规则类型模板给出风险类型、潜在威胁和应对建议，
+# 输出格式与大模型提示词中要求的一致（风险类型 / 风险表现 / 潜在威胁 / 应对建议）
+# 风险表现按逻辑算子选取决定最终结果的步骤（如与非触发时为未满足的条件，蕴含未触发时为前件与后件）
+# 规则中含有没有模板的算子、无法解释的逻辑算子，或无法确定规则类型时置信度降低，auto 方式下改为调用大模型
+# 服务（app.py）与命令行流式处理（pipeline.py）共用这里的默认解释方式、置信度阈值和结果摘要
+# ==============================
+
+# 解释方式：template 只用模板；llm 只用大模型；auto 置信度达到阈值时用模板，否则调用大模型
+EXPLAIN_MODES = ("template", "llm", "auto")
+DEFAULT_EXPLAIN_MODE = "auto"
+# auto 方式下模板置信度达到该阈值时使用模板
+TEMPLATE_MIN_CONFIDENCE = 0.8
+
+# 比较类算子：(满足时的关系, 不满足时的关系)，描述为“特征A（取值）关系 特征B（取值）”
+COMPARISON_RELATIONS = {
+    "cmp_operator": ("不低于", "低于"),
+    "subset_operator": ("全部包含于", "不完全包含于"),
+}
+
+# 阈值类算子：(度量名称模板, 度量计算)，度量与阈值比较，模板中 {0}、{1}… 为特征名称
+MEASURE_TEMPLATES = {
+    "diff_operator": ("{0}与{1}的差值", lambda v: v[0] - v[1]),
+    "mul_operator": ("{0}与{1}的乘积", lambda v: v[0] * v[1]),
+    "ratio_operator": ("{0}与{1}的比值", lambda v: v[0] / v[1]),
+    "diff_ratio_operator": ("{0}相对{1}的偏差率(%)", lambda v: (v[0] - v[1]) / v[1] * 100),
+    "avg_operator": ("{0}与{1}的平均值", lambda v: (v[0] + v[1]) / 2),
+    "var_operator": ("{0}与{1}的方差", lambda v: (v[0] - v[1]) ** 2 / 4),
+    "cross_deviation_operator": ("{0}、{1}、{2}的交叉偏差",
+                                 lambda v: abs(v[0] - v[1]) + abs(v[1] - v[2]) + abs(v[2] - v[0])),
+    "multivariate_var_operator": ("{0}、{1}、{2}的方差",
+                                  lambda v: sum((x - sum(v) / 3) ** 2 for x in v) / 3),
+    "euclidean_distance_2d": ("({0}, {1})与({2}, {3})的距离", lambda v: math.hypot(v[2] - v[0], v[3] - v[1])),
+    "euclidean_distance_3d": ("({0}, {1}, {2})与({3}, {4}, {5})的距离",
+                              lambda v: math.dist(v[:3], v[3:])),
+}
+
+# 逻辑算子 -> 选取决定结果的输入：(各输入结果, 结果) -> 输入下标；结果为 None 的输入（被跳过）不选
+COMBINER_RELEVANT_INPUTS = {
+    # 与/或：与结果相同的输入（与触发时全部满足，未触发时未满足的；或相反）
+    **dict.fromkeys(("and_operator", "or_operator", "and3_operator", "or3_operator"),
+                    lambda inputs, result: [i for i, r in enumerate(inputs) if r == result]),
+    # 与非/或非/非：与结果相反的输入（与非触发时未满足的条件，未触发时全部满足的条件）
+    **dict.fromkeys(("nand_operator", "nor_operator", "not_operator"),
+                    lambda inputs, result: [i for i, r in enumerate(inputs) if r is not None and r != result]),
+    # 蕴含：未触发时前件均满足且后件不满足，全部相关；触发时为不满足的前件或满足的后件
+    **dict.fromkeys(("implication_operator", "implication3_operator"),
+                    lambda inputs, result: [i for i, r in enumerate(inputs) if r is not None and
+                                            (result == 0 or r == (1 if i == len(inputs) - 1 else 0))]),
+    # 异或/等价：每个输入都决定结果
+    **dict.fromkeys(("xor_operator", "xor3_operator", "equivalence_operator"),
+                    lambda inputs, result: [i for i, r in enumerate(inputs) if r is not None]),
+}
+# 规则中有无法解释的逻辑算子时置信度乘以该系数（低于使用模板的置信度阈值）
+UNKNOWN_COMBINER_CONFIDENCE = 0.5
+
+# 规则类型模板：风险名称、潜在威胁、应对建议
+RULE_TYPE_TEMPLATES = {
+    "重量风险": {
+        "risk_name": "重量申报异常风险",
+        "threat": "超重运输带来的运输安全隐患，以及以低报重量规避监管或少缴税费",
+        "recommendation": "核对装箱单与过磅记录，必要时安排过磅复核或人工查验"
+    },
+    "价格风险": {
+        "risk_name": "价格申报异常风险",
+        "threat": "低报价格偷逃税款或高报价格骗取退税、转移资金，扰乱贸易秩序",
+        "recommendation": "调取合同、发票及付汇凭证开展价格磋商，必要时启动估价核查"
+    },
+    "品类风险": {
+        "risk_name": "伪报品名风险",
+        "threat": "以伪报、瞒报品类夹带违禁或高税率货物，危害贸易安全并造成税款流失",
+        "recommendation": "核对商品编码归类依据，安排人工查验并抽样送检"
+    },
+    "产地风险": {
+        "risk_name": "原产地伪报风险",
+        "threat": "伪报原产地规避反倾销税、保障措施税或违规享受协定优惠税率",
+        "recommendation": "核验原产地证书真实性，开展原产地溯源核查"
+    },
+    "企业信用风险": {
+        "risk_name": "企业信用风险",
+        "threat": "高风险企业重复违规申报，增加整体监管风险",
+        "recommendation": "提高该企业的查验比例，结合历史违规记录开展稽查"
+    },
+    "税收风险": {
+        "risk_name": "税款申报异常风险",
+        "threat": "适用税率或计税依据申报错误，造成税款流失",
+        "recommendation": "复核税则归类与适用税率，必要时开展税款补征核查"
+    },
+    "检疫风险": {
+        "risk_name": "检疫违规风险",
+        "threat": "未满足检疫要求的货物入境，带来疫病疫情传播和环境安全威胁",
+        "recommendation": "核验检疫证书与许可证，实施检疫查验或暂扣处理"
+    },
+    "数量风险": {
+        "risk_name": "数量申报异常风险",
+        "threat": "瞒报或少报数量偷逃税款，或以多报数量骗取退税",
+        "recommendation": "核对装箱单与实际数量，安排开箱查验清点"
+    },
+    "时间风险": {
+        "risk_name": "时效违规风险",
+        "threat": "过期或临期货物入境，以及超出清关时限带来的监管风险",
+        "recommendation": "核验生产日期与有效期，对临期、过期货物依规处置"
+    },
+}
+DEFAULT_TEMPLATE = {
+    "risk_name": "申报异常风险",
+    "threat": "申报信息与实际情况不符，影响监管的准确性",
+    "recommendation": "立即触发人工审核，核对申报单证"
+}
+
+# 明确给出规则类型与由特征推断规则类型时的置信度
+GIVEN_TYPE_CONFIDENCE = 1.0
+INFERRED_TYPE_CONFIDENCE = 0.9
+UNKNOWN_TYPE_CONFIDENCE = 0.6
+
+# 属性 -> 规则类型（由属性所在属性组对应的规则类型得到）
+ATTRIBUTE_RULE_TYPES = {attribute: rule_type
+                        for rule_type, group in rule_type_groups.items()
+                        for attribute in group_attributes[group]}
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    if isinstance(value, (set, frozenset, list, tuple)):
+        return "{" + "、".join(sorted(map(str, value))) + "}"
+    return str(value)
+
+
+def describe_step(step):
+    """
+    按算子模板描述一个属性算子步骤的计算结果
+    :param step: calculation_steps 中的属性算子步骤（含 input_features、threshold、result）
+    :return: 描述文本，算子没有模板时返回 None
+    """
+    operator_name = step["operator"]
+    names = list(step["input_features"])
+    values = list(step["input_features"].values())
+    met = step["result"] == 1
+
+    if operator_name in COMPARISON_RELATIONS:
+        labelled = [f"{name}（{_format_value(value)}）" for name, value in zip(names, values)]
+        return labelled[0] + COMPARISON_RELATIONS[operator_name][0 if met else 1] + labelled[1]
+
+    template = MEASURE_TEMPLATES.get(operator_name)
+    if template is None:
+        return None
+    label, measure = template
+    try:
+        value = measure(values)
+    except (TypeError, ValueError, ZeroDivisionError, IndexError):
+        return None
+    inputs = "，".join(f"{name}为{_format_value(v)}" for name, v in zip(names, values))
+    verdict = "达到" if met else "未达到"
+    return f"{inputs}，{label.format(*names)}为{_format_value(value)}，{verdict}阈值{step['threshold']}"
+
+
+def infer_rule_type(calculation_steps):
+    """按参与计算的特征所属的属性组推断规则类型，无法确定（没有对应的属性或票数并列）时返回 None"""
+    votes = Counter(ATTRIBUTE_RULE_TYPES[name]
+                    for step in calculation_steps if "input_features" in step
+                    for name in step["input_features"] if name in ATTRIBUTE_RULE_TYPES)
+    ranked = votes.most_common(2)
+    if not ranked or (len(ranked) == 2 and ranked[0][1] == ranked[1][1]):
+        return None
+    return ranked[0][0]
+
+
+def relevant_steps(calculation_steps):
+    """
+    从根步骤（最后一步）出发，按各逻辑算子选取决定最终结果的属性算子步骤
+    :return: (步骤编号集合, 是否全部逻辑算子都能解释)；逻辑算子无法解释时选取其全部输入
+    """
+    by_step = {step["step"]: step for step in calculation_steps}
+    # 平铺规则的逻辑组合步骤没有 input_steps，输入为全部属性算子步骤
+    leaves = [step["step"] for step in calculation_steps if "input_features" in step]
+    selected, explained = set(), True
+    pending = [calculation_steps[-1]] if calculation_steps else []
+    while pending:
+        step = pending.pop()
+        if step.get("skipped"):
+            continue
+        if "input_features" in step:
+            selected.add(step["step"])
+            continue
+        inputs = step.get("input_steps", leaves)
+        select = COMBINER_RELEVANT_INPUTS.get(step["operator"])
+        if select is None:
+            explained = False
+            indices = range(len(inputs))
+        else:
+            indices = select(step["input_results"], step["result"])
+        pending.extend(by_step[inputs[i]] for i in indices)
+    return selected, explained
+
+
+def render_template_explanation(multi_dimensional_structure, rule_type=None):
+    """
+    生成模板化语义描述
+    :param multi_dimensional_structure: generate_risk_indicator 的输出
+    :param rule_type: 规则类型（如 "价格风险"），未提供时按特征推断
+    :return: (描述文本, 置信度)；置信度为有模板的步骤占比乘以规则类型的确定程度，有无法解释的逻辑算子时再降低
+    """
+    steps = [step for step in multi_dimensional_structure["calculation_steps"]
+             if "input_features" in step and not step.get("skipped")]
+    fired = multi_dimensional_structure["final_risk_indicator"] == 1
+
+    if rule_type in RULE_TYPE_TEMPLATES:
+        type_confidence = GIVEN_TYPE_CONFIDENCE
+    else:
+        rule_type = infer_rule_type(steps)
+        type_confidence = INFERRED_TYPE_CONFIDENCE if rule_type is not None else UNKNOWN_TYPE_CONFIDENCE
+    template = RULE_TYPE_TEMPLATES.get(rule_type, DEFAULT_TEMPLATE)
+
+    described = [describe_step(step) for step in steps]
+    coverage = sum(text is not None for text in described) / len(described) if described else 0.0
+    selected, explained = relevant_steps(multi_dimensional_structure["calculation_steps"])
+    relevant = [text for step, text in zip(steps, described) if text is not None and step["step"] in selected]
+    conditions = "；".join(relevant) if relevant else "规则中的各项条件"
+
+    purpose = rule_descriptions.get(rule_type, "海关风险检测规则")
+    if fired:
+        text = (
+            f"风险类型：{template['risk_name']}（{purpose}）\n"
+            f"风险表现：{conditions}。\n"
+            f"潜在威胁：{template['threat']}。\n"
+            f"应对建议：{template['recommendation']}。"
+        )
+    else:
+        text = (
+            f"风险类型：未触发{template['risk_name']}（{purpose}）\n"
+            f"风险表现：{conditions}，未满足风险判定条件。\n"
+            f"潜在威胁：当前申报未见{template['risk_name']}的特征。\n"
+            f"应对建议：按常规流程通关，保留随机抽查。"
+        )
+    confidence = coverage * type_confidence * (1.0 if explained else UNKNOWN_COMBINER_CONFIDENCE)
+    return text, round(confidence, 3)
+
+
+def select_template_explanation(multi_dimensional_structure, mode, rule_type=None):
+    """
+    按解释方式决定是否使用模板描述
+    :param mode: 解释方式（EXPLAIN_MODES 之一），不支持时抛出 ValueError
+    :return: (模板描述, 置信度)；需要调用大模型时描述为 None，llm 方式不计算置信度
+    """
+    if mode not in EXPLAIN_MODES:
+        raise ValueError(f"不支持的 explain_mode: {mode}")
+    if mode == "llm":
+        return None, None
+    text, confidence = render_template_explanation(multi_dimensional_structure, rule_type)
+    if mode == "template" or confidence >= TEMPLATE_MIN_CONFIDENCE:
+        return text, confidence
+    return None, confidence
+
+
+def build_summary(risk_features, multi_dimensional_structure):
+    """风险结果摘要"""
+    return {
+        "risk_indicator": multi_dimensional_structure["final_risk_indicator"],
+        "risk_level": "高风险" if multi_dimensional_structure["final_risk_indicator"] == 1 else "低风险",
+        "features_count": len(risk_features),
+        "calculation_steps": len(multi_dimensional_structure["calculation_steps"])
+    }
@@ -0,0 +1,367 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from loguru import logger
+
+from metrics import LLM_ATTEMPTS, LLM_FAILURES, LLM_HEDGES, LLM_RETRIES
+
+# ==============================
+# 多节点大模型服务池：同一模型的多个副本按“未完成请求数最少”分发
+# 请求开始发送后超过该节点对话请求的 p95 延迟仍未返回时，向另一节点发送对冲请求，取先成功的结果；
+# 流式请求的首个数据耗时（TTFT）单独统计，不计入对话请求的延迟样本；
+# 客户端线程池没有空闲名额时不对冲，对冲请求数不超过请求数的 hedge_max_ratio；
+# 在线程池中排队超过 queue_timeout 仍未开始发送的尝试直接失败（避免在线程池内部调用时线程池已满而互相等待）；
+# 每个节点有独立的熔断器，连续失败后一段时间内不再分发，到期后放行一个探测请求
+# ==============================
+
+
+def _quantile(sorted_samples, q):
+    """已排序样本的 q 分位数（线性插值）"""
+    position = (len(sorted_samples) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (position - lower)
+
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后熔断，reset_timeout 秒后放行一个探测请求，成功则恢复"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """是否可以分发请求（不占用探测名额）"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            return self.state == CLOSED or (self.state == HALF_OPEN and not self._probing)
+
+    def acquire(self):
+        """分发前调用：半开状态下只放行一个探测请求"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """分发后请求未发出（如排队超时被取消）：归还探测名额，不计成功或失败"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(f"熔断器打开，连续失败 {self.consecutive_failures} 次")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class Endpoint:
+    """池中的一个大模型服务节点：未完成请求数、最近延迟样本（对话请求与流式首个数据分开）与熔断器"""
+
+    def __init__(self, url, failure_threshold=5, reset_timeout=30.0, latency_window=200):
+        self.url = url
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.hedges = 0
+        self.last_error = None
+        self.last_success = None
+        self._latencies = deque(maxlen=latency_window)  # 最近成功的对话请求耗时（秒），决定对冲等待
+        self._ttft = deque(maxlen=latency_window)  # 最近成功的流式请求收到首个数据的耗时（秒）
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.outstanding += 1
+            self.requests += 1
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def end(self, seconds, error=None, stream=False):
+        """
+        :param seconds: 对话请求为总耗时，流式请求（stream 为 True）为收到首个数据的耗时
+        """
+        with self._lock:
+            self.outstanding -= 1
+            if error is None:
+                (self._ttft if stream else self._latencies).append(seconds)
+                self.last_success = time.time()
+            else:
+                self.failures += 1
+                self.last_error = str(error)
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def latency_quantile(self, q, min_samples=1, stream=False):
+        """最近成功的对话请求（stream 为 True 时为流式请求首个数据）耗时的 q 分位数（秒），样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._ttft if stream else self._latencies)
+        return _quantile(samples, q) if samples and len(samples) >= min_samples else None
+
+    def stats(self):
+        p50 = self.latency_quantile(0.50)
+        p95 = self.latency_quantile(0.95)
+        ttft_p95 = self.latency_quantile(0.95, stream=True)
+        return {
+            "url": self.url,
+            "state": self.breaker.state,
+            "healthy": self.breaker.state == CLOSED,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "hedges": self.hedges,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "ttft_p95_ms": round(ttft_p95 * 1000, 1) if ttft_p95 is not None else None,
+            "last_success": self.last_success,
+            "last_error": self.last_error
+        }
+
+
+class NoEndpointAvailable(RuntimeError):
+    """所有节点均已熔断"""
+
+
+class LLMPool:
+    """多节点大模型服务池，请求经 AsyncLLMClient 的连接池与线程池发出（共用并发上限与退避策略）"""
+
+    def __init__(self, urls, client, hedge=True, hedge_min_samples=20, hedge_min_delay=0.05, hedge_max_ratio=0.1,
+                 failure_threshold=5, reset_timeout=30.0, queue_timeout=30.0):
+        """
+        :param urls: 节点地址列表
+        :param client: api.AsyncLLMClient，提供 _post、_backoff、线程池与超时配置
+        :param hedge: 是否发送对冲请求
+        :param hedge_min_samples: 节点至少有这么多延迟样本后才按其 p95 对冲
+        :param hedge_min_delay: 对冲等待的下限（秒），避免延迟极低时频繁对冲
+        :param hedge_max_ratio: 对冲请求数占请求数的上限，避免节点整体变慢时对冲放大负载
+        :param failure_threshold: 熔断前允许的连续失败次数
+        :param reset_timeout: 熔断后多久放行探测请求（秒）
+        :param queue_timeout: 请求在客户端线程池中排队等待的上限（秒），超过时本次尝试失败
+        """
+        if not urls:
+            raise ValueError("大模型服务节点列表为空")
+        self.client = client
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.queue_timeout = queue_timeout
+        self.endpoints = [Endpoint(url, failure_threshold, reset_timeout) for url in urls]
+        self._next = 0  # 未完成请求数相同时轮转起点
+        self.attempts = 0  # 发出的原请求数（不含对冲请求）
+        self.hedges = 0
+        self.hedges_skipped = 0  # 达到对冲比例上限或线程池没有空闲名额而未对冲的次数
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self):
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def handles(self, url):
+        return url in self.urls
+
+    def add_endpoint(self, url):
+        with self._lock:
+            if url not in self.urls:
+                self.endpoints = self.endpoints + [Endpoint(url, self.failure_threshold, self.reset_timeout)]
+
+    def remove_endpoint(self, url):
+        with self._lock:
+            remaining = [endpoint for endpoint in self.endpoints if endpoint.url != url]
+            if not remaining:
+                raise ValueError("不能移除最后一个大模型服务节点")
+            self.endpoints = remaining
+
+    def pick(self, exclude=()):
+        """选出未熔断、未完成请求数最少的节点（相同时轮转），没有可用节点时返回 None"""
+        with self._lock:
+            endpoints = self.endpoints
+            start = self._next
+            self._next += 1
+        ordered = endpoints[start % len(endpoints):] + endpoints[:start % len(endpoints)]
+        candidates = [endpoint for endpoint in ordered if endpoint not in exclude and endpoint.breaker.available()]
+        for endpoint in sorted(candidates, key=lambda endpoint: endpoint.outstanding):
+            if endpoint.breaker.acquire():
+                return endpoint
+        return None
+
+    def _send(self, endpoint, payload, timeout, started=None):
+        """
+        在客户端线程池中向节点发送一次请求（不重试），返回回复内容，失败时抛出异常
+        :param started: 开始发送时置位的 threading.Event（不计在线程池中排队的时间）
+        """
+        if started is not None:
+            started.set()
+        start = time.perf_counter()
+        endpoint.begin()
+        response = None
+        try:
+            response = self.client._post(endpoint.url, payload, timeout)
+            LLM_ATTEMPTS.inc(outcome=response.status_code)
+            if response.status_code != 200:
+                raise RuntimeError(f"{endpoint.url} 返回 {response.status_code}: {response.content[:200]!r}")
+            content = response.json()["choices"][0]["message"]["content"]
+        except Exception as e:
+            if response is None:
+                LLM_ATTEMPTS.inc(outcome="error")
+            endpoint.end(time.perf_counter() - start, e)
+            raise
+        endpoint.end(time.perf_counter() - start)
+        return content
+
+    def _hedge_delay(self, endpoint):
+        p95 = endpoint.latency_quantile(0.95, self.hedge_min_samples)
+        return max(p95, self.hedge_min_delay) if p95 is not None else None
+
+    def _reserve_hedge(self):
+        """对冲前调用：线程池有空闲名额且对冲数未超过比例上限时占用一次对冲名额"""
+        with self._lock:
+            if self.hedges + 1 > self.attempts * self.hedge_max_ratio or self.client.free_slots() == 0:
+                self.hedges_skipped += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def _attempt(self, endpoint, payload, timeout):
+        """
+        一次尝试：先发往 endpoint，开始发送后超过其 p95 延迟未返回时向另一节点发送对冲请求，返回先成功的结果
+        在线程池中排队超过 queue_timeout 仍未开始发送时取消请求并抛出 TimeoutError；
+        对冲后落后的请求无法中止，完成后仍计入节点统计
+        """
+        with self._lock:
+            self.attempts += 1
+        started = threading.Event()
+        primary = self.client.submit(self._send, endpoint, payload, timeout, started)
+        # 在线程池中排队的时间不计入对冲等待
+        if not started.wait(self.queue_timeout) and primary.cancel():
+            endpoint.breaker.release()
+            raise TimeoutError(f"在客户端线程池中排队超过 {self.queue_timeout} 秒，未发往 {endpoint.url}")
+        delay = self._hedge_delay(endpoint) if self.hedge else None
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self._reserve_hedge():
+            return primary.result()
+        backup_endpoint = self.pick(exclude=(endpoint,))
+        if backup_endpoint is None:
+            with self._lock:
+                self.hedges -= 1
+            return primary.result()
+        backup_endpoint.record_hedge()
+        backup = self.client.submit(self._send, backup_endpoint, payload, timeout)
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    LLM_HEDGES.inc(outcome="won" if future is backup else "lost")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def chat(self, model, message, max_retries=3, timeout=None):
+        """
+        发送对话请求，返回模型回复内容，所有重试均失败时返回 None（与 AsyncLLMClient.chat 一致）
+        失败后优先换一个节点立即重试，只剩同一节点可用时按客户端的退避策略等待
+        """
+        payload = json.dumps({"model": model, "messages": message})
+        timeout = timeout or self.client.timeout
+        failed = ()
+        for attempt in range(1, max_retries + 1):
+            endpoint = self.pick(exclude=failed) or self.pick()
+            if endpoint is None:
+                logger.error(f"Attempt {attempt}/{max_retries} failed: 所有大模型服务节点均已熔断")
+            else:
+                try:
+                    return self._attempt(endpoint, payload, timeout)
+                except Exception as e:
+                    logger.error(f"Attempt {attempt}/{max_retries} failed on {endpoint.url}: {str(e)}")
+                    failed = failed + (endpoint,)
+            if attempt < max_retries:
+                LLM_RETRIES.inc()
+                if endpoint is None or not any(e.breaker.available() for e in self.endpoints if e not in failed):
+                    time.sleep(self.client._backoff(attempt))
+        LLM_FAILURES.inc()
+        return None
+
+    def stream(self, model, message, max_retries=3, timeout=None):
+        """流式对话：选出节点后交给客户端的流式调用（只在收到首个数据前重试），失败时换节点"""
+        for attempt in range(1, max_retries + 1):
+            endpoint = self.pick()
+            if endpoint is None:
+                raise NoEndpointAvailable("所有大模型服务节点均已熔断")
+            sent = [time.perf_counter()]  # 开始发送的时间，不计排队等待流式名额的时间
+            endpoint.begin()
+            chunks = self.client.stream(endpoint.url, model, message, max_retries=1, timeout=timeout,
+                                        on_start=lambda: sent.__setitem__(0, time.perf_counter()))
+            try:
+                first = next(chunks, None)
+            except Exception as e:
+                endpoint.end(time.perf_counter() - sent[0], e, stream=True)
+                if attempt == max_retries:
+                    raise
+                LLM_RETRIES.inc()
+                continue
+            # 以首个数据到达的耗时作为节点的流式延迟样本（不影响对话请求的对冲等待），流结束后才计为完成
+            first_latency = time.perf_counter() - sent[0]
+            error = None
+            try:
+                if first is not None:
+                    yield first
+                yield from chunks
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                chunks.close()
+                endpoint.end(first_latency, error, stream=True)
+            return
+
+    def stats(self):
+        with self._lock:
+            attempts, hedges, skipped = self.attempts, self.hedges, self.hedges_skipped
+        return {"endpoints": [endpoint.stats() for endpoint in self.endpoints], "hedge": self.hedge,
+                "hedge_max_ratio": self.hedge_max_ratio, "attempts": attempts, "hedges": hedges,
+                "hedges_skipped": skipped}
@@ -0,0 +1,317 @@
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==============================
+# 本地大模型桩服务：实现与大模型服务相同的 /v1/chat/completions 接口（含 stream 流式返回）
+# 可配置响应延迟分布、5xx/429 错误注入、超时挂起和生成速度（token/秒），用于离线压测与延迟测试
+# python llmStub.py --port 9997 --latency-ms 300 --latency-dist lognormal --error-rate 0.05
+# 然后以 LLM_URL=http://127.0.0.1:9997/v1/chat/completions python app.py 启动服务
+# ==============================
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+# 回复内容按 token 切分后逐段返回，每个 token 为两个字符
+STUB_REPLY = ("风险类型：综合风险。风险表现：申报数据与参考数据存在偏差，多个计算步骤判定为异常。"
+              "潜在威胁：可能存在低报价格、伪报重量或规避监管的情况。处置建议：建议人工复核申报单证并安排查验。")
+
+# 合并调用（explanationBatcher.py）提示词中的申报编号，桩服务按编号逐条回复
+BATCH_ITEM = re.compile(r"【申报(\d+)】")
+
+
+class StubConfig:
+    """桩服务行为配置"""
+
+    def __init__(self, latency_ms=0.0, latency_dist="fixed", latency_spread=0.0, error_rate=0.0,
+                 error_codes=(500, 502, 503), rate_limit_rate=0.0, retry_after=1, hang_rate=0.0, hang_seconds=120.0,
+                 tokens_per_second=0.0, response_tokens=None, seed=None):
+        """
+        :param latency_ms: 首个 token 前的延迟（毫秒）；fixed/normal/uniform 为均值，lognormal 为中位数，exponential 为均值
+        :param latency_dist: 延迟分布，见 LATENCY_DISTRIBUTIONS
+        :param latency_spread: 分布的离散程度：normal 为标准差（毫秒），uniform 为半宽（毫秒），lognormal 为 sigma
+        :param error_rate: 返回 5xx 的概率，状态码从 error_codes 中随机选择
+        :param rate_limit_rate: 返回 429（带 Retry-After 头）的概率
+        :param hang_seconds: 以 hang_rate 的概率挂起这么久后才响应，用于测试客户端超时
+        :param tokens_per_second: 生成速度，0 表示不限速；非流式请求同样按该速度计入响应时间
+        :param response_tokens: 回复 token 数，None 表示完整的默认回复
+        :param seed: 随机种子，指定后延迟与错误注入的序列可复现
+        """
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布 {latency_dist}")
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.seed = seed
+
+
+class StubState:
+    """随机数生成器与请求统计，多个处理线程共享"""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.by_status = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def draw(self):
+        """为一次请求抽取 (结果, 延迟秒数)；结果为 "ok"、"hang" 或状态码"""
+        config = self.config
+        with self.lock:
+            u = self.rng.random()
+            if u < config.rate_limit_rate:
+                outcome = 429
+            elif u < config.rate_limit_rate + config.error_rate:
+                outcome = self.rng.choice(config.error_codes)
+            elif u < config.rate_limit_rate + config.error_rate + config.hang_rate:
+                outcome = "hang"
+            else:
+                outcome = "ok"
+            latency_ms = self._latency_ms()
+        return outcome, latency_ms / 1000
+
+    def _latency_ms(self):
+        config = self.config
+        mean = config.latency_ms
+        if config.latency_dist == "uniform":
+            value = self.rng.uniform(mean - config.latency_spread, mean + config.latency_spread)
+        elif config.latency_dist == "normal":
+            value = self.rng.gauss(mean, config.latency_spread)
+        elif config.latency_dist == "lognormal":
+            value = mean * math.exp(self.rng.gauss(0, config.latency_spread)) if mean > 0 else 0
+        elif config.latency_dist == "exponential":
+            value = self.rng.expovariate(1 / mean) if mean > 0 else 0
+        else:
+            value = mean
+        return max(0.0, value)
+
+    def begin(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, status):
+        with self.lock:
+            self.in_flight -= 1
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "by_status": {str(k): v for k, v in self.by_status.items()},
+                    "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.by_status = {}
+            self.max_in_flight = self.in_flight
+
+
+def reply_tokens(response_tokens=None, items=0):
+    """回复内容按两个字符一个 token 切分；items 大于0时按“### 申报N”格式为每条申报各回复一段"""
+    tokens = [STUB_REPLY[i:i + 2] for i in range(0, len(STUB_REPLY), 2)]
+    if response_tokens is not None:
+        tokens = [tokens[i % len(tokens)] for i in range(response_tokens)]
+    if items:
+        tokens = [token for number in range(1, items + 1) for token in [f"### 申报{number}\n"] + tokens + ["\n"]]
+    return tokens
+
+
+def batch_items(messages):
+    """合并调用提示词中的申报条数，不是合并调用时为0"""
+    content = str(messages[-1].get("content", "")) if messages else ""
+    return len(set(BATCH_ITEM.findall(content)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # 响应头与响应体分两次写出，避免与客户端的延迟确认叠加出 40ms 延迟
+    state = None  # 由 make_server 绑定
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "healthy"})
+        elif self.path == "/stats":
+            self._send_json(200, self.state.stats())
+        elif self.path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path == "/stats/reset":
+            self.state.reset()
+            self._send_json(200, self.state.stats())
+            return
+        if self.path != "/v1/chat/completions":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+            return
+
+        state = self.state
+        config = state.config
+        state.begin()
+        status = 200
+        try:
+            outcome, latency = state.draw()
+            if outcome == "hang":
+                time.sleep(config.hang_seconds)
+            else:
+                time.sleep(latency)
+            if outcome == 429:
+                status = 429
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                                {"Retry-After": str(config.retry_after)})
+                return
+            if isinstance(outcome, int):
+                status = outcome
+                self._send_json(outcome, {"error": {"message": "injected error", "type": "server_error"}})
+                return
+
+            tokens = reply_tokens(config.response_tokens, batch_items(request.get("messages", [])))
+            model = request.get("model", "stub")
+            if request.get("stream"):
+                self._stream(model, tokens, config.tokens_per_second)
+            else:
+                if config.tokens_per_second > 0:
+                    time.sleep(len(tokens) / config.tokens_per_second)
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": sum(len(str(m.get("content", ""))) // 2
+                                                   for m in request.get("messages", [])),
+                              "completion_tokens": len(tokens)}
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            status = "disconnected"  # 客户端提前断开
+        finally:
+            state.end(status)
+
+    def _stream(self, model, tokens, tokens_per_second):
+        """按 SSE 逐个 token 返回（chat.completion.chunk），以 data: [DONE] 结束"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        interval = 1 / tokens_per_second if tokens_per_second > 0 else 0
+        for token in tokens:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if interval:
+                time.sleep(interval)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def make_server(config, host="127.0.0.1", port=0):
+    """创建桩服务（port=0 时自动选择空闲端口），返回 (服务器, 共享状态)"""
+    state = StubState(config)
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server, state
+
+
+class LLMStub:
+    """在后台线程中运行的桩服务，供基准测试等进程内使用"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.server, self.state = make_server(config or StubConfig(), host, port)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="llm-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="本地大模型桩服务（/v1/chat/completions）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9997)
+    parser.add_argument("--latency-ms", type=float, default=0, help="首个 token 前的延迟（毫秒）")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="fixed", help="延迟分布")
+    parser.add_argument("--latency-spread", type=float, default=0,
+                        help="normal 的标准差/uniform 的半宽（毫秒），lognormal 的 sigma")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回 5xx 的概率")
+    parser.add_argument("--error-codes", default="500,502,503", help="注入的 5xx 状态码，逗号分隔")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--hang-rate", type=float, default=0, help="挂起不响应的概率")
+    parser.add_argument("--hang-seconds", type=float, default=120, help="挂起时长（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="生成速度，0 表示不限速")
+    parser.add_argument("--response-tokens", type=int, default=None, help="回复 token 数")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.latency_dist, args.latency_spread, args.error_rate,
+                        [int(code) for code in args.error_codes.split(",")], args.rate_limit_rate, args.retry_after,
+                        args.hang_rate, args.hang_seconds, args.tokens_per_second, args.response_tokens, args.seed)
+    server, _ = make_server(config, args.host, args.port)
+    print(f"大模型桩服务已启动: http://{args.host}:{server.server_address[1]}/v1/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
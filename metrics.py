@@ -0,0 +1,185 @@
+import contextvars
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# ==============================
+# 运行指标：计数器与直方图，按 Prometheus 文本格式导出（/metrics）
+# 各阶段（请求解析、风险指标计算、提示词构建、大模型调用、序列化）用 timed() 计时，
+# 同时记入当前请求的 timings（请求体 "timings": true 时随响应返回）
+# ==============================
+
+# 默认直方图分桶（秒），覆盖微秒级的规则计算到分钟级的大模型调用
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # 标签值 -> [各分桶计数（非累积）..., +Inf 分桶计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        counts = self._values.get(tuple(str(labels[name]) for name in self.labelnames))
+        return sum(counts[:-1]) if counts else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, ("le", _format_value(float(bound))))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表；collector 在导出时调用，返回其他组件已有统计（如缓存命中数）的指标行"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        :param collector: 无参函数，返回 [(指标名, 类型, 说明, [(标签字典, 值), ...]), ...]
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# 全局注册表与指标
+registry = MetricsRegistry()
+REQUESTS = registry.counter("risk_requests_total", "接口请求数", ("endpoint", "status"))
+REQUEST_SECONDS = registry.histogram("risk_request_seconds", "接口处理耗时（秒，流式接口为首字节前的耗时）", ("endpoint",))
+STAGE_SECONDS = registry.histogram("risk_stage_seconds", "各处理阶段耗时（秒）", ("stage",))
+LLM_ATTEMPTS = registry.counter("risk_llm_attempts_total", "大模型调用尝试次数，按结果（状态码或 error）", ("outcome",))
+LLM_RETRIES = registry.counter("risk_llm_retries_total", "大模型调用重试次数")
+LLM_FAILURES = registry.counter("risk_llm_failures_total", "大模型调用在全部重试后仍失败的次数")
+LLM_HEDGES = registry.counter("risk_llm_hedges_total", "多节点池的对冲请求次数，按结果（won 对冲请求先返回 / lost 原请求先返回）", ("outcome",))
+EXPLANATIONS = registry.counter("risk_explanations_total", "语义描述来源（template 模板 / llm 大模型 / reused 会话沿用上次描述）", ("source",))
+EXPLANATION_LOOKUPS = registry.counter("risk_explanation_cache_lookups_total", "语义描述缓存查找次数", ("result",))
+OPERATOR_ERRORS = registry.counter("risk_operator_errors_total", "算子计算出错次数（批量计算按出错行数）", ("operator",))
+
+# 当前请求的各阶段耗时（毫秒），由 start_timings() 开启
+_timings = contextvars.ContextVar("timings", default=None)
+
+
+def start_timings():
+    """为当前请求（上下文）开启阶段耗时记录，返回记录字典"""
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def current_timings():
+    return _timings.get()
+
+
+def record_stage(stage, seconds):
+    """记录一个阶段的耗时：计入直方图，并累加到当前请求的 timings（同一阶段多次执行时累加）"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 3)
+
+
+@contextmanager
+def timed(stage):
+    """阶段计时：with timed("generate_risk_indicator"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
@@ -139,4 +139,12 @@ def xor3_operator(A: int, B: int, C: int) -> int:
 
 def implication3_operator(A: int, B: int, C: int) -> int:
     """三元逻辑蕴含算子：¬(A∧B∧¬C)，即A和B为1且C为0时返回0，否则1"""
-    return 0 if (A == 1 and B == 1 and C == 0) else 1
\ No newline at end of file
+    return 0 if (A == 1 and B == 1 and C == 0) else 1
+
+# ==============================
+# 四、一元异常指标算子（输入为0/1，输出0/1）
+# ==============================
+
+def not_operator(A: int) -> int:
+    """逻辑非算子：A为0返回1，否则0"""
+    return 1 if A == 0 else 0
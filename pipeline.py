@@ -0,0 +1,377 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import api
+from backtest import parse_cell
+from explanationBatcher import ExplanationBatcher
+from explanationCache import ExplanationCache
+from explanationTemplates import DEFAULT_EXPLAIN_MODE, EXPLAIN_MODES, build_summary, select_template_explanation
+from riskIndicatorDescription import generate_risk_indicator, get_llm_explanation
+from ruleStore import RuleStore
+
+# ==============================
+# 命令行流式申报处理：与 /explain_risk_batch 相同的处理逻辑，不经过 HTTP
+# 读取 -> 计算 -> （可选）大模型语义描述 -> 写出 分为独立的阶段，阶段之间为有界队列：
+# 读取线程按批分组，计算阶段在进程池中并行（解析、求值、模板描述与序列化都在工作进程中完成），
+# 需要大模型的申报交给有独立并发上限的线程池，写出线程按输入顺序（或完成顺序）输出 NDJSON
+# 从读取到写出的申报数不超过 max_pending，内存占用与输入规模无关
+# python pipeline.py --input data/declarations.ndjson --output data/results.ndjson --rules data/rules.bin --workers 8
+# cat data/declarations.ndjson | python pipeline.py --explain --llm-concurrency 4 > results.ndjson
+# ==============================
+
+# CSV 输入中不作为特征的列
+CSV_RESERVED_COLUMNS = ("id", "rule_id", "rules", "rule_type", "explain", "explain_mode")
+
+_rule_store = None  # 工作进程中的规则库
+
+
+def _init_worker(rules_path):
+    global _rule_store
+    _rule_store = RuleStore.load(rules_path) if rules_path else RuleStore()
+
+
+def ndjson_line(data):
+    """单行JSON，不缩进，保留中文"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+def csv_item(header, row):
+    """CSV 行转换为申报：保留列（CSV_RESERVED_COLUMNS）之外的非空单元格为特征，rules 列为 JSON"""
+    cells = dict(zip(header, row))
+    item = {"risk_features": {}}
+    for name, text in cells.items():
+        if name in CSV_RESERVED_COLUMNS:
+            if text:
+                item[name] = text
+        else:
+            value = parse_cell(text)
+            if value is not None:
+                item["risk_features"][name] = value
+    if "rules" in item:
+        item["rules"] = json.loads(item["rules"])
+    if "explain" in item:
+        item["explain"] = item["explain"].strip().lower() in ("1", "true", "yes", "是")
+    return item
+
+
+class _ErrorLine(str):
+    """出错申报的输出行，写出阶段据此统计出错数"""
+
+
+def _error_line(result, message):
+    result["error"] = message
+    return _ErrorLine(ndjson_line(result))
+
+
+def process_item(index, item, default_explain, default_mode):
+    """
+    处理一条申报
+    :return: (输出行, None)；需要大模型描述时为 (None, (结果, 风险特征, 规则, 多维计算结构, 模板置信度))
+    """
+    if not isinstance(item, dict):
+        return _error_line({"index": index, "id": None}, "申报格式错误"), None
+    result = {"index": index, "id": item.get('id')}
+    risk_features = item.get('risk_features', {})
+    rules = item.get('rules', [])
+    rule_type = item.get('rule_type')
+    if not rules and item.get('rule_id'):
+        stored = _rule_store.get(item['rule_id'])
+        if stored is None:
+            return _error_line(result, f"规则 {item['rule_id']} 不存在"), None
+        rules, rule_type = stored.rules, rule_type or stored.rule_type
+    if not risk_features or not rules:
+        return _error_line(result, "缺少必要参数"), None
+
+    explain = item.get('explain', default_explain)
+    try:
+        multi_dimensional_structure = generate_risk_indicator(risk_features, rules)
+        if explain:
+            template, confidence = select_template_explanation(
+                multi_dimensional_structure, item.get('explain_mode', default_mode), rule_type)
+    except Exception as e:
+        return _error_line(result, str(e)), None
+
+    if explain and template is None:
+        return None, (result, risk_features, rules, multi_dimensional_structure, confidence)
+    result["multi_dimensional_structure"] = multi_dimensional_structure
+    if explain:
+        result["semantic_description"] = template
+    result["summary"] = build_summary(risk_features, multi_dimensional_structure)
+    if explain:
+        result.update({"explanation_source": "template", "template_confidence": confidence})
+    return ndjson_line(result), None
+
+
+def process_batch(start, records, header, default_explain, default_mode):
+    """
+    在工作进程中处理一批申报
+    :param records: NDJSON 行文本；header 不为 None 时为 CSV 行（单元格列表）
+    :return: ([(序号, 输出行, 待描述数据), ...], 耗时秒数)
+    """
+    batch_start = time.perf_counter()
+    outputs = []
+    for offset, record in enumerate(records):
+        index = start + offset
+        try:
+            item = csv_item(header, record) if header is not None else json.loads(record)
+        except ValueError as e:
+            outputs.append((index, _error_line({"index": index, "id": None}, f"申报解析失败: {e}"), None))
+            continue
+        line, pending = process_item(index, item, default_explain, default_mode)
+        outputs.append((index, line, pending))
+    return outputs, time.perf_counter() - batch_start
+
+
+class Pipeline:
+    """流式申报处理流水线"""
+
+    def __init__(self, workers=None, batch_size=256, max_pending=4096, ordered=True, rules_path=None,
+                 explain=False, explain_mode=DEFAULT_EXPLAIN_MODE, llm_url=None, llm_model=None, llm_concurrency=4,
+                 llm_batch=1, cache=None):
+        """
+        :param workers: 计算阶段的进程数，1 表示在当前进程的一个线程中计算
+        :param batch_size: 每个计算任务的申报条数
+        :param max_pending: 已读取、尚未写出的申报数上限（同时限制各阶段队列与乱序缓冲）
+        :param ordered: True 按输入顺序写出，False 按完成顺序写出（每行均带 index 与 id）
+        :param rules_path: 规则库文件，申报用 rule_id 引用规则时需要
+        :param explain: 未在申报中指定 explain 时是否生成语义描述
+        :param explain_mode: 未在申报中指定 explain_mode 时的描述方式（template / llm / auto）
+        :param llm_concurrency: 同时进行的大模型调用数上限
+        :param llm_batch: 大于1时在时间窗口内合并至多这么多条申报为一次大模型调用（见 explanationBatcher.py）
+        :param cache: 可选的 ExplanationCache
+        """
+        if explain_mode not in EXPLAIN_MODES:
+            raise ValueError(f"不支持的 explain_mode: {explain_mode}")
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        # 至少容纳两批，读取线程凑满一批前不会因窗口耗尽而阻塞
+        self.max_pending = max(max_pending, 2 * batch_size)
+        self.ordered = ordered
+        self.rules_path = rules_path
+        self.explain = explain
+        self.explain_mode = explain_mode
+        self.llm_url = llm_url or api.LLM_URL
+        self.llm_model = llm_model or api.LLM_MODEL
+        self.llm_concurrency = llm_concurrency
+        self.cache = cache
+        self.batcher = ExplanationBatcher(max_items=llm_batch, workers=llm_concurrency) if llm_batch > 1 else None
+        # 使用合并调用时，等待结果的线程数要足以凑满每次合并，实际并发调用数由合并器的线程数限制
+        self._llm_threads = llm_concurrency * llm_batch if self.batcher is not None else llm_concurrency
+        self.stats = {}
+
+    def _explain(self, pending):
+        result, risk_features, rules, multi_dimensional_structure, confidence = pending
+        start = time.perf_counter()
+        try:
+            semantic_description = get_llm_explanation(risk_features, rules, multi_dimensional_structure,
+                                                       self.llm_url, self.llm_model, self.cache, self.batcher)
+            result.update({
+                "multi_dimensional_structure": multi_dimensional_structure,
+                "semantic_description": semantic_description,
+                "summary": build_summary(risk_features, multi_dimensional_structure),
+                "explanation_source": "llm",
+                "template_confidence": confidence
+            })
+        except Exception as e:
+            return _error_line(result, str(e)), time.perf_counter() - start
+        return ndjson_line(result), time.perf_counter() - start
+
+    def run(self, source, sink, textual=False, progress=None):
+        """
+        处理 source 中的全部申报，结果逐行写入 sink
+        :param source: 文本文件对象，NDJSON（每行一条申报，格式同批量接口中的申报）或 CSV（textual 为 True）
+        :param sink: 文本文件对象
+        :param progress: 每隔多少秒向标准错误输出一次进度，None 表示不输出
+        :return: 运行统计
+        """
+        start_time = time.perf_counter()
+        window = threading.Semaphore(self.max_pending)
+        batches = queue.Queue(maxsize=2)
+        futures = queue.Queue(maxsize=2 * self.workers)
+        outputs = queue.Queue()
+        counters = {"read_seconds": 0.0, "evaluate_seconds": 0.0, "llm_seconds": 0.0, "write_seconds": 0.0,
+                    "llm_calls": 0, "errors": 0}
+        failures = []
+        lock = threading.Lock()
+
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"),
+                                           _init_worker, (self.rules_path,))
+        else:
+            executor = ThreadPoolExecutor(1, "pipeline-evaluate", _init_worker, (self.rules_path,))
+        llm_executor = ThreadPoolExecutor(self._llm_threads, "pipeline-llm")
+
+        def read():
+            """读取阶段：按批分组，每条申报进入流水线前占用一个窗口名额"""
+            total = 0
+            try:
+                if textual:
+                    reader = csv.reader(source)
+                    header = next(reader, None)
+                    records = reader
+                else:
+                    header = None
+                    records = (line for line in source if line.strip())
+                batch = []
+                read_start = time.perf_counter()
+                for record in records:
+                    counters["read_seconds"] += time.perf_counter() - read_start
+                    window.acquire()
+                    batch.append(record)
+                    if len(batch) == self.batch_size:
+                        batches.put((total, batch, header))
+                        total += len(batch)
+                        batch = []
+                    read_start = time.perf_counter()
+                if batch:
+                    batches.put((total, batch, header))
+                    total += len(batch)
+            except Exception as e:
+                failures.append(f"读取输入失败: {e}")
+            finally:
+                batches.put(None)
+                outputs.put(("eof", total))
+
+        def dispatch():
+            """计算阶段：批次提交到进程池，进行中的批次数受 futures 队列长度限制"""
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    futures.put(None)
+                    return
+                batch_start, records, header = batch
+                futures.put((batch_start, len(records),
+                             executor.submit(process_batch, batch_start, records, header, self.explain,
+                                             self.explain_mode)))
+
+        def explained(future):
+            line, seconds = future.result()
+            with lock:
+                counters["llm_seconds"] += seconds
+            outputs.put((future.index, line))
+
+        def collect():
+            """按提交顺序取回计算结果，需要大模型描述的申报交给描述阶段"""
+            while True:
+                entry = futures.get()
+                if entry is None:
+                    return
+                batch_start, count, future = entry
+                try:
+                    results, seconds = future.result()
+                except Exception as e:
+                    results = [(index, _error_line({"index": index, "id": None}, f"计算失败: {e}"), None)
+                               for index in range(batch_start, batch_start + count)]
+                    seconds = 0.0
+                counters["evaluate_seconds"] += seconds
+                for index, line, pending in results:
+                    if pending is None:
+                        outputs.put((index, line))
+                    else:
+                        with lock:
+                            counters["llm_calls"] += 1
+                        llm_future = llm_executor.submit(self._explain, pending)
+                        llm_future.index = index
+                        llm_future.add_done_callback(explained)
+
+        threads = [threading.Thread(target=target, name=f"pipeline-{target.__name__}", daemon=True)
+                   for target in (read, dispatch, collect)]
+        for thread in threads:
+            thread.start()
+
+        # 写出阶段（当前线程）：有序时缓冲先完成的申报，直到前面的申报全部写出
+        buffered = {}
+        next_index = written = 0
+        total = None
+        last_report = time.perf_counter()
+        try:
+            while total is None or written < total:
+                index, value = outputs.get()
+                if index == "eof":
+                    total = value
+                    continue
+                write_start = time.perf_counter()
+                if self.ordered:
+                    buffered[index] = value
+                    ready = []
+                    while next_index in buffered:
+                        ready.append(buffered.pop(next_index))
+                        next_index += 1
+                else:
+                    ready = [value]
+                for line in ready:
+                    sink.write(line)
+                    if isinstance(line, _ErrorLine):
+                        counters["errors"] += 1
+                    window.release()
+                written += len(ready)
+                counters["write_seconds"] += time.perf_counter() - write_start
+                if progress and time.perf_counter() - last_report >= progress:
+                    last_report = time.perf_counter()
+                    elapsed = last_report - start_time
+                    print(f"已处理 {written} 条申报，{written / elapsed:.0f} 条/秒", file=sys.stderr, flush=True)
+            sink.flush()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            llm_executor.shutdown(wait=True)
+
+        elapsed = time.perf_counter() - start_time
+        self.stats = {
+            "records": written,
+            "errors": counters["errors"],
+            "llm_calls": counters["llm_calls"],
+            "elapsed_seconds": round(elapsed, 3),
+            "records_per_second": round(written / elapsed, 1) if elapsed > 0 else None,
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "max_pending": self.max_pending,
+            "ordered": self.ordered,
+            # 各阶段累计耗时（秒）：计算为各工作进程耗时之和，描述为各次大模型调用耗时之和
+            "stages": {name: round(counters[f"{name}_seconds"], 3) for name in ("read", "evaluate", "llm", "write")},
+            "explanation_cache": self.cache.stats() if self.cache is not None else None,
+            "explanation_batcher": self.batcher.stats() if self.batcher is not None else None,
+            "failures": failures
+        }
+        return self.stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="流式处理申报（与 /explain_risk_batch 相同的处理逻辑）")
+    parser.add_argument("--input", default="-", help="申报文件，- 表示标准输入")
+    parser.add_argument("--output", default="-", help="结果文件（NDJSON），- 表示标准输出")
+    parser.add_argument("--format", choices=("auto", "ndjson", "csv"), default="auto",
+                        help="输入格式，auto 按扩展名判断（.csv 为 CSV，其他为 NDJSON）")
+    parser.add_argument("--rules", default=None, help="规则库文件（CSV 或列式二进制），申报用 rule_id 引用规则时需要")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="计算阶段的进程数")
+    parser.add_argument("--batch-size", type=int, default=256, help="每个计算任务的申报条数")
+    parser.add_argument("--max-pending", type=int, default=4096, help="已读取、尚未写出的申报数上限")
+    parser.add_argument("--unordered", action="store_true", help="按完成顺序写出（默认按输入顺序）")
+    parser.add_argument("--explain", action="store_true", help="未在申报中指定 explain 时生成语义描述")
+    parser.add_argument("--explain-mode", choices=EXPLAIN_MODES, default=DEFAULT_EXPLAIN_MODE, help="语义描述方式")
+    parser.add_argument("--llm-url", default=api.LLM_URL, help="大模型服务地址（/v1/chat/completions）")
+    parser.add_argument("--llm-model", default=api.LLM_MODEL, help="大模型名称")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="同时进行的大模型调用数上限")
+    parser.add_argument("--llm-batch", type=int, default=1, help="大于1时合并至多这么多条申报为一次大模型调用")
+    parser.add_argument("--cache-db", default=None, help="语义描述磁盘缓存文件（SQLite），不指定时只用进程内缓存")
+    parser.add_argument("--progress", type=float, default=None, help="每隔多少秒向标准错误输出一次进度")
+    args = parser.parse_args()
+
+    textual = args.format == "csv" or (args.format == "auto" and args.input.lower().endswith(".csv"))
+    source = open(sys.stdin.fileno(), encoding="utf-8", newline='', closefd=False) if args.input == "-" \
+        else open(args.input, encoding="utf-8", newline='')
+    sink = open(sys.stdout.fileno(), "w", encoding="utf-8", closefd=False) if args.output == "-" \
+        else open(args.output, "w", encoding="utf-8")
+    pipeline = Pipeline(args.workers, args.batch_size, args.max_pending, not args.unordered, args.rules, args.explain,
+                        args.explain_mode, args.llm_url, args.llm_model, args.llm_concurrency, args.llm_batch,
+                        ExplanationCache(db_path=args.cache_db))
+    with source, sink:
+        stats = pipeline.run(source, sink, textual, args.progress)
+    print(json.dumps(stats, ensure_ascii=False, indent=2), file=sys.stderr)
@@ -1,90 +1,39 @@
 # 假设之前的算子代码已经保存为 operators.py
+import time
 from operators import *
 from api import *
+from rulePlan import get_plan
+from metrics import EXPLANATION_LOOKUPS, record_stage, timed
 
 def generate_risk_indicator(risk_features, rules):
     """
     根据风险特征和规则生成风险指标
     :param risk_features: 风险特征字典，键为特征名称，值为特征值
-    :param rules: 风险规则列表，每个规则是一个元组，格式为 (算子名称, 特征名称列表, 阈值)
+    :param rules: 风险规则列表，每个规则是一个元组，格式为 (算子名称, 特征名称列表, 阈值)；
+                  或嵌套的规则树 {"op": 逻辑算子名称, "args": [子节点, ...]}，按短路求值，跳过的步骤在计算结构中标记
     :return: 包含多维计算结构的字典
     """
-    intermediate_results = []
-    calculation_steps = []
-    
-    # 第一步：计算属性算子结果
-    for i, rule in enumerate(rules[:-1]):  # 排除最后一个规则（逻辑算子规则）
-        operator_name, feature_names, threshold = rule
-        operator = globals().get(operator_name)
-        if operator is None:
-            raise ValueError(f"未找到算子 {operator_name}")
-        
-        features = [risk_features[feature_name] for feature_name in feature_names]
-        
-        if operator_name in ['subset_operator']:
-            result = operator(*features)
-        elif operator_name in ['cmp_operator']:
-            # cmp_operator 不需要阈值参数
-            result = operator(*features)
-        elif operator_name in ['weighted_avg_operator']:
-            # 假设第一个特征是权重列表，其余是值列表
-            weights = features[0]
-            values = features[1:]
-            result = operator(weights, values, threshold)
-        elif operator_name in ['euclidean_distance_2d', 'euclidean_distance_3d', 'cosine_similarity_3d']:
-            result = operator(*features, threshold)
-        else:
-            result = operator(*features, threshold)
-        
-        intermediate_results.append(result)
-        
-        # 记录计算步骤
-        step_info = {
-            "step": i + 1,
-            "operator": operator_name,
-            "input_features": {name: risk_features[name] for name in feature_names},
-            "threshold": threshold,
-            "result": result,
-            "description": get_operator_description(operator_name, feature_names, threshold, result)
-        }
-        calculation_steps.append(step_info)
-
-    # 第二步：根据二元或三元异常指标算子组合中间结果
-    last_rule = rules[-1]
-    operator_name = last_rule[0]
-    operator = globals().get(operator_name)
-    if operator is None:
-        raise ValueError(f"未找到算子 {operator_name}")
-
-    if len(intermediate_results) == 2:
-        # 二元异常指标算子
-        final_result = operator(*intermediate_results)
-    elif len(intermediate_results) == 3:
-        # 三元异常指标算子
-        final_result = operator(*intermediate_results)
-    else:
-        raise ValueError("不支持的规则数量，仅支持二元或三元组合")
-
-    # 记录最终步骤
-    final_step = {
-        "step": len(calculation_steps) + 1,
-        "operator": operator_name,
-        "input_results": intermediate_results,
-        "result": final_result,
-        "description": get_logical_operator_description(operator_name, intermediate_results, final_result)
-    }
-    calculation_steps.append(final_step)
-
-    # 构建多维计算结构
-    multi_dimensional_structure = {
-        "original_features": risk_features,
-        "calculation_steps": calculation_steps,
-        "intermediate_results": intermediate_results,
-        "final_risk_indicator": final_result,
-        "rules_applied": rules
-    }
+    # 规则首次出现时编译（解析算子、绑定参数、校验元数与特征名称），之后复用缓存的计划
+    plan = get_plan(rules)
+    return plan.evaluate(risk_features, rules)
 
-    return multi_dimensional_structure
+def generate_risk_indicator_value(risk_features, rules):
+    """
+    只计算最终风险指标（0/1），不生成计算结构；结果与出错情况与 generate_risk_indicator 相同
+    嵌套规则树按运行统计调整可交换逻辑节点的子节点求值顺序，只需要风险指标时比完整计算更快
+    """
+    return get_plan(rules).evaluate_indicator(risk_features)
+
+def generate_risk_indicator_batch(feature_table, rules):
+    """
+    在列式特征表上批量生成风险指标，语义与 generate_risk_indicator 逐行一致
+    :param feature_table: 特征表，键为特征名称，值为等长的特征列（列表或 numpy 数组）
+    :param rules: 风险规则列表，格式同 generate_risk_indicator
+    :return: 包含各步骤结果掩码、错误掩码（如除数为0的行）和最终风险指标掩码的字典；
+             出错行的最终风险指标为0，valid 中对应位置为 False
+    """
+    plan = get_plan(rules)
+    return plan.evaluate_batch(feature_table, rules)
 
 def get_operator_description(operator_name, feature_names, threshold, result):
     """生成算子计算描述"""
@@ -107,16 +56,17 @@ def get_logical_operator_description(operator_name, input_results, final_result)
         "and_operator": f"逻辑与运算：所有条件({input_results})均需满足",
         "or_operator": f"逻辑或运算：任一条件({input_results})满足即可",
         "and3_operator": f"三元逻辑与运算：所有三个条件({input_results})均需满足",
-        "or3_operator": f"三元逻辑或运算：任一条件({input_results})满足即可"
+        "or3_operator": f"三元逻辑或运算：任一条件({input_results})满足即可",
+        "not_operator": f"逻辑非运算：条件({input_results})不满足时触发"
     }
     
     base_desc = logical_descriptions.get(operator_name, f"应用{operator_name}逻辑运算")
     result_desc = "触发风险" if final_result == 1 else "未触发风险"
     return f"{base_desc}，最终判定：{result_desc}"
 
-def get_llm_explanation(risk_features, rules, multi_dimensional_structure, url, model):
-    """调用大模型解释风险指标计算逻辑，生成详细的语义描述"""
-    
+def build_explanation_messages(risk_features, multi_dimensional_structure):
+    """构建生成语义描述的大模型对话消息"""
+
     # 构建详细的计算过程描述
     calculation_process = ""
     for step in multi_dimensional_structure["calculation_steps"]:
@@ -143,13 +93,65 @@ def get_llm_explanation(risk_features, rules, multi_dimensional_structure, url,
     示例格式：当[具体条件]时，判定为'[风险类型]'。此类风险可能导致[威胁分析]，需[应对建议]。
     """
 
-    messages = [
+    return [
         {'role': 'system', 'content': "你是专业的风险分析专家，擅长基于多维特征进行风险识别和语义描述。"},
         {'role': 'user', 'content': prompt.strip()}
     ]
-    content = chat_with_requests(url, model, messages)
+
+def get_llm_explanation(risk_features, rules, multi_dimensional_structure, url, model, cache=None, batcher=None):
+    """调用大模型解释风险指标计算逻辑，生成详细的语义描述
+
+    :param cache: 可选的 ExplanationCache，相同规则与步骤结果模式直接返回缓存的描述
+    :param batcher: 可选的 ExplanationBatcher，与同一时间窗口内的其他申报合并为一次大模型调用
+    """
+    if cache is not None:
+        with timed("cache_lookup"):
+            cache_key = cache.key(rules, multi_dimensional_structure, risk_features)
+            content = cache.get(cache_key)
+        EXPLANATION_LOOKUPS.inc(result="hit" if content is not None else "miss")
+        if content is not None:
+            return content
+
+    if batcher is not None:
+        with timed("llm_call"):
+            content = batcher.explain(url, model, risk_features, multi_dimensional_structure)
+    else:
+        with timed("build_prompt"):
+            messages = build_explanation_messages(risk_features, multi_dimensional_structure)
+        with timed("llm_call"):
+            content = chat_with_requests(url, model, messages)
+    if cache is not None:
+        cache.set(cache_key, content)
     return content
 
+def stream_llm_explanation(risk_features, rules, multi_dimensional_structure, url, model, cache=None):
+    """流式生成语义描述，逐段返回；缓存命中时一次返回完整描述，完整接收后写入缓存"""
+    if cache is not None:
+        with timed("cache_lookup"):
+            cache_key = cache.key(rules, multi_dimensional_structure, risk_features)
+            content = cache.get(cache_key)
+        EXPLANATION_LOOKUPS.inc(result="hit" if content is not None else "miss")
+        if content is not None:
+            yield content
+            return
+
+    with timed("build_prompt"):
+        messages = build_explanation_messages(risk_features, multi_dimensional_structure)
+    chunks = []
+    start = time.perf_counter()
+    upstream = stream_chat(url, model, messages)
+    try:
+        for chunk in upstream:
+            if not chunks:
+                record_stage("llm_first_chunk", time.perf_counter() - start)
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        upstream.close()  # 调用方提前关闭时取消上游请求
+        record_stage("llm_stream", time.perf_counter() - start)
+    if cache is not None:
+        cache.set(cache_key, "".join(chunks))
+
 if __name__ == "__main__":
     # 1. 定义风险特征、规则
     risk_features = {
@@ -170,8 +172,8 @@ if __name__ == "__main__":
     risk_indicator = multi_dimensional_structure['final_risk_indicator']
     print(f"风险指标: {risk_indicator}\n")
 
-    url = "http://100.100.20.144:9997/v1/chat/completions"
-    model = "qwen3"
+    url = LLM_URL
+    model = LLM_MODEL
     print(get_llm_explanation(risk_features, rules, multi_dimensional_structure, url, model))
 
     # # 3. 构建整合prompt
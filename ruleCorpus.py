@@ -0,0 +1,270 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+
+import numpy as np
+
+# ==============================
+# 规则库的列式二进制格式
+# 文件 = 魔数 + 头部长度 + JSON 头部（字典表、数组位置）+ 按 64 字节对齐的定长数组
+# 算子、属性及低基数字符串列编码为小整数，阈值存为 float64 数组，
+# 规则结构通过偏移量指向扁平的步骤数组，步骤的属性同样通过偏移量指向扁平的属性编码数组
+# 读取时整个文件内存映射（只读共享），多个工作进程共用同一份页缓存
+# ==============================
+
+MAGIC = b"RULECORP"
+VERSION = 1
+ALIGN = 64
+
+# 编码为字典下标的字符串列
+DICTIONARY_COLUMNS = ("rule_type", "rule_status", "rule_description", "calculation_method", "operator")
+
+# 阈值标记：原阈值为整数 / 原阈值为 None（float64 中分别按 1.0 / NaN 存储）
+THRESHOLD_INT = 1
+THRESHOLD_NONE = 2
+
+
+def _code_dtype(size):
+    return "<u1" if size <= 0xFF else "<u2" if size <= 0xFFFF else "<u4"
+
+
+class _Dictionary:
+    """字符串 -> 编码，按首次出现顺序编号"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def write_rule_corpus(rows, path):
+    """
+    写出列式二进制规则库
+    :param rows: 规则字典序列，字段与 createRuleData.CSV_FIELDNAMES 相同，rule_structure 为列表或 JSON 字符串
+    :param path: 输出文件
+    :return: 规则条数
+    """
+    dictionaries = {name: _Dictionary() for name in DICTIONARY_COLUMNS + ("op", "attribute")}
+    columns = {name: array("I") for name in DICTIONARY_COLUMNS}
+    ids = []
+    names = bytearray()
+    name_offset = array("q", [0])
+    created_time = array("q")
+    updated_time = array("q")
+    step_offset = array("q", [0])
+    step_op = array("I")
+    step_threshold = array("d")
+    step_flag = array("B")
+    step_attr_offset = array("q", [0])
+    step_attr = array("I")
+    attribute_sets = _Dictionary()
+    rule_attribute_set = array("i")
+
+    for row in rows:
+        ids.append(row["rule_id"].encode("utf-8"))
+        names += row["rule_name"].encode("utf-8")
+        name_offset.append(len(names))
+        for name in DICTIONARY_COLUMNS:
+            columns[name].append(dictionaries[name].encode(row[name]))
+        created_time.append(int(row["created_time"]))
+        updated_time.append(int(row["updated_time"]))
+
+        structure = row["rule_structure"]
+        if isinstance(structure, str):
+            structure = json.loads(structure)
+        rule_attributes = set()
+        for op, attributes, threshold in structure:
+            step_op.append(dictionaries["op"].encode(op))
+            if threshold is None:
+                step_threshold.append(float("nan"))
+                step_flag.append(THRESHOLD_NONE)
+            else:
+                step_threshold.append(float(threshold))
+                step_flag.append(THRESHOLD_INT if isinstance(threshold, int) and not isinstance(threshold, bool) else 0)
+            for attribute in attributes:
+                code = dictionaries["attribute"].encode(attribute)
+                step_attr.append(code)
+                rule_attributes.add(code)
+            step_attr_offset.append(len(step_attr))
+        step_offset.append(len(step_op))
+        rule_attribute_set.append(attribute_sets.encode(tuple(sorted(rule_attributes))))
+
+    count = len(ids)
+    id_width = max((len(rule_id) for rule_id in ids), default=1)
+    id_array = np.array(ids, dtype=f"S{id_width}") if ids else np.zeros(0, dtype="S1")
+    set_offset = array("q", [0])
+    set_attr = array("I")
+    for attribute_set in attribute_sets.values:
+        set_attr.extend(attribute_set)
+        set_offset.append(len(set_attr))
+
+    arrays = {
+        "rule_id": id_array,
+        "id_order": np.argsort(id_array, kind="stable").astype("<i4"),
+        "name_offset": np.frombuffer(name_offset, dtype="<i8"),
+        "name_blob": np.frombuffer(bytes(names), dtype="u1"),
+        "created_time": np.frombuffer(created_time, dtype="<i8"),
+        "updated_time": np.frombuffer(updated_time, dtype="<i8"),
+        "step_offset": np.frombuffer(step_offset, dtype="<i8"),
+        "step_op": np.frombuffer(step_op, dtype="<u4").astype(_code_dtype(len(dictionaries["op"].values))),
+        "step_threshold": np.frombuffer(step_threshold, dtype="<f8"),
+        "step_flag": np.frombuffer(step_flag, dtype="u1"),
+        "step_attr_offset": np.frombuffer(step_attr_offset, dtype="<i8"),
+        "step_attr": np.frombuffer(step_attr, dtype="<u4").astype(_code_dtype(len(dictionaries["attribute"].values))),
+        "attribute_set": np.frombuffer(rule_attribute_set, dtype="<i4"),
+        "set_offset": np.frombuffer(set_offset, dtype="<i8"),
+        "set_attr": np.frombuffer(set_attr, dtype="<u4").astype(_code_dtype(len(dictionaries["attribute"].values))),
+    }
+    for name in DICTIONARY_COLUMNS:
+        arrays[name] = np.frombuffer(columns[name], dtype="<u4").astype(_code_dtype(len(dictionaries[name].values)))
+
+    # 先计算各数组在文件中的位置（相对数据区起点），再写头部与数据
+    layout = {}
+    position = 0
+    for name, values in arrays.items():
+        position = (position + ALIGN - 1) // ALIGN * ALIGN
+        layout[name] = [values.dtype.str, len(values), position]
+        position += values.nbytes
+    header = json.dumps({
+        "version": VERSION,
+        "rules": count,
+        "steps": len(step_op),
+        "dictionaries": {name: dictionary.values for name, dictionary in dictionaries.items()},
+        "arrays": layout
+    }, ensure_ascii=False).encode("utf-8")
+    data_start = (len(MAGIC) + 8 + len(header) + ALIGN - 1) // ALIGN * ALIGN
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<II", VERSION, len(header)) + header)
+        for name, values in arrays.items():
+            f.seek(data_start + layout[name][2])
+            f.write(np.ascontiguousarray(values).tobytes())
+        f.truncate(data_start + position)
+    os.replace(tmp_path, path)
+    return count
+
+
+def is_rule_corpus(path):
+    """文件是否为列式二进制规则库"""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class MappedRuleCorpus:
+    """内存映射的列式二进制规则库，数组直接引用映射的页，不复制"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} 不是列式二进制规则库")
+        version, header_length = struct.unpack_from("<II", self._mmap, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f"不支持的规则库格式版本 {version}")
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_length].decode("utf-8"))
+        data_start = (header_start + header_length + ALIGN - 1) // ALIGN * ALIGN
+
+        self.dictionaries = header["dictionaries"]
+        self.step_count = header["steps"]
+        self.arrays = {name: np.frombuffer(self._mmap, dtype=dtype, count=length, offset=data_start + offset)
+                       for name, (dtype, length, offset) in header["arrays"].items()}
+        for name, values in self.arrays.items():
+            setattr(self, name, values)
+
+        self.operators = self.dictionaries["op"]
+        self.attributes = self.dictionaries["attribute"]
+        self._attribute_codes = {attribute: code for code, attribute in enumerate(self.attributes)}
+        # 属性集合数量远小于规则数，解码后常驻内存
+        self.attribute_sets = [
+            frozenset(self.attributes[code] for code in self.set_attr[self.set_offset[i]:self.set_offset[i + 1]])
+            for i in range(len(self.set_offset) - 1)
+        ]
+
+    def __len__(self):
+        return len(self.rule_id)
+
+    def code(self, column, value):
+        """字符串列取值对应的编码，不存在时返回 None"""
+        if column == "attribute":
+            return self._attribute_codes.get(value)
+        try:
+            return self.dictionaries[column].index(value)
+        except ValueError:
+            return None
+
+    def position(self, rule_id):
+        """规则ID所在行号，在按ID排序的置换上二分查找，不存在时返回 None"""
+        key = rule_id.encode("utf-8")
+        if len(key) > self.rule_id.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self.rule_id, key, sorter=self.id_order))
+        if i < len(self.id_order):
+            position = int(self.id_order[i])
+            if self.rule_id[position] == key:
+                return position
+        return None
+
+    def rule_id_at(self, position):
+        return self.rule_id[position].decode("utf-8")
+
+    def rule_name_at(self, position):
+        return bytes(self.name_blob[self.name_offset[position]:self.name_offset[position + 1]]).decode("utf-8")
+
+    def value_at(self, column, position):
+        """字典编码列的取值"""
+        return self.dictionaries[column][self.arrays[column][position]]
+
+    def structure_at(self, position):
+        """规则结构，与 CSV 中 rule_structure 解析后相同：((算子, 属性元组, 阈值), ...)"""
+        steps = []
+        for step in range(self.step_offset[position], self.step_offset[position + 1]):
+            flag = self.step_flag[step]
+            if flag == THRESHOLD_NONE:
+                threshold = None
+            elif flag == THRESHOLD_INT:
+                threshold = int(self.step_threshold[step])
+            else:
+                threshold = float(self.step_threshold[step])
+            attributes = tuple(self.attributes[code] for code in
+                               self.step_attr[self.step_attr_offset[step]:self.step_attr_offset[step + 1]])
+            steps.append((self.operators[self.step_op[step]], attributes, threshold))
+        return tuple(steps)
+
+    def attribute_set_at(self, position):
+        return self.attribute_sets[self.attribute_set[position]]
+
+    def iter_structures(self, chunk_size=65536):
+        """按行号顺序产出 (行号, 规则结构)，分块批量解码，用于构建规则DAG等全量遍历"""
+        operators = self.operators
+        attributes = self.attributes
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            offsets = self.step_offset[start:stop + 1].tolist()
+            first, last = offsets[0], offsets[-1]
+            ops = self.step_op[first:last].tolist()
+            thresholds = self.step_threshold[first:last].tolist()
+            flags = self.step_flag[first:last].tolist()
+            attr_offsets = self.step_attr_offset[first:last + 1].tolist()
+            attrs = self.step_attr[attr_offsets[0]:attr_offsets[-1]].tolist()
+            base = attr_offsets[0]
+            for i in range(stop - start):
+                steps = []
+                for step in range(offsets[i] - first, offsets[i + 1] - first):
+                    flag = flags[step]
+                    threshold = None if flag == THRESHOLD_NONE else \
+                        int(thresholds[step]) if flag == THRESHOLD_INT else thresholds[step]
+                    names = tuple(attributes[code] for code in
+                                  attrs[attr_offsets[step] - base:attr_offsets[step + 1] - base])
+                    steps.append((operators[ops[step]], names, threshold))
+                yield start + i, tuple(steps)
@@ -0,0 +1,333 @@
+from bisect import bisect_right
+
+from rulePlan import bind, parse_combiner, parse_step
+
+# ==============================
+# 多规则共享子表达式求值（规则DAG）
+# 所有规则合并为三层：操作数节点（如 A-B、A/B）-> 阈值比较节点（操作数 >= 阈值）-> 规则（逻辑组合）
+# 相同的 (运算, 特征) 在一条申报上只计算一次，供所有引用它的规则使用
+# ==============================
+
+
+def _ratio(A, B):
+    if B == 0:
+        raise ValueError("除数B不能为0")
+    return A / B
+
+
+def _diff_ratio(A, B):
+    if B == 0:
+        raise ValueError("基准值B不能为0")
+    return (A - B) / B * 100
+
+
+def _mean(A, B):
+    return (A + B) / 2
+
+
+def _variance(A, B):
+    mean = (A + B) / 2
+    return ((A - mean)**2 + (B - mean)**2) / 2
+
+
+# 可拆分为“操作数 >= 阈值”的算子：算子名称 -> (操作数名称, 操作数计算函数)
+# 计算公式与 operators.py 中对应算子保持一致，结果逐位相同
+OPERAND_KERNELS = {
+    "diff_operator": ("diff", lambda A, B: A - B),
+    "mul_operator": ("mul", lambda A, B: A * B),
+    "ratio_operator": ("ratio", _ratio),
+    "diff_ratio_operator": ("diff_ratio", _diff_ratio),
+    "avg_operator": ("mean", _mean),
+    "var_operator": ("variance", _variance),
+}
+
+
+class RuleDAG:
+    """合并多条规则的求值图"""
+
+    def __init__(self):
+        self.operands = []  # (特征名称元组, 计算函数)
+        self.comparisons = []  # (操作数序号, 阈值)；阈值为 None 时操作数本身即 0/1 结果
+        self.rule_ids = []
+        self.rule_steps = []  # 每条规则引用的比较节点序号
+        self.rule_combiners = []  # 每条规则的逻辑算子，单步规则为 None
+        self.invalid = {}  # 无法编译的规则ID -> 错误信息
+        self.step_count = 0
+        self._operand_index = {}
+        self._comparison_index = {}
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.rule_ids)
+
+    def _operand(self, key, feature_names, compute):
+        index = self._operand_index.get(key)
+        if index is None:
+            index = self._operand_index[key] = len(self.operands)
+            self.operands.append((feature_names, compute))
+        return index
+
+    def _comparison(self, operand, threshold):
+        key = (operand, threshold)
+        index = self._comparison_index.get(key)
+        if index is None:
+            index = self._comparison_index[key] = len(self.comparisons)
+            self.comparisons.append(key)
+        return index
+
+    def _step_node(self, index, rule):
+        operator_name, feature_names, threshold, kind, func = parse_step(index, rule)
+        if operator_name in OPERAND_KERNELS:
+            name, compute = OPERAND_KERNELS[operator_name]
+            operand = self._operand((name, feature_names), feature_names, lambda values: compute(*values))
+            return self._comparison(operand, threshold)
+        # 其他算子整体作为一个节点，按 (算子, 特征, 阈值) 去重；不使用阈值的算子忽略阈值
+        key = (operator_name, feature_names) if kind == "plain" else (operator_name, feature_names, repr(threshold))
+        operand = self._operand(key, feature_names, bind(kind, func, threshold))
+        return self._comparison(operand, None)
+
+    def add_rule(self, rule_id, rules):
+        """加入一条规则（generate_risk_indicator 格式），无法编译时记录到 invalid"""
+        try:
+            _, combiner = parse_combiner(rules)
+            step_rules = rules if combiner is None else rules[:-1]
+            steps = tuple(self._step_node(i, rule) for i, rule in enumerate(step_rules))
+        except ValueError as e:
+            self.invalid[rule_id] = str(e)
+            return
+        self._positions[rule_id] = len(self.rule_ids)
+        self.rule_ids.append(rule_id)
+        self.rule_steps.append(steps)
+        self.rule_combiners.append(combiner)
+        self.step_count += len(steps)
+
+    @classmethod
+    def build(cls, items):
+        """由 (规则ID, 规则列表) 序列构建"""
+        dag = cls()
+        for rule_id, rules in items:
+            dag.add_rule(rule_id, rules)
+        return dag
+
+    def position(self, rule_id):
+        return self._positions.get(rule_id)
+
+    def evaluate(self, risk_features, positions=None):
+        """
+        在一条申报上求值
+        :param risk_features: 风险特征字典
+        :param positions: 只求值这些规则（规则序号），None 表示全部规则
+        :return: (结果字典 {规则ID: 0/1}, 错误字典 {规则ID: 错误信息})
+        """
+        operand_values = {}  # 操作数序号 -> 值或异常
+        comparison_results = {}  # 比较节点序号 -> 0/1 或异常
+        operands = self.operands
+        comparisons = self.comparisons
+        results = {}
+        errors = {}
+
+        for position in (range(len(self.rule_ids)) if positions is None else positions):
+            step_results = []
+            error = None
+            for step in self.rule_steps[position]:
+                result = comparison_results.get(step)
+                if result is None:
+                    operand, threshold = comparisons[step]
+                    value = operand_values.get(operand)
+                    if value is None:
+                        feature_names, compute = operands[operand]
+                        try:
+                            value = compute([risk_features[name] for name in feature_names])
+                        except KeyError as e:
+                            value = ValueError(f"缺少特征 {e.args[0]}")
+                        except Exception as e:
+                            value = e
+                        operand_values[operand] = value
+                    if isinstance(value, Exception) or threshold is None:
+                        result = value
+                    else:
+                        try:
+                            result = 1 if value >= threshold else 0
+                        except TypeError as e:
+                            result = e
+                    comparison_results[step] = result
+                if isinstance(result, Exception):
+                    error = result
+                    break
+                step_results.append(result)
+
+            rule_id = self.rule_ids[position]
+            if error is not None:
+                errors[rule_id] = str(error)
+                continue
+            combiner = self.rule_combiners[position]
+            results[rule_id] = step_results[0] if combiner is None else combiner(*step_results)
+
+        return results, errors
+
+    def stats(self):
+        return {
+            "rules": len(self.rule_ids),
+            "invalid_rules": len(self.invalid),
+            "total_steps": self.step_count,
+            "distinct_comparisons": len(self.comparisons),
+            "distinct_operands": len(self.operands)
+        }
+
+
+# 只有全部步骤满足才触发的逻辑算子，可以按“触发步骤计数”找出触发的规则
+CONJUNCTIVE_COMBINERS = {"and_operator", "and3_operator"}
+
+
+class ThresholdIndex:
+    """
+    阈值有序索引：同一操作数上的所有比较节点按阈值排序
+    每个算子都是“操作数 >= 阈值”的单调判断，操作数算出后二分查找即得到全部满足的阈值（有序前缀）；
+    单步规则直接按阈值排序，触发的规则就是前缀切片；多步“与”规则统计触发步骤数，
+    其他逻辑组合的规则交给规则DAG逐条求值；无法编译的规则按所需属性集合分组，属性齐全时记为错误
+    """
+
+    def __init__(self, dag, rule_attributes=None):
+        """
+        :param dag: 规则DAG
+        :param rule_attributes: rule_attributes(规则ID) 返回规则所需的属性集合，用于报告无法编译的规则；None 时不报告
+        """
+        self.dag = dag
+        self.sorted_comparisons = {}  # 操作数序号 -> (升序阈值列表, 对应比较节点序号列表)
+        self.sorted_single_rules = {}  # 操作数序号 -> (升序阈值列表, 对应单步规则序号列表)
+        self.predicates = {}  # 操作数序号 -> 比较节点序号（阈值为 None，操作数本身即结果）
+        self.postings = {}  # 比较节点序号 -> 引用它的多步“与”规则序号
+        self.required = []  # 每条规则需要触发的步骤数，0 表示不走计数路径
+        self.fallback = []  # 交给规则DAG求值的规则序号
+        self.invalid_groups = {}  # 所需属性集合 -> [(无法编译的规则ID, 错误信息)]
+        if rule_attributes is not None:
+            for rule_id, error in dag.invalid.items():
+                self.invalid_groups.setdefault(rule_attributes(rule_id), []).append(
+                    (rule_id, f"规则 {rule_id} 无法编译: {error}"))
+
+        pairs = {}
+        singles = {}
+        for position, (steps, combiner) in enumerate(zip(dag.rule_steps, dag.rule_combiners)):
+            if not self._indexable(steps) or (combiner is not None and combiner.__name__ not in CONJUNCTIVE_COMBINERS):
+                self.fallback.append(position)
+                self.required.append(0)
+                continue
+            self.required.append(len(steps))
+            if combiner is None:
+                operand, threshold = dag.comparisons[steps[0]]
+                if threshold is not None:
+                    singles.setdefault(operand, []).append((threshold, position))
+                    continue
+            for step in set(steps):
+                self.postings.setdefault(step, []).append(position)
+            if combiner is not None and len(set(steps)) != len(steps):
+                self.required[position] = len(set(steps))  # 同一步骤重复出现只计一次
+
+        for step, (operand, threshold) in enumerate(dag.comparisons):
+            if threshold is None:
+                self.predicates[operand] = step
+            elif self._numeric(threshold):
+                pairs.setdefault(operand, []).append((threshold, step))
+        for operand, items in pairs.items():
+            items.sort()
+            self.sorted_comparisons[operand] = ([t for t, _ in items], [s for _, s in items])
+        for operand, items in singles.items():
+            items.sort()
+            self.sorted_single_rules[operand] = ([t for t, _ in items], [p for _, p in items])
+
+    @staticmethod
+    def _numeric(threshold):
+        return isinstance(threshold, (int, float)) and not isinstance(threshold, bool) and threshold == threshold
+
+    def _indexable(self, steps):
+        for step in steps:
+            threshold = self.dag.comparisons[step][1]
+            if threshold is not None and not self._numeric(threshold):
+                return False
+        return True
+
+    def fired_rules(self, risk_features):
+        """
+        找出在该申报上触发（结果为1）的全部规则
+        只考虑所需特征都在 risk_features 中的规则；操作数计算出错（如除数为0）时，引用它的规则记为错误，
+        无法编译的规则也记为错误（与逐条求值一致）
+        :return: (触发的规则ID列表, 错误字典 {规则ID: 错误信息})
+        """
+        dag = self.dag
+        fired = []
+        counts = {}
+        errors = {}
+        operand_errors = {}
+        missing = set()  # 缺少特征的操作数
+
+        def touch(step):
+            for position in self.postings.get(step, ()):
+                counts[position] = counts.get(position, 0) + 1
+
+        for operand, (feature_names, compute) in enumerate(dag.operands):
+            if not all(name in risk_features for name in feature_names):
+                missing.add(operand)
+                continue
+            try:
+                value = compute([risk_features[name] for name in feature_names])
+            except Exception as e:
+                operand_errors[operand] = str(e)
+                continue
+
+            if operand in self.predicates:
+                if value == 1:
+                    touch(self.predicates[operand])
+                continue
+            if value != value:
+                continue  # NaN 不满足任何阈值
+            try:
+                sorted_steps = self.sorted_comparisons.get(operand)
+                if sorted_steps is not None:
+                    for step in sorted_steps[1][:bisect_right(sorted_steps[0], value)]:
+                        touch(step)
+                sorted_singles = self.sorted_single_rules.get(operand)
+                if sorted_singles is not None:
+                    fired.extend(sorted_singles[1][:bisect_right(sorted_singles[0], value)])
+            except TypeError as e:
+                operand_errors[operand] = str(e)
+
+        required = self.required
+        fired.extend(position for position, count in counts.items() if count == required[position])
+        fired_ids = [dag.rule_ids[position] for position in fired]
+
+        if operand_errors:
+            # 只检查引用出错操作数的规则：其比较节点的倒排链与单步规则
+            for operand, error in operand_errors.items():
+                positions = list(self.sorted_single_rules.get(operand, ((), ()))[1])
+                steps = list(self.sorted_comparisons.get(operand, ((), ()))[1])
+                if operand in self.predicates:
+                    steps.append(self.predicates[operand])
+                for step in steps:
+                    positions.extend(self.postings.get(step, ()))
+                for position in positions:
+                    rule_id = dag.rule_ids[position]
+                    if rule_id in errors:
+                        continue
+                    operands = [dag.comparisons[step][0] for step in dag.rule_steps[position]]
+                    if missing.isdisjoint(operands):
+                        errors[rule_id] = operand_errors[next(o for o in operands if o in operand_errors)]
+            fired_ids = [rule_id for rule_id in fired_ids if rule_id not in errors]
+
+        if self.fallback:
+            results, fallback_errors = dag.evaluate(risk_features, self.fallback)
+            fired_ids.extend(rule_id for rule_id, result in results.items() if result == 1)
+            errors.update((rule_id, error) for rule_id, error in fallback_errors.items()
+                          if not error.startswith("缺少特征"))
+        for attributes, invalid in self.invalid_groups.items():
+            if attributes.issubset(risk_features):
+                errors.update(invalid)
+        return fired_ids, errors
+
+    def stats(self):
+        return {
+            "indexed_operands": len(self.sorted_comparisons),
+            "single_step_operands": len(self.sorted_single_rules),
+            "conjunctive_rules": sum(1 for count in self.required if count),
+            "fallback_rules": len(self.fallback),
+            "invalid_rules": sum(len(invalid) for invalid in self.invalid_groups.values())
+        }
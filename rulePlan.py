@@ -0,0 +1,363 @@
+import hashlib
+import inspect
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+import batchOperators as batch_ops
+import operators as ops
+from metrics import OPERATOR_ERRORS
+
+# ==============================
+# 规则编译：将规则列表编译为可复用的评估计划
+# ==============================
+
+# 不需要阈值参数的属性算子：operator(*features)
+NO_THRESHOLD_OPERATORS = {"cmp_operator", "subset_operator"}
+# 加权算子：第一个特征为权重列表，其余为特征值列表
+WEIGHTED_OPERATORS = {"weighted_avg_operator"}
+
+
+def resolve_operator(operator_name, module=ops):
+    """按名称查找算子模块（默认 operators.py）中定义的算子函数，找不到时抛出 ValueError"""
+    func = getattr(module, operator_name, None) if isinstance(operator_name, str) else None
+    if not inspect.isfunction(func) or func.__module__ != module.__name__:
+        raise ValueError(f"未找到算子 {operator_name}")
+    return func
+
+
+@lru_cache(maxsize=None)
+def operator_arity(func):
+    """算子的位置参数个数"""
+    return len(inspect.signature(func).parameters)
+
+
+def rules_signature(rules):
+    """规则列表的规范化哈希，元组与列表形式、字典键顺序不同的同一规则得到相同的键"""
+    canonical = json.dumps(rules, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=repr)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _check_binding(operator_name, func, arg_count, threshold):
+    """校验算子参数个数与阈值，返回调用方式：plain / weighted / threshold"""
+    arity = operator_arity(func)
+    if operator_name in WEIGHTED_OPERATORS:
+        if arg_count < 2:
+            raise ValueError(f"算子 {operator_name} 至少需要权重和一个特征值")
+        kind = "weighted"
+    elif operator_name in NO_THRESHOLD_OPERATORS:
+        if arg_count != arity:
+            raise ValueError(f"算子 {operator_name} 需要 {arity} 个特征，实际 {arg_count} 个")
+        return "plain"
+    else:
+        if arg_count + 1 != arity:
+            raise ValueError(f"算子 {operator_name} 需要 {arity - 1} 个特征，实际 {arg_count} 个")
+        kind = "threshold"
+    if threshold is None:
+        raise ValueError(f"算子 {operator_name} 缺少阈值")
+    return kind
+
+
+def bind(kind, func, threshold):
+    """按调用方式绑定算子，返回只接收特征值列表（或特征列列表）的函数"""
+    if kind == "weighted":
+        return lambda values: func(values[0], values[1:], threshold)
+    if kind == "plain":
+        return lambda values: func(*values)
+    return lambda values: func(*values, threshold)
+
+
+class PlanStep:
+    """属性算子步骤：算子、参数绑定（含批量版本）和两种结果下的描述均在编译期确定"""
+    __slots__ = ("step", "operator_name", "feature_names", "threshold", "kind", "call", "batch_call",
+                 "desc_met", "desc_unmet")
+
+    def __init__(self, step, operator_name, feature_names, threshold, kind, call, batch_call, desc_met, desc_unmet):
+        self.step = step
+        self.operator_name = operator_name
+        self.feature_names = feature_names
+        self.threshold = threshold
+        self.kind = kind
+        self.call = call
+        self.batch_call = batch_call
+        self.desc_met = desc_met
+        self.desc_unmet = desc_unmet
+
+
+class RulePlan:
+    """编译后的规则：重复评估时只做特征取值和算子运算"""
+
+    def __init__(self, signature, steps, combiner_name, combiner):
+        self.signature = signature
+        self.steps = steps
+        self.combiner_name = combiner_name
+        self.combiner = combiner
+        self.batch_combiner = resolve_operator(combiner_name, batch_ops) if combiner_name is not None else None
+        self.required_features = frozenset(name for step in steps for name in step.feature_names)
+        self._logic_descriptions = {}
+
+    def _logic_description(self, input_results, final_result):
+        key = tuple(input_results)
+        desc = self._logic_descriptions.get(key)
+        if desc is None:
+            from riskIndicatorDescription import get_logical_operator_description
+            desc = get_logical_operator_description(self.combiner_name, input_results, final_result)
+            self._logic_descriptions[key] = desc
+        return desc
+
+    def _run_step(self, step, risk_features):
+        """计算单个步骤，返回 (结果, 计算步骤描述)"""
+        try:
+            values = [risk_features[name] for name in step.feature_names]
+        except KeyError as e:
+            raise ValueError(f"缺少特征 {e.args[0]}") from None
+        try:
+            result = step.call(values)
+        except Exception:
+            OPERATOR_ERRORS.inc(operator=step.operator_name)
+            raise
+        return result, {
+            "step": step.step,
+            "operator": step.operator_name,
+            "input_features": dict(zip(step.feature_names, values)),
+            "threshold": step.threshold,
+            "result": result,
+            "description": step.desc_met if result == 1 else step.desc_unmet
+        }
+
+    def _finish(self, risk_features, rules, intermediate_results, calculation_steps):
+        """组合各步骤结果，生成完整的多维计算结构"""
+        if self.combiner is None:
+            final_result = intermediate_results[0]
+        else:
+            final_result = self.combiner(*intermediate_results)
+            calculation_steps.append({
+                "step": len(calculation_steps) + 1,
+                "operator": self.combiner_name,
+                "input_results": intermediate_results,
+                "result": final_result,
+                "description": self._logic_description(intermediate_results, final_result)
+            })
+
+        return {
+            "original_features": risk_features,
+            "calculation_steps": calculation_steps,
+            "intermediate_results": intermediate_results,
+            "final_risk_indicator": final_result,
+            "rules_applied": rules
+        }
+
+    def evaluate(self, risk_features, rules):
+        """按计划计算风险指标，输出结构与 generate_risk_indicator 一致"""
+        intermediate_results = []
+        calculation_steps = []
+        for step in self.steps:
+            result, calculation_step = self._run_step(step, risk_features)
+            intermediate_results.append(result)
+            calculation_steps.append(calculation_step)
+        return self._finish(risk_features, rules, intermediate_results, calculation_steps)
+
+    def evaluate_indicator(self, risk_features):
+        """只计算最终风险指标（不生成计算结构），结果与出错情况都与 evaluate 相同"""
+        intermediate_results = [self._run_step(step, risk_features)[0] for step in self.steps]
+        return intermediate_results[0] if self.combiner is None else self.combiner(*intermediate_results)
+
+    def reevaluate(self, risk_features, rules, previous, step_indices):
+        """
+        特征部分变化后的增量计算：只重算 step_indices 中的步骤，其余步骤沿用上次的结果
+        :param previous: 同一计划上次 evaluate/reevaluate 的输出
+        :param step_indices: 输入特征有变化的步骤下标（从 0 开始）
+        """
+        intermediate_results = list(previous["intermediate_results"])
+        calculation_steps = previous["calculation_steps"][:len(self.steps)]
+        for index in step_indices:
+            intermediate_results[index], calculation_steps[index] = self._run_step(self.steps[index], risk_features)
+        return self._finish(risk_features, rules, intermediate_results, calculation_steps)
+
+    def evaluate_batch(self, feature_table, rules):
+        """
+        在列式特征表上批量计算风险指标
+        :param feature_table: 特征表，键为特征名称，值为等长的特征列
+        :param rules: 原始规则列表
+        :return: 各步骤结果掩码、逐行错误掩码及最终风险指标掩码
+        """
+        row_count = None
+        for name in self.required_features:
+            if name not in feature_table:
+                raise ValueError(f"缺少特征 {name}")
+            if row_count is None:
+                row_count = len(feature_table[name])
+            elif len(feature_table[name]) != row_count:
+                raise ValueError(f"特征列 {name} 长度不一致")
+        row_count = row_count or 0
+
+        invalid = np.zeros(row_count, dtype=bool)
+        intermediate_results = []
+        calculation_steps = []
+        for step in self.steps:
+            result, errors = step.batch_call([feature_table[name] for name in step.feature_names])
+            if errors is not None:
+                invalid |= errors
+                error_count = int(np.count_nonzero(errors))
+                if error_count:
+                    OPERATOR_ERRORS.inc(error_count, operator=step.operator_name)
+            intermediate_results.append(result)
+            calculation_steps.append({
+                "step": step.step,
+                "operator": step.operator_name,
+                "feature_names": list(step.feature_names),
+                "threshold": step.threshold,
+                "result": result,
+                "errors": errors
+            })
+
+        if self.combiner is None:
+            final_result = intermediate_results[0].copy()
+        else:
+            final_result = self.batch_combiner(*intermediate_results)
+            if isinstance(final_result, tuple):
+                final_result = final_result[0]  # 以属性算子作为组合算子时只取结果掩码
+            calculation_steps.append({
+                "step": len(calculation_steps) + 1,
+                "operator": self.combiner_name,
+                "result": final_result
+            })
+        final_result[invalid] = 0
+
+        return {
+            "row_count": row_count,
+            "calculation_steps": calculation_steps,
+            "intermediate_results": np.vstack(intermediate_results),
+            "final_risk_indicator": final_result,
+            "valid": ~invalid,
+            "rules_applied": rules
+        }
+
+
+def parse_step(index, rule):
+    """校验单条属性算子规则，返回 (算子名称, 特征名称元组, 阈值, 调用方式, 算子函数)，index 从 0 开始"""
+    if not isinstance(rule, (list, tuple)) or len(rule) != 3:
+        raise ValueError(f"第{index + 1}条规则格式错误，应为 (算子名称, 特征名称列表, 阈值)")
+    operator_name, feature_names, threshold = rule
+    func = resolve_operator(operator_name)
+    if not isinstance(feature_names, (list, tuple)) or not feature_names \
+            or not all(isinstance(name, str) for name in feature_names):
+        raise ValueError(f"第{index + 1}条规则的特征名称列表无效: {feature_names}")
+    feature_names = tuple(feature_names)
+    kind = _check_binding(operator_name, func, len(feature_names), threshold)
+    return operator_name, feature_names, threshold, kind, func
+
+
+def parse_combiner(rules):
+    """校验规则列表的组合方式，返回 (逻辑算子名称, 逻辑算子函数)；单条属性算子规则返回 (None, None)"""
+    if not rules:
+        raise ValueError("规则列表为空")
+    if not isinstance(rules, (list, tuple)):
+        raise ValueError("规则格式错误，应为规则列表")
+    if len(rules) == 1:
+        return None, None
+
+    last_rule = rules[-1]
+    if not isinstance(last_rule, (list, tuple)) or not last_rule:
+        raise ValueError("逻辑算子规则格式错误")
+    combiner_name = last_rule[0]
+    combiner = resolve_operator(combiner_name)
+
+    step_count = len(rules) - 1
+    if step_count not in (2, 3):
+        raise ValueError("不支持的规则数量，仅支持二元或三元组合")
+    if operator_arity(combiner) != step_count:
+        raise ValueError(f"逻辑算子 {combiner_name} 需要 {operator_arity(combiner)} 个中间结果，实际 {step_count} 个")
+    return combiner_name, combiner
+
+
+def compile_step(index, rule):
+    """校验并编译单条属性算子规则，index 从 0 开始"""
+    from riskIndicatorDescription import get_operator_description
+
+    operator_name, feature_names, threshold, kind, func = parse_step(index, rule)
+    return PlanStep(
+        index + 1, operator_name, feature_names, threshold, kind, bind(kind, func, threshold),
+        bind(kind, resolve_operator(operator_name, batch_ops), threshold),
+        get_operator_description(operator_name, feature_names, threshold, 1),
+        get_operator_description(operator_name, feature_names, threshold, 0)
+    )
+
+
+def compile_rules(rules, signature=None):
+    """
+    校验并编译规则列表
+    :param rules: 风险规则列表，前 N 条为属性算子规则 (算子名称, 特征名称列表, 阈值)，最后一条为逻辑算子规则；
+                  只有一条属性算子规则时不需要逻辑算子，该规则的结果即最终风险指标；
+                  也可以是嵌套的表达式树 {"op": 逻辑算子名称, "args": [...]}（见 ruleTree.py）
+    :param signature: 规则哈希，未提供时现场计算
+    :return: RulePlan，表达式树为 RuleTreePlan
+    """
+    if isinstance(rules, dict):
+        from ruleTree import compile_tree
+        return compile_tree(rules, signature)
+    combiner_name, combiner = parse_combiner(rules)
+    if signature is None:
+        signature = rules_signature(rules)
+    if combiner is None:
+        return RulePlan(signature, [compile_step(0, rules[0])], None, None)
+    steps = [compile_step(i, rule) for i, rule in enumerate(rules[:-1])]
+    return RulePlan(signature, steps, combiner_name, combiner)
+
+
+class PlanCache:
+    """按规则哈希缓存编译结果的 LRU 缓存"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, rules):
+        """返回规则对应的编译计划，未命中时编译并放入缓存"""
+        signature = rules_signature(rules)
+        with self._lock:
+            plan = self._plans.get(signature)
+            if plan is not None:
+                self._plans.move_to_end(signature)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        plan = compile_rules(rules, signature)
+        with self._lock:
+            self._plans[signature] = plan
+            self._plans.move_to_end(signature)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+                self.evictions += 1
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._plans),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# 全局计划缓存
+plan_cache = PlanCache()
+
+
+def get_plan(rules):
+    """从全局缓存获取规则的编译计划"""
+    return plan_cache.get(rules)
@@ -0,0 +1,287 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from ruleStore import MappedRuleStore, OverlayRuleStore, StoredRule
+
+# ==============================
+# 规则库快照：规则库及其全部派生结构（类型/状态/属性索引、规则DAG、阈值索引、各规则的编译计划）打包为带版本号的只读快照
+# 内存映射规则库的规则DAG和阈值索引在启动时不构建（首次使用时加锁构建），保持启动快、多进程共享页缓存；
+# 重新加载时若上一版本已经建好（或设置了 warm_index），则在后台线程中建好后再发布，请求不会等待构建
+# 重新加载和编辑规则时在后台线程中基于当前快照构建新快照，建好后整体替换当前快照的引用；
+# 请求开始时取一次当前快照，读取不加锁，也不会看到构建到一半的索引
+# 编辑记录校验时的快照版本：构建前规则库已从文件重新加载时拒绝该编辑（编辑针对的是重新加载前的规则）
+# ==============================
+
+# 编辑规则时可以修改的字段；thresholds 按步骤顺序替换阈值，delete 为 true 时删除规则
+EDITABLE_FIELDS = ("rule_name", "rule_type", "rule_status", "rule_structure", "thresholds", "delete")
+# 新增规则时必须给出的字段
+REQUIRED_FIELDS = ("rule_type", "rule_status", "rule_structure")
+
+
+def _threshold(value):
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise ValueError(f"阈值应为数字或 null: {value!r}")
+    return value
+
+
+def parse_structure(rule_structure):
+    """校验 rule_structure（[[算子名称, [属性...], 阈值], ...]），返回规则库使用的元组形式"""
+    if not isinstance(rule_structure, list) or not rule_structure:
+        raise ValueError("rule_structure 应为非空列表")
+    steps = []
+    for step in rule_structure:
+        if not isinstance(step, list) or len(step) != 3 or not isinstance(step[0], str) \
+                or not isinstance(step[1], list) or not all(isinstance(a, str) for a in step[1]):
+            raise ValueError(f"规则步骤格式错误: {step!r}")
+        steps.append((step[0], tuple(step[1]), _threshold(step[2])))
+    return tuple(steps)
+
+
+def edited_rule(rule, edit):
+    """
+    按一条编辑生成新的 StoredRule，不修改原规则
+    :param rule: 原规则，None 表示新增
+    :param edit: {"rule_id": ..., 要修改的字段...}
+    """
+    rule_id = edit["rule_id"]
+    if rule is None:
+        missing = [field for field in REQUIRED_FIELDS if field not in edit]
+        if missing:
+            raise ValueError(f"规则 {rule_id} 不存在，新增规则需要 {', '.join(missing)}")
+    structure = parse_structure(edit["rule_structure"]) if "rule_structure" in edit else rule.structure
+    if "thresholds" in edit:
+        thresholds = edit["thresholds"]
+        if not isinstance(thresholds, list) or len(thresholds) != len(structure):
+            raise ValueError(f"规则 {rule_id} 有 {len(structure)} 个步骤，thresholds 应为等长列表")
+        structure = tuple((op, attributes, _threshold(threshold))
+                          for (op, attributes, _), threshold in zip(structure, thresholds))
+    attributes = frozenset(a for step in structure for a in step[1])
+    if rule is not None and attributes == rule.attributes:
+        attributes = rule.attributes  # 沿用原规则的属性集合对象（加载时已复用相同集合）
+    return StoredRule(
+        rule_id,
+        edit.get("rule_name", rule.rule_name if rule is not None else ""),
+        edit.get("rule_type", rule.rule_type if rule is not None else None),
+        edit.get("rule_status", rule.rule_status if rule is not None else None),
+        structure, attributes, int(time.time())
+    )
+
+
+def resolve_edits(store, edits):
+    """
+    按顺序校验编辑（后面的编辑看到前面编辑的结果），不修改规则库
+    :return: {规则ID: 新规则，删除的规则为 None}
+    """
+    if not isinstance(edits, list) or not edits:
+        raise ValueError("edits 应为非空列表")
+    changed = {}
+    for edit in edits:
+        if not isinstance(edit, dict) or not isinstance(edit.get("rule_id"), str) or not edit["rule_id"]:
+            raise ValueError(f"编辑格式错误: {edit!r}")
+        unknown = set(edit) - {"rule_id", *EDITABLE_FIELDS}
+        if unknown:
+            raise ValueError(f"不支持修改的字段: {', '.join(sorted(unknown))}")
+        rule_id = edit["rule_id"]
+        rule = changed[rule_id] if rule_id in changed else store.get(rule_id)
+        if edit.get("delete"):
+            if rule is None:
+                raise ValueError(f"规则 {rule_id} 不存在")
+            changed[rule_id] = None
+        else:
+            changed[rule_id] = edited_rule(rule, edit)
+    return changed
+
+
+def apply_edits(store, edits):
+    """
+    应用编辑，返回新的 OverlayRuleStore，原规则库不变
+    基础规则库（包括内存映射规则库）不复制，编辑过的规则叠加在其上；多次编辑合并到同一层，不逐层嵌套
+    """
+    changed = resolve_edits(store, edits)
+    if isinstance(store, OverlayRuleStore):
+        return OverlayRuleStore(store.base, {**store.overrides, **changed})
+    return OverlayRuleStore(store, changed)
+
+
+def index_built(store):
+    """规则库（叠加编辑的规则库看其基础规则库）的规则DAG或阈值索引是否已经建好"""
+    base = store.base if isinstance(store, OverlayRuleStore) else store
+    return base._dag is not None or base._threshold_index is not None
+
+
+class RuleSnapshot:
+    """带版本号的只读规则库快照，发布前已建好全部派生结构（内存映射规则库的规则DAG与阈值索引视 warm_index 而定）"""
+
+    def __init__(self, version, store, source, reason, build_seconds, compiled_plans, invalid_plans,
+                 loaded_version=None):
+        self.version = version
+        # 基础规则库从文件加载时的版本号，编辑后的快照沿用上一版本的值
+        self.loaded_version = loaded_version if loaded_version is not None else version
+        self.store = store
+        self.source = source
+        self.reason = reason
+        self.created = time.time()
+        self.build_seconds = build_seconds
+        self.compiled_plans = compiled_plans
+        self.invalid_plans = invalid_plans
+
+    @classmethod
+    def build(cls, version, store, source=None, reason="load", warm_plans=True, warm_index=False,
+              loaded_version=None):
+        """
+        构建快照：建好规则DAG与阈值索引，warm_plans 时编译每条规则的计算计划（无法编译的规则记下错误）；
+        编辑后的快照只为编辑过的规则构建，基础规则库的派生结构沿用上一版本
+        内存映射规则库只在 warm_index 时预先构建规则DAG与阈值索引：规则按需创建，规则DAG与阈值索引要解析全部规则，
+        会使每个工作进程多占用与规则数成正比的私有内存，也会拖慢启动
+        """
+        start = time.perf_counter()
+        base = store.base if isinstance(store, OverlayRuleStore) else store
+        if warm_index or not isinstance(base, MappedRuleStore):
+            base.dag
+            base.threshold_index
+        if store is not base:
+            store.dag
+            store.threshold_index
+        compiled = invalid = 0
+        if warm_plans and (store is not base or not isinstance(store, MappedRuleStore)):
+            for rule in store.by_id.values():
+                try:
+                    rule.plan
+                    compiled += 1
+                except ValueError:
+                    invalid += 1
+        return cls(version, store, source, reason, round(time.perf_counter() - start, 3), compiled, invalid,
+                   loaded_version)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "source": self.source,
+            "reason": self.reason,
+            "loaded_version": self.loaded_version,
+            "created": self.created,
+            "build_seconds": self.build_seconds,
+            "rules": len(self.store),
+            "compiled_plans": self.compiled_plans,
+            "invalid_plans": self.invalid_plans
+        }
+
+
+class RuleSnapshots:
+    """当前规则库快照与后台构建：构建依次进行，每次基于当时的当前快照，建好后替换当前快照"""
+
+    def __init__(self, loader, source=None, warm_plans=True, history=20, warm_index=False):
+        """
+        :param loader: loader(path) 返回 RuleStore；path 为 None 时加载默认规则库
+        :param source: 初始规则库的来源（仅用于统计）
+        :param warm_plans: 构建快照时是否预先编译每条规则的计划
+        :param history: 保留的构建记录条数
+        :param warm_index: 内存映射规则库是否也在发布前构建规则DAG与阈值索引（包括启动时）；
+                           为 False 时只在上一版本已经建好时才预先构建
+        """
+        self.loader = loader
+        self.warm_plans = warm_plans
+        self.history = history
+        self.warm_index = warm_index
+        self._current = RuleSnapshot.build(1, loader(None), source, "initial", warm_plans, warm_index)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rule-snapshot")
+        self._builds = OrderedDict()  # 构建ID -> 构建记录
+        self._futures = {}
+        self._next_build = 1
+        self._lock = threading.Lock()  # 只保护构建记录，读取当前快照不加锁
+
+    @property
+    def current(self):
+        """当前快照；整体替换引用，读取方拿到的快照不会再变化"""
+        return self._current
+
+    def reload(self, path=None):
+        """后台从文件重新加载规则库，返回构建ID"""
+        return self._submit("reload", lambda snapshot: (self.loader(path), path or snapshot.source))
+
+    def edit(self, edits, base_version=None):
+        """
+        校验编辑（格式错误、规则不存在时立即抛出 ValueError），后台在当时的当前快照上应用，返回构建ID
+        构建时规则库已重新加载（与校验时不是同一次加载）则构建失败，不应用编辑；
+        之间只有其他编辑时重新校验后应用
+        :param base_version: 编辑所基于的快照版本，给出时要求构建时的当前快照仍是该版本，否则构建失败
+        """
+        current = self._current
+        if base_version is not None and base_version != current.version:
+            raise ValueError(f"当前快照为 v{current.version}，编辑基于 v{base_version}，请基于当前快照重新提交")
+        resolve_edits(current.store, edits)
+
+        def make_store(snapshot):
+            if snapshot.loaded_version != current.loaded_version:
+                raise ValueError(f"编辑基于 v{current.version}，之后规则库已重新加载为 v{snapshot.loaded_version}，"
+                                 f"请基于当前快照重新提交")
+            if base_version is not None and snapshot.version != base_version:
+                raise ValueError(f"当前快照已更新为 v{snapshot.version}，编辑基于 v{base_version}，请基于当前快照重新提交")
+            return apply_edits(snapshot.store, edits), snapshot.source
+
+        return self._submit("edit", make_store, current.version)
+
+    def _submit(self, reason, make_store, base_version=None):
+        """
+        :param base_version: 提交时校验所用的快照版本（编辑），仅记录在构建记录中
+        """
+        with self._lock:
+            build_id = self._next_build
+            self._next_build += 1
+            self._builds[build_id] = {"build_id": build_id, "reason": reason, "status": "pending",
+                                      "submitted": time.time(), "base_version": base_version, "version": None,
+                                      "error": None, "seconds": None}
+            while len(self._builds) > self.history:
+                old_id, _ = self._builds.popitem(last=False)
+                self._futures.pop(old_id, None)
+            self._futures[build_id] = self._executor.submit(self._run, build_id, reason, make_store)
+        return build_id
+
+    def _update(self, build_id, **fields):
+        with self._lock:
+            record = self._builds.get(build_id)
+            if record is not None:
+                record.update(fields)
+
+    def _run(self, build_id, reason, make_store):
+        """在构建线程中执行：构建线程只有一个，版本号依次递增"""
+        self._update(build_id, status="running")
+        start = time.perf_counter()
+        base = self._current
+        try:
+            store, source = make_store(base)
+            snapshot = RuleSnapshot.build(base.version + 1, store, source, reason, self.warm_plans,
+                                          self.warm_index or index_built(base.store),
+                                          base.loaded_version if reason == "edit" else None)
+        except Exception as e:
+            logger.error(f"规则库快照构建失败 ({reason}): {e}")
+            self._update(build_id, status="failed", error=str(e), seconds=round(time.perf_counter() - start, 3))
+            return
+        self._current = snapshot
+        logger.info(f"规则库快照 v{snapshot.version} 已发布 ({reason}): {len(store)} 条规则，构建 {snapshot.build_seconds} 秒")
+        self._update(build_id, status="done", version=snapshot.version, seconds=round(time.perf_counter() - start, 3))
+
+    def build(self, build_id):
+        """查询构建记录，不存在时返回 None"""
+        with self._lock:
+            record = self._builds.get(build_id)
+            return dict(record) if record is not None else None
+
+    def wait(self, build_id, timeout=None):
+        """等待构建结束，返回构建记录；超时后返回当时的记录"""
+        future = self._futures.get(build_id)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+        return self.build(build_id)
+
+    def stats(self):
+        with self._lock:
+            builds = [dict(record) for record in self._builds.values()]
+        return {"current": self._current.stats(), "builds": builds}
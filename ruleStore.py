@@ -0,0 +1,541 @@
+import csv
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+from ruleCorpus import MappedRuleCorpus, is_rule_corpus
+from ruleDAG import RuleDAG, ThresholdIndex
+from rulePlan import compile_rules
+
+# ==============================
+# 规则库：加载 createRuleData.py 生成的 rules.csv，按规则ID、类型、状态和引用属性建立索引
+# ==============================
+
+# 规则库中的算子名称与 operators.py 中算子的对应关系
+# 规则库中的对比算子带阈值（与差值算子取值范围相同），按“A-B >= 阈值”求值；cmp_operator 不接受阈值，会丢弃阈值
+CORPUS_OPERATOR_ALIASES = {
+    "diff_operator": "diff_operator",
+    "ratio_operator": "ratio_operator",
+    "comparison_operator": "diff_operator",
+    "multiplication_operator": "mul_operator",
+    "subset_judgment_operator": "subset_operator",
+    "mean_operator": "avg_operator",
+    "variance_operator": "var_operator",
+}
+# 规则库中多个基础算子之间按“同时满足”组合
+CORPUS_COMBINERS = {2: "and_operator", 3: "and3_operator"}
+
+
+def corpus_rules(rule_structure):
+    """
+    将规则库中的 rule_structure 转换为 generate_risk_indicator 使用的规则列表
+    算子按 CORPUS_OPERATOR_ALIASES 映射，没有对应实现的算子（如两属性的联合概率算子）保留原名，编译时报错；
+    2、3 个基础算子分别用 and_operator、and3_operator 组合，单个基础算子直接作为最终结果
+    """
+    rules = [[CORPUS_OPERATOR_ALIASES.get(op, op), list(attributes), threshold]
+             for op, attributes, threshold in rule_structure]
+    if len(rules) in CORPUS_COMBINERS:
+        rules.append([CORPUS_COMBINERS[len(rules)], [], None])
+    return rules
+
+
+def current_rss_mb():
+    """当前进程常驻内存（MB），无法读取 /proc 时退回峰值常驻内存"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class StoredRule:
+    """规则库中的一条规则"""
+    __slots__ = ("rule_id", "rule_name", "rule_type", "rule_status", "structure", "attributes",
+                 "updated_time", "_plan", "_error")
+
+    def __init__(self, rule_id, rule_name, rule_type, rule_status, structure, attributes, updated_time):
+        self.rule_id = rule_id
+        self.rule_name = rule_name
+        self.rule_type = rule_type
+        self.rule_status = rule_status
+        self.structure = structure
+        self.attributes = attributes
+        self.updated_time = updated_time
+        self._plan = None
+        self._error = None
+
+    @property
+    def rules(self):
+        """generate_risk_indicator 格式的规则列表"""
+        return corpus_rules(self.structure)
+
+    @property
+    def plan(self):
+        """首次使用时编译，无法编译的规则抛出 ValueError"""
+        if self._plan is None:
+            if self._error is not None:
+                raise ValueError(self._error)
+            try:
+                self._plan = compile_rules(self.rules)
+            except ValueError as e:
+                self._error = f"规则 {self.rule_id} 无法编译: {e}"
+                raise ValueError(self._error) from None
+        return self._plan
+
+    def evaluate(self, risk_features):
+        """用本规则计算风险指标，返回多维计算结构"""
+        return self.plan.evaluate(risk_features, self.rules)
+
+    def to_dict(self):
+        return {
+            "rule_id": self.rule_id,
+            "rule_name": self.rule_name,
+            "rule_type": self.rule_type,
+            "rule_status": self.rule_status,
+            "rule_structure": [[op, list(attributes), threshold] for op, attributes, threshold in self.structure],
+            "updated_time": self.updated_time
+        }
+
+
+class RuleStore:
+    """内存规则库"""
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_type = {}
+        self.by_status = {}
+        self.by_attribute = {}
+        # 倒排索引：规则按所需属性集合分组，属性 -> 包含该属性的属性集合
+        self.by_attribute_set = {}
+        self.attribute_sets_by_attribute = {}
+        self.load_stats = {}
+        self._dag = None
+        self._threshold_index = None
+        self._dag_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def add(self, rule):
+        """加入一条规则并更新索引，同ID的旧规则会被替换"""
+        self._dag = self._threshold_index = None
+        if rule.rule_id in self.by_id:
+            self.remove(rule.rule_id)
+        self.by_id[rule.rule_id] = rule
+        self.by_type.setdefault(rule.rule_type, []).append(rule)
+        self.by_status.setdefault(rule.rule_status, []).append(rule)
+        for attribute in rule.attributes:
+            self.by_attribute.setdefault(attribute, []).append(rule)
+        group = self.by_attribute_set.get(rule.attributes)
+        if group is None:
+            group = self.by_attribute_set[rule.attributes] = []
+            for attribute in rule.attributes:
+                self.attribute_sets_by_attribute.setdefault(attribute, []).append(rule.attributes)
+        group.append(rule)
+
+    def remove(self, rule_id):
+        self._dag = self._threshold_index = None
+        rule = self.by_id.pop(rule_id)
+        self.by_type[rule.rule_type].remove(rule)
+        self.by_status[rule.rule_status].remove(rule)
+        for attribute in rule.attributes:
+            self.by_attribute[attribute].remove(rule)
+        group = self.by_attribute_set[rule.attributes]
+        group.remove(rule)
+        if not group:
+            del self.by_attribute_set[rule.attributes]
+            for attribute in rule.attributes:
+                self.attribute_sets_by_attribute[attribute].remove(rule.attributes)
+        return rule
+
+    def get(self, rule_id):
+        return self.by_id.get(rule_id)
+
+    def query(self, rule_type=None, rule_status=None, attribute=None):
+        """按类型、状态、引用属性筛选规则（条件之间为“且”），未给出任何条件时返回全部规则"""
+        candidates = []
+        if rule_type is not None:
+            candidates.append(self.by_type.get(rule_type, []))
+        if rule_status is not None:
+            candidates.append(self.by_status.get(rule_status, []))
+        if attribute is not None:
+            candidates.append(self.by_attribute.get(attribute, []))
+        if not candidates:
+            return list(self.by_id.values())
+        # 从最小的候选集合出发，逐条检查其余条件
+        smallest = min(candidates, key=len)
+        return [rule for rule in smallest
+                if (rule_type is None or rule.rule_type == rule_type)
+                and (rule_status is None or rule.rule_status == rule_status)
+                and (attribute is None or attribute in rule.attributes)]
+
+    def count(self, rule_type=None, rule_status=None, attribute=None):
+        """符合条件的规则数"""
+        if rule_type is None and rule_status is None and attribute is None:
+            return len(self.by_id)
+        return len(self.query(rule_type, rule_status, attribute))
+
+    def candidates(self, risk_features, rule_type=None, rule_status=None):
+        """
+        返回所需属性全部出现在 risk_features 中的规则
+        只遍历申报所含属性的倒排链，统计每个属性集合被覆盖的属性数，覆盖数等于集合大小的集合即可满足，
+        代价与申报属性的倒排链长度和命中规则数相关，与规则库总量无关
+        """
+        covered = {}
+        for attribute in risk_features:
+            for attribute_set in self.attribute_sets_by_attribute.get(attribute, ()):
+                covered[attribute_set] = covered.get(attribute_set, 0) + 1
+
+        rules = []
+        for attribute_set, count in covered.items():
+            if count == len(attribute_set):
+                rules.extend(self.by_attribute_set[attribute_set])
+        if rule_type is not None or rule_status is not None:
+            rules = [rule for rule in rules
+                     if (rule_type is None or rule.rule_type == rule_type)
+                     and (rule_status is None or rule.rule_status == rule_status)]
+        return rules
+
+    @property
+    def dag(self):
+        """全部规则合并后的求值图，首次使用时构建"""
+        dag = self._dag
+        if dag is None:
+            with self._dag_lock:
+                if self._dag is None:
+                    self._dag = RuleDAG.build(self._rule_items())
+                dag = self._dag
+        return dag
+
+    @property
+    def threshold_index(self):
+        """规则DAG上的阈值有序索引，首次使用时构建"""
+        index = self._threshold_index
+        if index is None:
+            dag = self.dag
+            with self._dag_lock:
+                if self._threshold_index is None:
+                    self._threshold_index = ThresholdIndex(dag, lambda rule_id: self.get(rule_id).attributes)
+                index = self._threshold_index
+        return index
+
+    def fired_rules(self, risk_features, rule_type=None, rule_status=None):
+        """
+        通过阈值有序索引找出在该申报上触发的规则，不逐条求值未触发的规则；
+        所需属性都在 risk_features 中、但无法编译的规则记为错误（与 evaluate_many 一致）
+        :return: (触发的规则列表, 错误字典 {规则ID: 错误信息})
+        """
+        fired_ids, errors = self.threshold_index.fired_rules(risk_features)
+        rules = [self.get(rule_id) for rule_id in fired_ids]
+        if rule_type is not None or rule_status is not None:
+            def keep(rule):
+                return (rule_type is None or rule.rule_type == rule_type) \
+                    and (rule_status is None or rule.rule_status == rule_status)
+            rules = [rule for rule in rules if keep(rule)]
+            errors = {rule_id: error for rule_id, error in errors.items() if keep(self.get(rule_id))}
+        return rules, errors
+
+    def _rule_items(self):
+        """(规则ID, 规则列表) 序列，用于构建规则DAG"""
+        return ((rule.rule_id, rule.rules) for rule in self.by_id.values())
+
+    def evaluate_many(self, rules, risk_features):
+        """
+        用规则DAG一次求值多条规则，相同子表达式只计算一次
+        :return: (结果字典 {规则ID: 0/1}, 错误字典 {规则ID: 错误信息})
+        """
+        dag = self.dag
+        positions = []
+        errors = {}
+        for rule in rules:
+            position = dag.position(rule.rule_id)
+            if position is None:
+                errors[rule.rule_id] = f"规则 {rule.rule_id} 无法编译: {dag.invalid[rule.rule_id]}"
+            else:
+                positions.append(position)
+        results, evaluate_errors = dag.evaluate(risk_features, positions)
+        errors.update(evaluate_errors)
+        return results, errors
+
+    def stats(self):
+        return {
+            "rules": len(self.by_id),
+            "by_type": {key: len(rules) for key, rules in self.by_type.items()},
+            "by_status": {key: len(rules) for key, rules in self.by_status.items()},
+            "attributes": len(self.by_attribute),
+            "attribute_sets": len(self.by_attribute_set),
+            "dag": self._dag.stats() if self._dag is not None else None,
+            "threshold_index": self._threshold_index.stats() if self._threshold_index is not None else None,
+            "load": self.load_stats
+        }
+
+    @classmethod
+    def load_csv(cls, path):
+        """从 createRuleData.py 生成的 CSV 加载规则库，并记录加载耗时与内存占用"""
+        rss_before = current_rss_mb()
+        start = time.time()
+        store = cls()
+        interned = {}  # 复用相同的字符串、属性元组与属性集合，降低百万级规则的内存占用
+
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            columns = [header.index(name) for name in
+                       ("rule_id", "rule_name", "rule_type", "rule_status", "rule_structure", "updated_time")]
+            for row in reader:
+                rule_id, rule_name, rule_type, rule_status, rule_structure, updated_time = (row[i] for i in columns)
+                steps = []
+                for op, attributes, threshold in json.loads(rule_structure):
+                    attributes = tuple(attributes)
+                    steps.append((interned.setdefault(op, op), interned.setdefault(attributes, attributes), threshold))
+                structure = tuple(steps)
+                attribute_set = frozenset(a for step in steps for a in step[1])
+                attribute_set = interned.setdefault(attribute_set, attribute_set)
+                store.add(StoredRule(
+                    rule_id, rule_name, interned.setdefault(rule_type, rule_type),
+                    interned.setdefault(rule_status, rule_status), structure, attribute_set, int(updated_time)
+                ))
+
+        store.load_stats = {
+            "source": path,
+            "format": "csv",
+            "rules": len(store),
+            "load_seconds": round(time.time() - start, 2),
+            "rss_mb": round(current_rss_mb(), 1),
+            "rss_delta_mb": round(current_rss_mb() - rss_before, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1)
+        }
+        return store
+
+    @classmethod
+    def load(cls, path):
+        """按文件内容选择加载方式：列式二进制规则库内存映射加载，其他按 CSV 加载"""
+        if is_rule_corpus(path):
+            return MappedRuleStore.open(path)
+        return cls.load_csv(path)
+
+
+class MappedRuleStore(RuleStore):
+    """
+    基于内存映射列式二进制文件的只读规则库
+    规则ID通过排序置换二分查找，类型、状态、属性筛选在编码数组上向量化完成，
+    StoredRule 对象只在被访问时创建，启动时不解析任何规则
+    """
+
+    def __init__(self, corpus):
+        super().__init__()
+        self.corpus = corpus
+        self._rules = {}  # 行号 -> 已创建的 StoredRule
+        # 属性 -> 包含该属性的属性集合编号
+        self._sets_by_attribute = {}
+        for code, attribute_set in enumerate(corpus.attribute_sets):
+            for attribute in attribute_set:
+                self._sets_by_attribute.setdefault(attribute, []).append(code)
+
+    def __len__(self):
+        return len(self.corpus)
+
+    def add(self, rule):
+        raise ValueError("内存映射规则库为只读")
+
+    def remove(self, rule_id):
+        raise ValueError("内存映射规则库为只读")
+
+    def _rule_at(self, position):
+        rule = self._rules.get(position)
+        if rule is None:
+            corpus = self.corpus
+            rule = self._rules[position] = StoredRule(
+                corpus.rule_id_at(position), corpus.rule_name_at(position),
+                corpus.value_at("rule_type", position), corpus.value_at("rule_status", position),
+                corpus.structure_at(position), corpus.attribute_set_at(position),
+                int(corpus.updated_time[position])
+            )
+        return rule
+
+    def get(self, rule_id):
+        position = self.corpus.position(rule_id)
+        return self._rule_at(position) if position is not None else None
+
+    def _mask(self, rule_type=None, rule_status=None, attribute_sets=None):
+        """符合条件的行掩码，没有任何条件时返回 None"""
+        corpus = self.corpus
+        mask = None
+        for column, value in (("rule_type", rule_type), ("rule_status", rule_status)):
+            if value is None:
+                continue
+            code = corpus.code(column, value)
+            column_mask = corpus.arrays[column] == code if code is not None else np.zeros(len(corpus), dtype=bool)
+            mask = column_mask if mask is None else mask & column_mask
+        if attribute_sets is not None:
+            set_mask = np.isin(corpus.attribute_set, np.fromiter(attribute_sets, dtype=np.int32))
+            mask = set_mask if mask is None else mask & set_mask
+        return mask
+
+    def query(self, rule_type=None, rule_status=None, attribute=None):
+        attribute_sets = self._sets_by_attribute.get(attribute, []) if attribute is not None else None
+        mask = self._mask(rule_type, rule_status, attribute_sets)
+        positions = range(len(self.corpus)) if mask is None else np.flatnonzero(mask).tolist()
+        return [self._rule_at(position) for position in positions]
+
+    def count(self, rule_type=None, rule_status=None, attribute=None):
+        attribute_sets = self._sets_by_attribute.get(attribute, []) if attribute is not None else None
+        mask = self._mask(rule_type, rule_status, attribute_sets)
+        return len(self.corpus) if mask is None else int(np.count_nonzero(mask))
+
+    def candidates(self, risk_features, rule_type=None, rule_status=None):
+        covered = {}
+        for attribute in risk_features:
+            for code in self._sets_by_attribute.get(attribute, ()):
+                covered[code] = covered.get(code, 0) + 1
+        attribute_sets = self.corpus.attribute_sets
+        mask = self._mask(rule_type, rule_status,
+                          [code for code, count in covered.items() if count == len(attribute_sets[code])])
+        return [self._rule_at(position) for position in np.flatnonzero(mask).tolist()]
+
+    def _rule_items(self):
+        corpus = self.corpus
+        rule_ids = corpus.rule_id
+        return ((rule_ids[position].decode("utf-8"), corpus_rules(structure))
+                for position, structure in corpus.iter_structures())
+
+    def stats(self):
+        corpus = self.corpus
+        type_counts = np.bincount(corpus.rule_type, minlength=len(corpus.dictionaries["rule_type"]))
+        status_counts = np.bincount(corpus.rule_status, minlength=len(corpus.dictionaries["rule_status"]))
+        return {
+            "rules": len(corpus),
+            "by_type": dict(zip(corpus.dictionaries["rule_type"], type_counts.tolist())),
+            "by_status": dict(zip(corpus.dictionaries["rule_status"], status_counts.tolist())),
+            "attributes": len(self._sets_by_attribute),
+            "attribute_sets": len(corpus.attribute_sets),
+            "materialized_rules": len(self._rules),
+            "dag": self._dag.stats() if self._dag is not None else None,
+            "threshold_index": self._threshold_index.stats() if self._threshold_index is not None else None,
+            "load": self.load_stats
+        }
+
+    @classmethod
+    def open(cls, path):
+        """内存映射打开列式二进制规则库，并记录加载耗时与内存占用"""
+        rss_before = current_rss_mb()
+        start = time.time()
+        store = cls(MappedRuleCorpus(path))
+        store.load_stats = {
+            "source": path,
+            "format": "binary",
+            "rules": len(store),
+            "load_seconds": round(time.time() - start, 4),
+            "rss_mb": round(current_rss_mb(), 1),
+            "rss_delta_mb": round(current_rss_mb() - rss_before, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1)
+        }
+        return store
+
+
+
+def _matches(rule, rule_type=None, rule_status=None, attribute=None):
+    return (rule_type is None or rule.rule_type == rule_type) \
+        and (rule_status is None or rule.rule_status == rule_status) \
+        and (attribute is None or attribute in rule.attributes)
+
+
+class OverlayRuleStore(RuleStore):
+    """
+    只读基础规则库上叠加编辑过的规则：基础规则库（及其规则DAG、阈值索引）不复制、不修改，在各版本间共享；
+    编辑过的规则单独建立索引和规则DAG（代价只与编辑条数有关），查询时合并两部分，基础库中被编辑或删除的规则被屏蔽
+    """
+
+    def __init__(self, base, overrides):
+        """
+        :param base: 基础规则库（RuleStore 或 MappedRuleStore），不是 OverlayRuleStore
+        :param overrides: 规则ID -> 编辑后的规则，删除的规则为 None
+        """
+        super().__init__()
+        self.base = base
+        self.overrides = overrides
+        for rule in overrides.values():
+            if rule is not None:
+                RuleStore.add(self, rule)
+        self._shadowed = [rule for rule in (base.get(rule_id) for rule_id in overrides) if rule is not None]
+        self._size = len(base) - len(self._shadowed) + len(self.by_id)
+        self.load_stats = {**base.load_stats, "overrides": len(overrides)}
+
+    def __len__(self):
+        return self._size
+
+    def add(self, rule):
+        raise ValueError("叠加编辑的规则库为只读")
+
+    def remove(self, rule_id):
+        raise ValueError("叠加编辑的规则库为只读")
+
+    def get(self, rule_id):
+        if rule_id in self.overrides:
+            return self.overrides[rule_id]
+        return self.base.get(rule_id)
+
+    def _visible(self, rules):
+        """去掉基础规则库中被编辑或删除的规则"""
+        overrides = self.overrides
+        return [rule for rule in rules if rule.rule_id not in overrides]
+
+    def query(self, rule_type=None, rule_status=None, attribute=None):
+        return self._visible(self.base.query(rule_type, rule_status, attribute)) \
+            + RuleStore.query(self, rule_type, rule_status, attribute)
+
+    def count(self, rule_type=None, rule_status=None, attribute=None):
+        shadowed = sum(1 for rule in self._shadowed if _matches(rule, rule_type, rule_status, attribute))
+        return self.base.count(rule_type, rule_status, attribute) - shadowed \
+            + len(RuleStore.query(self, rule_type, rule_status, attribute))
+
+    def candidates(self, risk_features, rule_type=None, rule_status=None):
+        return self._visible(self.base.candidates(risk_features, rule_type, rule_status)) \
+            + RuleStore.candidates(self, risk_features, rule_type, rule_status)
+
+    def fired_rules(self, risk_features, rule_type=None, rule_status=None):
+        rules, errors = self.base.fired_rules(risk_features, rule_type, rule_status)
+        overlay_rules, overlay_errors = RuleStore.fired_rules(self, risk_features, rule_type, rule_status)
+        errors = {rule_id: error for rule_id, error in errors.items() if rule_id not in self.overrides}
+        errors.update(overlay_errors)
+        return self._visible(rules) + overlay_rules, errors
+
+    def evaluate_many(self, rules, risk_features):
+        """基础规则库中的规则用基础规则DAG求值，编辑过的规则用叠加部分的规则DAG求值"""
+        base_rules = self._visible(rules)
+        overlay_rules = [rule for rule in rules if rule.rule_id in self.overrides]
+        results, errors = self.base.evaluate_many(base_rules, risk_features) if base_rules else ({}, {})
+        if overlay_rules:
+            overlay_results, overlay_errors = RuleStore.evaluate_many(self, overlay_rules, risk_features)
+            results.update(overlay_results)
+            errors.update(overlay_errors)
+        return results, errors
+
+    def stats(self):
+        return {
+            **self.base.stats(),
+            "rules": self._size,
+            "overrides": len(self.overrides),
+            "overlay": {
+                "rules": len(self.by_id),
+                "deleted": sum(1 for rule in self.overrides.values() if rule is None),
+                "dag": self._dag.stats() if self._dag is not None else None,
+                "threshold_index": self._threshold_index.stats() if self._threshold_index is not None else None
+            }
+        }
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/rules.csv"
+    store = RuleStore.load(path)
+    print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
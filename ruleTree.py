@@ -0,0 +1,444 @@
+import time
+
+import numpy as np
+
+import batchOperators as batch_ops
+from metrics import OPERATOR_ERRORS
+from rulePlan import compile_step, operator_arity, resolve_operator, rules_signature
+from stepStatistics import StepStats, step_statistics
+
+# ==============================
+# 表达式树规则：逻辑算子可以任意嵌套，例如 (A 且 B) 或 (C 且 非D)
+# {"op": "or_operator", "args": [
+#     {"op": "and_operator", "args": [["diff_operator", ["申报重量", "限重"], 0], ["ratio_operator", ["申报价格", "参考价格"], 1.2]]},
+#     {"op": "and_operator", "args": [["cmp_operator", ["毛重", "净重"], None],
+#                                     {"op": "not_operator", "args": [["subset_operator", ["原产国", "贸易区"], None]]}]}
+# ]}
+# 叶子节点为属性算子规则 (算子名称, 特征名称列表, 阈值)，内部节点为 operators.py 中的逻辑算子
+# 求值时短路：结果已经确定的逻辑节点不再计算其余子树，计算结构中标记为已跳过
+# 可交换逻辑节点的子节点按运行统计重排（代价低、易短路的先算），evaluate 与 evaluate_indicator 都按重排后的顺序求值；
+# 只在各子节点对本次申报都不会出错时才按重排后的顺序，否则按声明顺序，最终风险指标与出错情况都与声明顺序相同；
+# 计算结构仍按步骤编号（声明顺序）排列，被跳过的步骤取决于实际求值顺序
+# ==============================
+
+# 可作为内部节点的逻辑算子
+LOGIC_OPERATORS = {
+    "and_operator", "or_operator", "xor_operator", "implication_operator", "nand_operator", "nor_operator",
+    "equivalence_operator", "and3_operator", "or3_operator", "xor3_operator", "implication3_operator", "not_operator"
+}
+
+# 短路规则：逻辑算子 -> (可触发短路的子节点位置，None 表示任意位置; 触发值; 短路结果)
+SHORT_CIRCUIT = {
+    "and_operator": (None, 0, 0),
+    "and3_operator": (None, 0, 0),
+    "or_operator": (None, 1, 1),
+    "or3_operator": (None, 1, 1),
+    "nand_operator": (None, 0, 1),
+    "nor_operator": (None, 1, 0),
+    "implication_operator": ((0,), 0, 1),  # ¬A∨B：A为0时结果为1
+    "implication3_operator": ((0, 1), 0, 1),  # ¬(A∧B∧¬C)：A或B为0时结果为1
+}
+
+# 子节点可以任意调换求值顺序的逻辑算子
+COMMUTATIVE_OPERATORS = {"and_operator", "or_operator", "and3_operator", "or3_operator", "nand_operator", "nor_operator"}
+
+# 只在数值输入上计算、不会抛出异常的属性算子；值为定义域检查（None 表示任意数值都可以）
+TOTAL_OPERATORS = {
+    "cmp_operator": None,
+    "diff_operator": None,
+    "mul_operator": None,
+    "avg_operator": None,
+    "var_operator": None,
+    "ratio_operator": lambda values: values[1] != 0,
+    "diff_ratio_operator": lambda values: values[1] != 0,
+    "euclidean_distance_2d": None,
+    "euclidean_distance_3d": None,
+    "cross_deviation_operator": None,
+    "multivariate_var_operator": None,
+    "joint_probability_operator": None,
+}
+
+# 嵌套深度上限，超出时编译报错（避免递归过深）
+MAX_TREE_DEPTH = 100
+
+# 每个计划每求值 REORDER_INTERVAL 次（evaluate_indicator）按统计重排一次子节点顺序
+REORDER_INTERVAL = 1024
+# 每 PROFILE_EVERY 次求值对叶子节点计时一次（计时本身有开销，只抽样）
+PROFILE_EVERY = 8
+# 统计次数不足时不参与重排
+MIN_EVALUATIONS = 64
+MIN_TIMED = 8
+
+
+def is_tree_rule(rules):
+    """规则是否为表达式树格式（根节点为 {"op": ..., "args": [...]}）"""
+    return isinstance(rules, dict)
+
+
+class TreeNode:
+    """表达式树节点：叶子节点持有编译后的属性算子步骤，内部节点持有逻辑算子"""
+    __slots__ = ("step", "operator_name", "children", "func", "batch_func", "leaf", "leaf_index", "order", "stats",
+                 "total", "features", "guarded")
+
+    def __init__(self, step, operator_name, children=(), func=None, leaf=None, leaf_index=None, stats=None):
+        self.step = step
+        self.operator_name = operator_name
+        self.children = children
+        self.func = func
+        self.batch_func = resolve_operator(operator_name, batch_ops) if func is not None else None  # 批量版本的逻辑算子
+        self.leaf = leaf
+        self.leaf_index = leaf_index
+        self.order = tuple(range(len(children)))  # 子节点求值顺序（下标），只有可交换逻辑节点会被重排
+        self.stats = stats if stats is not None else StepStats()  # 叶子节点为全局共享的步骤统计
+        # 编译期确定：子树的算子是否都属于 TOTAL_OPERATORS、子树用到的特征、需要定义域检查的叶子编号
+        if leaf is not None:
+            self.total = leaf.operator_name in TOTAL_OPERATORS
+            self.features = frozenset(leaf.feature_names)
+            self.guarded = frozenset((leaf_index,)) if TOTAL_OPERATORS.get(leaf.operator_name) else frozenset()
+        else:
+            self.total = all(child.total for child in children)
+            self.features = frozenset().union(*(child.features for child in children))
+            self.guarded = frozenset().union(*(child.guarded for child in children))
+
+
+class RuleTreePlan:
+    """编译后的表达式树规则，接口与 RulePlan 一致"""
+
+    def __init__(self, signature, root, nodes, leaves):
+        self.signature = signature
+        self.root = root
+        self.nodes = nodes  # 按步骤编号（后序）排列的全部节点
+        self.leaves = leaves
+        self.required_features = frozenset(name for leaf in leaves for name in leaf.leaf.feature_names)
+        self._logic_descriptions = {}
+        self._evaluations = 0
+        self._reordered = False  # 是否有逻辑节点的求值顺序与声明顺序不同
+        self._guarded_leaves = [leaf for leaf in leaves if leaf.guarded]
+
+    def _logic_description(self, node, input_results, final_result):
+        key = (node.step, tuple(input_results))
+        desc = self._logic_descriptions.get(key)
+        if desc is None:
+            from riskIndicatorDescription import get_logical_operator_description
+            desc = get_logical_operator_description(node.operator_name, input_results, final_result)
+            skipped = [child.step for child, result in zip(node.children, input_results) if result is None]
+            if skipped:
+                desc += f"（其他条件已确定结果，跳过步骤{'、'.join(map(str, skipped))}）"
+            self._logic_descriptions[key] = desc
+        return desc
+
+    def _skip(self, node, trace, parent_step):
+        """将子树中的所有节点标记为已跳过"""
+        for child in node.children:
+            self._skip(child, trace, parent_step)
+        trace[node.step - 1] = {
+            "step": node.step,
+            "operator": node.operator_name,
+            "result": None,
+            "skipped": True,
+            "description": f"已跳过：步骤{parent_step}的结果已由其他条件确定"
+        }
+
+    def _unsafe(self, risk_features):
+        """
+        本次申报中可能导致出错的 (特征集合, 叶子编号集合)：缺少或不是数值的特征、定义域检查不通过的叶子
+        只在有节点被重排时计算，每次求值一次
+        """
+        features = set()
+        for name in self.required_features:
+            value = risk_features.get(name)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                features.add(name)
+        leaves = set()
+        for node in self._guarded_leaves:
+            domain = TOTAL_OPERATORS[node.operator_name]
+            if node.features.isdisjoint(features) and not domain([risk_features[name] for name in node.leaf.feature_names]):
+                leaves.add(node.leaf_index)
+        return features, leaves
+
+    @staticmethod
+    def _order(node, unsafe):
+        """子节点的求值顺序：子树对本次申报一定不会出错时按重排后的顺序，否则按声明顺序"""
+        if unsafe is not None and node.total:
+            features, leaves = unsafe
+            if node.features.isdisjoint(features) and node.guarded.isdisjoint(leaves):
+                return node.order
+        return range(len(node.children))
+
+    def _evaluate(self, node, risk_features, trace, leaf_results, profile, unsafe):
+        step = node.leaf
+        if step is not None:
+            try:
+                values = [risk_features[name] for name in step.feature_names]
+            except KeyError as e:
+                raise ValueError(f"缺少特征 {e.args[0]}") from None
+            stats = node.stats
+            try:
+                if profile:
+                    start = time.perf_counter_ns()
+                    result = step.call(values)
+                    stats.total_ns += time.perf_counter_ns() - start
+                    stats.timed += 1
+                else:
+                    result = step.call(values)
+            except Exception:
+                OPERATOR_ERRORS.inc(operator=step.operator_name)
+                raise
+            stats.evaluations += 1
+            if result == 1:
+                stats.fired += 1
+            leaf_results[node.leaf_index] = result
+            trace[node.step - 1] = {
+                "step": node.step,
+                "operator": step.operator_name,
+                "input_features": dict(zip(step.feature_names, values)),
+                "threshold": step.threshold,
+                "result": result,
+                "description": step.desc_met if result == 1 else step.desc_unmet
+            }
+            return result
+
+        positions, trigger, decided_result = SHORT_CIRCUIT.get(node.operator_name, (None, None, None))
+        input_results = [None] * len(node.children)
+        decided = None
+        for i in self._order(node, unsafe):
+            child = node.children[i]
+            if decided is not None:
+                self._skip(child, trace, node.step)
+                continue
+            value = self._evaluate(child, risk_features, trace, leaf_results, profile, unsafe)
+            input_results[i] = value
+            if trigger is not None and value == trigger and (positions is None or i in positions):
+                decided = decided_result
+        result = decided if decided is not None else node.func(*input_results)
+        node.stats.evaluations += 1
+        if result == 1:
+            node.stats.fired += 1
+        trace[node.step - 1] = {
+            "step": node.step,
+            "operator": node.operator_name,
+            "input_steps": [child.step for child in node.children],
+            "input_results": input_results,
+            "result": result,
+            "description": self._logic_description(node, input_results, result)
+        }
+        return result
+
+    def _begin(self, risk_features):
+        """计数并按需重排，返回 (是否抽样计时, 本次申报的出错风险集合；未重排时为 None)"""
+        self._evaluations += 1
+        count = self._evaluations
+        if count % REORDER_INTERVAL == 0:
+            self.reorder()
+        unsafe = self._unsafe(risk_features) if self._reordered else None
+        return count % PROFILE_EVERY == 0, unsafe
+
+    def evaluate(self, risk_features, rules):
+        """
+        按重排后的顺序短路求值（见 _order），输出结构与 generate_risk_indicator 一致：
+        calculation_steps 按步骤编号（子节点在前）包含全部节点，被跳过的节点 skipped 为 True、result 为 None；
+        intermediate_results 为各叶子节点的结果（跳过为 None）；skipped_steps 为被跳过的步骤编号
+        """
+        profile, unsafe = self._begin(risk_features)
+        trace = [None] * len(self.nodes)
+        leaf_results = [None] * len(self.leaves)
+        final_result = self._evaluate(self.root, risk_features, trace, leaf_results, profile, unsafe)
+        return {
+            "original_features": risk_features,
+            "calculation_steps": trace,
+            "intermediate_results": leaf_results,
+            "final_risk_indicator": final_result,
+            "skipped_steps": [entry["step"] for entry in trace if entry.get("skipped")],
+            "rules_applied": rules
+        }
+
+    def _indicator(self, node, risk_features, profile, unsafe):
+        """只计算结果的短路求值，求值顺序与 evaluate 相同"""
+        step = node.leaf
+        if step is not None:
+            try:
+                values = [risk_features[name] for name in step.feature_names]
+            except KeyError as e:
+                raise ValueError(f"缺少特征 {e.args[0]}") from None
+            stats = node.stats
+            try:
+                if profile:
+                    start = time.perf_counter_ns()
+                    result = step.call(values)
+                    stats.total_ns += time.perf_counter_ns() - start
+                    stats.timed += 1
+                else:
+                    result = step.call(values)
+            except Exception:
+                OPERATOR_ERRORS.inc(operator=step.operator_name)
+                raise
+            stats.evaluations += 1
+            if result == 1:
+                stats.fired += 1
+            return result
+
+        positions, trigger, decided_result = SHORT_CIRCUIT.get(node.operator_name, (None, None, None))
+        input_results = [None] * len(node.children)
+        result = None
+        for i in self._order(node, unsafe):
+            value = self._indicator(node.children[i], risk_features, profile, unsafe)
+            input_results[i] = value
+            if trigger is not None and value == trigger and (positions is None or i in positions):
+                result = decided_result
+                break
+        if result is None:
+            result = node.func(*input_results)
+        node.stats.evaluations += 1
+        if result == 1:
+            node.stats.fired += 1
+        return result
+
+    def evaluate_indicator(self, risk_features):
+        """
+        只计算最终风险指标（不生成计算结构），结果与出错情况都与 evaluate 相同
+        可交换逻辑节点按运行统计重排子节点，evaluate 与 evaluate_indicator 合计每求值 REORDER_INTERVAL 次重排一次
+        """
+        profile, unsafe = self._begin(risk_features)
+        return self._indicator(self.root, risk_features, profile, unsafe)
+
+    def _estimate(self, node):
+        """
+        按统计估计子树的 (期望代价, 结果为1的概率)，并在可交换节点上重排子节点；统计不足时返回 None
+        可交换节点的子节点按 代价/短路概率 升序求值（各条件独立时期望代价最小）
+        """
+        if node.leaf is not None:
+            stats = node.stats
+            if stats.evaluations < MIN_EVALUATIONS or stats.timed < MIN_TIMED:
+                return None
+            return stats.mean_ns(), stats.fire_rate()
+
+        estimates = [self._estimate(child) for child in node.children]
+        if any(estimate is None for estimate in estimates) or node.stats.evaluations < MIN_EVALUATIONS:
+            return None
+        positions, trigger, _ = SHORT_CIRCUIT.get(node.operator_name, (None, None, None))
+        if trigger is None:
+            return sum(cost for cost, _ in estimates), node.stats.fire_rate()
+
+        # 子节点结果等于触发值（即发生短路）的概率
+        decide = [p if trigger == 1 else 1 - p for _, p in estimates]
+        order = node.order
+        if node.operator_name in COMMUTATIVE_OPERATORS:
+            order = tuple(sorted(range(len(estimates)),
+                                 key=lambda i: (estimates[i][0] / decide[i] if decide[i] else float("inf"), i)))
+            if order != node.order:
+                node.order = order
+                step_statistics.reorders += 1
+            if order != tuple(range(len(order))):
+                self._reordered = True
+        cost, reach = 0.0, 1.0
+        for i in order:
+            cost += reach * estimates[i][0]
+            if positions is None or i in positions:
+                reach *= 1 - decide[i]
+        return cost, node.stats.fire_rate()
+
+    def reorder(self):
+        """按运行统计重排可交换逻辑节点的子节点求值顺序"""
+        self._estimate(self.root)
+
+    def evaluation_order(self):
+        """各逻辑节点当前的子节点求值顺序：{步骤编号: [子节点步骤编号, ...]}"""
+        return {node.step: [node.children[i].step for i in node.order] for node in self.nodes if node.children}
+
+    def _evaluate_batch(self, node, feature_table, calculation_steps, leaf_results):
+        """返回 (结果掩码, 错误掩码)；错误只在该行结果依赖出错子树时向上传递（按声明顺序，与标量版本的短路一致）"""
+        step = node.leaf
+        if step is not None:
+            result, errors = step.batch_call([feature_table[name] for name in step.feature_names])
+            if errors is None:
+                errors = np.zeros(len(result), dtype=bool)
+            else:
+                error_count = int(np.count_nonzero(errors))
+                if error_count:
+                    OPERATOR_ERRORS.inc(error_count, operator=step.operator_name)
+            leaf_results[node.leaf_index] = result
+        else:
+            positions, trigger, decided_result = SHORT_CIRCUIT.get(node.operator_name, (None, None, None))
+            child_results = [self._evaluate_batch(child, feature_table, calculation_steps, leaf_results)
+                             for child in node.children]
+            row_count = len(child_results[0][0])
+            decided = np.zeros(row_count, dtype=bool)
+            errors = np.zeros(row_count, dtype=bool)
+            for i, (child_result, child_errors) in enumerate(child_results):
+                errors |= child_errors & ~decided
+                if trigger is not None and (positions is None or i in positions):
+                    decided |= (child_result == trigger) & ~errors
+            result = node.batch_func(*(r for r, _ in child_results))
+            if trigger is not None:
+                result = np.where(decided, np.int8(decided_result), result).astype(np.int8)
+        calculation_steps[node.step - 1] = {
+            "step": node.step,
+            "operator": node.operator_name,
+            "result": result,
+            "errors": errors
+        }
+        return result, errors
+
+    def evaluate_batch(self, feature_table, rules):
+        """在列式特征表上批量求值，输出结构与 RulePlan.evaluate_batch 一致（批量计算不短路，但错误按短路语义传递）"""
+        row_count = None
+        for name in self.required_features:
+            if name not in feature_table:
+                raise ValueError(f"缺少特征 {name}")
+            if row_count is None:
+                row_count = len(feature_table[name])
+            elif len(feature_table[name]) != row_count:
+                raise ValueError(f"特征列 {name} 长度不一致")
+
+        calculation_steps = [None] * len(self.nodes)
+        leaf_results = [None] * len(self.leaves)
+        final_result, invalid = self._evaluate_batch(self.root, feature_table, calculation_steps, leaf_results)
+        final_result = final_result.copy()
+        final_result[invalid] = 0
+        return {
+            "row_count": row_count or 0,
+            "calculation_steps": calculation_steps,
+            "intermediate_results": np.vstack(leaf_results),
+            "final_risk_indicator": final_result,
+            "valid": ~invalid,
+            "rules_applied": rules
+        }
+
+
+def compile_tree(rules, signature=None):
+    """
+    校验并编译表达式树规则
+    :param rules: 根节点 {"op": 逻辑算子名称, "args": [子节点, ...]}，子节点为同样格式的字典或属性算子规则
+    :param signature: 规则哈希，未提供时现场计算
+    :return: RuleTreePlan
+    """
+    nodes = []
+    leaves = []
+
+    def build(node, depth):
+        if depth > MAX_TREE_DEPTH:
+            raise ValueError(f"规则树嵌套超过 {MAX_TREE_DEPTH} 层")
+        if isinstance(node, dict):
+            operator_name = node.get("op")
+            args = node.get("args")
+            if operator_name not in LOGIC_OPERATORS:
+                raise ValueError(f"规则树内部节点必须为逻辑算子，实际为 {operator_name}")
+            func = resolve_operator(operator_name)
+            if not isinstance(args, (list, tuple)) or len(args) != operator_arity(func):
+                raise ValueError(f"逻辑算子 {operator_name} 需要 {operator_arity(func)} 个子节点")
+            children = tuple(build(child, depth + 1) for child in args)
+            tree_node = TreeNode(len(nodes) + 1, operator_name, children, func)
+        else:
+            step = compile_step(len(nodes), node)
+            tree_node = TreeNode(step.step, step.operator_name, leaf=step, leaf_index=len(leaves),
+                                 stats=step_statistics.record(step.operator_name, step.feature_names, step.threshold))
+            leaves.append(tree_node)
+        nodes.append(tree_node)
+        return tree_node
+
+    if not is_tree_rule(rules):
+        raise ValueError("规则树的根节点必须为逻辑算子节点")
+    root = build(rules, 1)
+    if signature is None:
+        signature = rules_signature(rules)
+    return RuleTreePlan(signature, root, nodes, leaves)
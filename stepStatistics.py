@@ -0,0 +1,79 @@
+import threading
+
+# ==============================
+# 属性算子步骤的运行统计：按 (算子, 特征名称, 阈值) 记录求值次数、触发次数和抽样的单次耗时
+# 规则树（ruleTree.py）据此估计各子树的期望代价与短路概率，定期重排可交换逻辑节点的子节点求值顺序
+# 计数在求值路径上无锁累加，并发时可能少计个别次数，只影响估计精度
+# ==============================
+
+
+class StepStats:
+    """单个步骤的统计：求值次数、结果为1的次数、抽样计时次数与总耗时（纳秒）"""
+    __slots__ = ("evaluations", "fired", "timed", "total_ns")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.evaluations = 0
+        self.fired = 0
+        self.timed = 0
+        self.total_ns = 0
+
+    def fire_rate(self):
+        return self.fired / self.evaluations if self.evaluations else None
+
+    def mean_ns(self):
+        return self.total_ns / self.timed if self.timed else None
+
+    def to_dict(self):
+        fire_rate = self.fire_rate()
+        mean_ns = self.mean_ns()
+        return {
+            "evaluations": self.evaluations,
+            "fire_rate": round(fire_rate, 4) if fire_rate is not None else None,
+            "mean_us": round(mean_ns / 1000, 3) if mean_ns is not None else None
+        }
+
+
+class StepStatistics:
+    """全部规则共享的步骤统计表，同一 (算子, 特征, 阈值) 在不同规则中共用一条记录"""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+        self.reorders = 0
+
+    def record(self, operator_name, feature_names, threshold):
+        """返回步骤对应的统计记录，不存在时创建；编译规则时取出并保存在计划中，求值时直接累加"""
+        key = (operator_name, tuple(feature_names), repr(threshold))
+        record = self._records.get(key)
+        if record is None:
+            with self._lock:
+                record = self._records.setdefault(key, StepStats())
+        return record
+
+    def clear(self):
+        """
+        清零全部统计；记录原地清零而不删除，已编译的计划仍累加到同一记录，之后的统计与重排依据保持一致
+        """
+        with self._lock:
+            for record in self._records.values():
+                record.reset()
+            self.reorders = 0
+
+    def stats(self, top=10):
+        """记录条数、重排次数及平均耗时最高的 top 个步骤"""
+        with self._lock:
+            items = list(self._records.items())
+        slowest = sorted((item for item in items if item[1].timed), key=lambda item: -item[1].mean_ns())[:top]
+        return {
+            "tracked": len(items),
+            "reorders": self.reorders,
+            "slowest": [{"operator": operator_name, "features": list(feature_names), "threshold": threshold,
+                         **record.to_dict()} for (operator_name, feature_names, threshold), record in slowest]
+        }
+
+
+# 全局步骤统计
+step_statistics = StepStatistics()
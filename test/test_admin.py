@@ -0,0 +1,34 @@
+import os
+
+import app
+
+REMOTE = {'REMOTE_ADDR': '10.0.0.5'}
+
+
+def test_admin_requires_loopback_without_token():
+    """未设置管理令牌时只接受本机请求"""
+    client = app.app.test_client()
+    response = client.get('/admin/rules/snapshot', environ_base=REMOTE)
+    assert response.status_code == 403
+    response = client.get('/admin/rules/snapshot', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+    assert response.status_code == 200
+
+
+def test_admin_token(monkeypatch):
+    monkeypatch.setattr(app, 'ADMIN_TOKEN', 'secret')
+    client = app.app.test_client()
+    assert client.get('/admin/rules/snapshot', environ_base=REMOTE).status_code == 403
+    response = client.get('/admin/rules/snapshot', environ_base=REMOTE, headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200
+
+
+def test_reload_path_outside_rules_dir(tmp_path, monkeypatch):
+    """规则目录之外（含经符号链接指向目录外）的路径返回 400"""
+    monkeypatch.setattr(app, 'RULES_DIR', str(tmp_path / 'rules'))
+    (tmp_path / 'rules').mkdir()
+    (tmp_path / 'secret.csv').write_text('x')
+    os.symlink(tmp_path / 'secret.csv', tmp_path / 'rules' / 'link.csv')
+    client = app.app.test_client()
+    for path in ('/etc/passwd', str(tmp_path / 'rules' / '..' / 'secret.csv'), str(tmp_path / 'rules' / 'link.csv')):
+        response = client.post('/admin/rules/reload', json={'path': path})
+        assert response.status_code == 400, path
@@ -0,0 +1,56 @@
+import time
+
+from evaluationSession import EvaluationSession, EvaluationSessions
+
+RULES = [["diff_operator", ["申报价格", "参考价格"], 0], ["diff_operator", ["申报重量", "实际重量"], 0],
+         ["or_operator", [], None]]
+TREE = {"op": "or_operator", "args": RULES[:2]}
+FEATURES = {"申报价格": 5, "参考价格": 10, "申报重量": 100, "实际重量": 90}
+
+
+def test_incremental_update_matches_full_evaluation():
+    """只重算输入特征有变化的步骤，结果与完整计算相同"""
+    session = EvaluationSession("D1", RULES)
+    first = session.evaluate(dict(FEATURES))
+    assert not first["incremental"] and first["results_changed"]
+
+    updated = {**FEATURES, "申报价格": 20}
+    changes = session.evaluate(updated)
+    assert changes["incremental"] and changes["changed_features"] == ["申报价格"]
+    assert changes["recomputed_steps"] == [1, 3] and changes["reused_steps"] == 1
+    assert changes["flipped_steps"] == [1] and not changes["final_flipped"] and changes["results_changed"]
+    full = EvaluationSession("D2", RULES)
+    full.evaluate(updated)
+    assert session.structure == full.structure
+
+    unchanged = session.evaluate({**updated, "申报价格": 21})
+    assert unchanged["flipped_steps"] == [] and not unchanged["results_changed"]
+
+
+def test_tree_rules_always_evaluated_in_full():
+    session = EvaluationSession("D1", TREE)
+    session.evaluate(dict(FEATURES))
+    changes = session.evaluate({**FEATURES, "申报价格": 20})
+    assert not changes["incremental"]
+
+
+def test_failed_evaluation_resets_structure():
+    session = EvaluationSession("D1", RULES)
+    session.evaluate(dict(FEATURES))
+    try:
+        session.evaluate({"申报价格": 5})
+    except ValueError:
+        pass
+    assert session.structure is None
+    assert not session.evaluate(dict(FEATURES))["incremental"]
+
+
+def test_sessions_evict_and_expire():
+    sessions = EvaluationSessions(maxsize=2, ttl=60)
+    for declaration_id in ("A", "B", "C"):
+        sessions.create(declaration_id, RULES)
+    assert sessions.get("A") is None and sessions.get("C") is not None
+    sessions.get("B").updated = time.time() - 120
+    assert sessions.get("B") is None
+    stats = sessions.stats()
+    assert (stats["size"], stats["evicted"], stats["expired"]) == (1, 1, 1)
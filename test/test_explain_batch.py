@@ -0,0 +1,28 @@
+import json
+import time
+
+import app
+
+RULES = [["diff_operator", ["申报价格", "参考价格"], 0]]
+
+
+def test_llm_results_streamed_before_batch_ends(monkeypatch):
+    """大模型描述完成后在后续申报计算期间就输出，不等到全部申报计算完"""
+    monkeypatch.setattr(app, "get_llm_explanation", lambda *args: "描述")
+    summary = app.build_summary
+
+    def slow_summary(*args):
+        time.sleep(0.05)
+        return summary(*args)
+    monkeypatch.setattr(app, "build_summary", slow_summary)
+
+    declarations = [{"id": "llm", "explain": True, "explain_mode": "llm",
+                     "risk_features": {"申报价格": 5, "参考价格": 1}, "rules": RULES}]
+    declarations += [{"id": f"plain{i}", "risk_features": {"申报价格": 5, "参考价格": 1}, "rules": RULES}
+                     for i in range(5)]
+    response = app.app.test_client().post('/explain_risk_batch', json={"declarations": declarations})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    ids = [line["id"] for line in lines]
+    assert sorted(ids) == sorted(item["id"] for item in declarations)
+    assert ids.index("llm") < len(ids) - 1
+    assert lines[ids.index("llm")]["semantic_description"] == "描述"
@@ -0,0 +1,40 @@
+from explanationBatcher import ExplanationBatcher
+
+STRUCTURE = {"calculation_steps": [{"step": 1, "description": "计算申报价格与参考价格的差值"}], "final_risk_indicator": 1}
+
+
+def explain_group(chat, count=3):
+    """同时提交 count 条申报（合并为一次调用），返回各自的结果"""
+    batcher = ExplanationBatcher(window_ms=50, max_items=count, chat=chat, timeout=5)
+    futures = [batcher.submit("url", "model", {"申报价格": i}, STRUCTURE) for i in range(count)]
+    return [future.result(timeout=5) for future in futures], batcher.stats()
+
+
+def test_failed_batch_resolves_every_item():
+    """大模型调用失败（返回 None）时每条申报都得到 None，不会一直等待"""
+    results, stats = explain_group(lambda url, model, messages: None)
+    assert results == [None, None, None]
+    assert stats["batched_calls"] == 1 and stats["fallbacks"] == 0
+
+
+def test_unsplittable_answer_falls_back_to_single_calls():
+    """回复无法按编号拆分时逐条调用"""
+    def chat(url, model, messages):
+        return "无编号" if "3条申报" in messages[-1]["content"] else "逐条描述"
+    results, stats = explain_group(chat)
+    assert results == ["逐条描述"] * 3
+    assert stats["fallbacks"] == 1
+
+
+def test_split_answer():
+    def chat(url, model, messages):
+        return "\n".join(f"### 申报{i}\n描述{i}" for i in range(1, 4))
+    results, _ = explain_group(chat)
+    assert results == ["描述1", "描述2", "描述3"]
+
+
+def test_explain_times_out():
+    """等待超过 timeout 时返回 None"""
+    batcher = ExplanationBatcher(window_ms=10, max_items=1, chat=lambda url, model, messages: None, timeout=0.2)
+    batcher._executor.submit = lambda *args: None  # 调用永远不执行
+    assert batcher.explain("url", "model", {"申报价格": 1}, STRUCTURE) is None
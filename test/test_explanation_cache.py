@@ -0,0 +1,38 @@
+from explanationCache import ExplanationCache, explanation_key
+
+RULES = [["ratio_operator", ["申报价格", "参考价格"], 1.1]]
+STRUCTURE = {"calculation_steps": [{"result": 1}], "final_risk_indicator": 1}
+
+
+def key(features, digits=3):
+    return explanation_key(RULES, STRUCTURE, features, digits)
+
+
+def test_key_keeps_significant_digits():
+    """特征值按有效数字取整：与量级无关，取值相差较大的申报不共用描述"""
+    assert key({"比值": 1.19}) != key({"比值": 1.99})
+    assert key({"比值": 1.19}) != key({"比值": 1.2})
+    assert key({"比值": 1.1901}) == key({"比值": 1.1899})
+    assert key({"申报价格": 10851}) == key({"申报价格": 10854})
+    assert key({"申报价格": 10851}) != key({"申报价格": 10951})
+    assert key({"比值": 1.1901}, None) != key({"比值": 1.1899}, None)
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    db_path = str(tmp_path / "explanations.db")
+    cache = ExplanationCache(db_path=db_path)
+    cache.set(key({"比值": 1.19}), "描述")
+    cache.set(key({"比值": 1.5}), "")  # 空描述不缓存
+
+    restarted = ExplanationCache(db_path=db_path)
+    assert restarted.get(key({"比值": 1.19})) == "描述"
+    assert restarted.get(key({"比值": 1.5})) is None
+    assert restarted.get(key({"比值": 1.19})) == "描述"
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+
+
+def test_ttl():
+    cache = ExplanationCache(ttl=-1)
+    cache.set("k", "描述")
+    assert cache.get("k") is None
@@ -0,0 +1,83 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import explanationJobs
+from explanationJobs import ExplanationJobs, check_callback_url
+
+
+class CallbackServer(HTTPServer):
+    """本机回调服务，记录收到的 (Host 头, 请求体)"""
+
+    def __init__(self):
+        self.received = []
+        self.event = threading.Event()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(handler):
+                body = handler.rfile.read(int(handler.headers["Content-Length"]))
+                self.received.append((handler.headers["Host"], json.loads(body)))
+                handler.send_response(204)
+                handler.end_headers()
+                self.event.set()
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def fake_resolver(monkeypatch, answers):
+    """*.example 主机依次解析为 answers 中的地址（最后一个重复使用），返回解析记录"""
+    calls = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        if not host.endswith(".example"):
+            return real_getaddrinfo(host, *args, **kwargs)
+        address = answers[min(len(calls), len(answers) - 1)]
+        calls.append(host)
+        port = int(args[0]) if args and args[0] is not None else 0
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, port))]
+
+    monkeypatch.setattr(explanationJobs.socket, "getaddrinfo", getaddrinfo)
+    return calls
+
+
+def test_check_callback_url():
+    for url in ("ftp://example.com/", "http://127.0.0.1/", "http://10.0.0.1/", "http://169.254.169.254/", 1):
+        with pytest.raises(ValueError):
+            check_callback_url(url)
+    with pytest.raises(ValueError):
+        check_callback_url("http://other.example/", {"hooks.example"})
+
+
+def test_callback_connects_to_validated_address(monkeypatch):
+    """回调连接校验时解析出的地址，Host 头为原主机名"""
+    server = CallbackServer()
+    calls = fake_resolver(monkeypatch, ["127.0.0.1"])
+    jobs = ExplanationJobs(workers=1, callback_hosts=["hooks.example"])
+    port = server.server_address[1]
+    job_id = jobs.submit(lambda: "描述", callback_url=f"http://hooks.example:{port}/done?x=1")
+    assert server.event.wait(5)
+    host, body = server.received[0]
+    assert host == f"hooks.example:{port}" and body["job_id"] == job_id and body["semantic_description"] == "描述"
+    assert calls == ["hooks.example", "hooks.example"]  # 提交时与发送前各解析一次，连接时不再解析
+    server.shutdown()
+
+
+def test_callback_not_resolved_again_when_connecting(monkeypatch):
+    """校验后解析结果改为指向本机（DNS 重绑定）时，仍只连接校验过的公网地址"""
+    server = CallbackServer()
+    fake_resolver(monkeypatch, ["93.184.216.34", "93.184.216.34", "127.0.0.1"])
+    jobs = ExplanationJobs(workers=1, callback_timeout=0.5)
+    jobs.submit(lambda: "描述", callback_url=f"http://rebind.example:{server.server_address[1]}/")
+    jobs._queue.join()
+    time.sleep(1)  # 回调在 task_done 之后发送
+    assert not server.received
+    server.shutdown()
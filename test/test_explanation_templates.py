@@ -0,0 +1,32 @@
+from explanationTemplates import render_template_explanation
+from rulePlan import get_plan
+
+# 步骤1（价格差值）不满足，步骤2（重量差值）满足
+FEATURES = {"申报价格": 5.0, "参考价格": 10.0, "申报重量": 100.0, "实际重量": 90.0}
+STEPS = [["diff_operator", ["申报价格", "参考价格"], 0], ["diff_operator", ["申报重量", "实际重量"], 0]]
+PRICE = "申报价格与参考价格的差值"
+WEIGHT = "申报重量与实际重量的差值"
+
+
+def risk_behaviour(combiner):
+    """按逻辑算子组合两个步骤，返回模板描述中的风险表现一行"""
+    rules = STEPS + [[combiner, [], None]]
+    text, confidence = render_template_explanation(get_plan(rules).evaluate(FEATURES, rules), "价格风险")
+    assert confidence == 1.0
+    return text.splitlines()[1]
+
+
+def test_combiner_relevant_steps():
+    """风险表现只描述按逻辑算子决定最终结果的步骤"""
+    cases = {
+        "and_operator": [PRICE],  # 未触发：未满足的条件
+        "or_operator": [WEIGHT],  # 触发：满足的条件
+        "nand_operator": [PRICE],  # 触发：未满足的条件
+        "nor_operator": [WEIGHT],  # 未触发：满足的条件
+        "implication_operator": [PRICE, WEIGHT],  # 触发：前件不满足、后件满足
+        "xor_operator": [PRICE, WEIGHT],
+    }
+    for combiner, expected in cases.items():
+        line = risk_behaviour(combiner)
+        for label in (PRICE, WEIGHT):
+            assert (label in line) == (label in expected), (combiner, line)
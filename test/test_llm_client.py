@@ -0,0 +1,27 @@
+import pytest
+
+from test_llm_pool import FakeClient
+
+
+def test_stream_releases_slot_when_on_start_raises():
+    """on_start 抛出异常时归还流式名额"""
+    client = FakeClient(max_streams=1)
+
+    def on_start():
+        raise RuntimeError("on_start")
+
+    with pytest.raises(RuntimeError):
+        next(client.stream("a", "model", [], on_start=on_start))
+    assert "".join(client.stream("a", "model", [], max_retries=1)) == "a"
+    assert client._stream_slots.acquire(timeout=1)
+
+
+def test_stream_releases_slot_after_failed_attempts():
+    class FailingClient(FakeClient):
+        def _post(self, url, payload, timeout, stream=False):
+            raise ConnectionError("refused")
+
+    client = FailingClient(max_streams=1, backoff_base=0)
+    with pytest.raises(RuntimeError):
+        list(client.stream("a", "model", [], max_retries=2))
+    assert client._stream_slots.acquire(timeout=1)
@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+
+from api import AsyncLLMClient
+from llmPool import LLMPool
+
+
+class FakeResponse:
+    def __init__(self, content, delay=0.0):
+        self.status_code = 200
+        self.content = content.encode("utf-8")
+        self._content = content
+        self._delay = delay
+
+    def json(self):
+        return {"choices": [{"message": {"content": self._content}}]}
+
+    def iter_lines(self, decode_unicode=False):
+        time.sleep(self._delay)
+        yield "data: " + json.dumps({"choices": [{"delta": {"content": self._content}}]})
+        yield "data: [DONE]"
+
+    def close(self):
+        pass
+
+
+class FakeClient(AsyncLLMClient):
+    """不发出网络请求：对话请求耗时 chat_delay 秒，流式请求首个数据耗时 stream_delay 秒"""
+
+    def __init__(self, chat_delay=0.0, stream_delay=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.chat_delay = chat_delay
+        self.stream_delay = stream_delay
+
+    def _post(self, url, payload, timeout, stream=False):
+        if stream:
+            return FakeResponse(url, self.stream_delay)
+        time.sleep(self.chat_delay)
+        return FakeResponse(url)
+
+
+def test_stream_latency_kept_apart_from_chat():
+    """流式请求的首个数据耗时单独统计，不计入决定对冲等待的对话请求延迟"""
+    pool = LLMPool(["a"], FakeClient(stream_delay=0.05), hedge_min_samples=1)
+    endpoint = pool.endpoints[0]
+    assert "".join(pool.stream("model", [])) == "a"
+    assert endpoint.latency_quantile(0.95) is None
+    assert endpoint.latency_quantile(0.95, stream=True) >= 0.05
+    assert pool._hedge_delay(endpoint) is None
+
+    assert pool.chat("model", []) == "a"
+    assert endpoint.latency_quantile(0.95) < 0.05
+    assert endpoint.stats()["ttft_p95_ms"] >= 50
+
+
+def test_attempt_fails_when_queued_too_long():
+    """线程池已满（如在线程池内部调用）时，排队超过 queue_timeout 的尝试失败，不会一直等待"""
+    client = FakeClient(max_concurrency=1)
+    release = threading.Event()
+    client.submit(release.wait, 5)
+    pool = LLMPool(["a"], client, queue_timeout=0.1)
+    start = time.perf_counter()
+    assert pool.chat("model", [], max_retries=1) is None
+    assert time.perf_counter() - start < 2
+    release.set()
+    assert pool.chat("model", [], max_retries=1) == "a"
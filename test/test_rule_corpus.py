@@ -0,0 +1,66 @@
+import csv
+import json
+import random
+
+from ruleCorpus import is_rule_corpus, write_rule_corpus
+from ruleStore import MappedRuleStore, RuleStore
+
+OPERATORS = [("diff_operator", 2, 0), ("ratio_operator", 2, 1.2), ("mul_operator", 2, 2.5), ("cmp_operator", 2, None)]
+ATTRIBUTES = ["申报价格", "参考价格", "申报重量", "实际重量", "毛重", "净重"]
+FIELDS = ["rule_id", "rule_name", "rule_description", "rule_type", "rule_status", "rule_structure",
+          "calculation_method", "created_time", "updated_time", "operator"]
+
+
+def make_rows(count, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        steps = []
+        for _ in range(rng.choice([1, 2])):
+            operator_name, arity, threshold = rng.choice(OPERATORS)
+            steps.append([operator_name, rng.sample(ATTRIBUTES, arity), threshold])
+        if len(steps) == 2:
+            steps.append(["and_operator", [], None])
+        rows.append({"rule_id": f"RULE_{i:04d}", "rule_name": f"规则{i}", "rule_description": "",
+                     "rule_type": rng.choice(["价格风险", "重量风险"]), "rule_status": rng.choice(["启用", "禁用"]),
+                     "rule_structure": json.dumps(steps, ensure_ascii=False), "calculation_method": "",
+                     "created_time": 0, "updated_time": 1700000000 + i, "operator": steps[0][0]})
+    return rows
+
+
+def load_both(tmp_path, rows):
+    csv_path, binary_path = tmp_path / "rules.csv", tmp_path / "rules.bin"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    assert write_rule_corpus(rows, str(binary_path)) == len(rows)
+    assert is_rule_corpus(str(binary_path)) and not is_rule_corpus(str(csv_path))
+    return RuleStore.load(str(csv_path)), RuleStore.load(str(binary_path))
+
+
+def ids(rules):
+    return sorted(rule.rule_id for rule in rules)
+
+
+def test_mapped_store_matches_csv(tmp_path):
+    """内存映射加载的规则库与 CSV 加载的规则库查询结果相同"""
+    csv_store, mapped = load_both(tmp_path, make_rows(300))
+    assert isinstance(mapped, MappedRuleStore) and len(mapped) == len(csv_store) == 300
+    for rule_id in ("RULE_0000", "RULE_0150", "RULE_0299"):
+        assert mapped.get(rule_id).to_dict() == csv_store.get(rule_id).to_dict()
+    assert mapped.get("RULE_9999") is None and mapped.get("X" * 100) is None
+
+    for rule_type in (None, "价格风险", "不存在"):
+        for rule_status in (None, "启用"):
+            for attribute in (None, "毛重"):
+                assert ids(mapped.query(rule_type, rule_status, attribute)) \
+                    == ids(csv_store.query(rule_type, rule_status, attribute))
+                assert mapped.count(rule_type, rule_status, attribute) \
+                    == csv_store.count(rule_type, rule_status, attribute)
+
+    risk_features = {"申报价格": 15, "参考价格": 10, "申报重量": 5, "实际重量": 3}
+    assert ids(mapped.candidates(risk_features, "价格风险")) == ids(csv_store.candidates(risk_features, "价格风险"))
+    fired, errors = mapped.fired_rules(risk_features)
+    csv_fired, csv_errors = csv_store.fired_rules(risk_features)
+    assert ids(fired) == ids(csv_fired) and errors == csv_errors
@@ -0,0 +1,77 @@
+import random
+
+from ruleDAG import RuleDAG, ThresholdIndex
+from rulePlan import compile_rules
+
+# 规则共用操作数（申报价格/参考价格 的比值、重量差值），阈值各不相同
+RULES = {
+    "R1": [["ratio_operator", ["申报价格", "参考价格"], 1.2]],
+    "R2": [["ratio_operator", ["申报价格", "参考价格"], 1.5]],
+    "R3": [["ratio_operator", ["申报价格", "参考价格"], 1.2], ["diff_operator", ["申报重量", "实际重量"], 0],
+           ["and_operator", [], None]],
+    "R4": [["diff_operator", ["申报重量", "实际重量"], 5], ["ratio_operator", ["申报价格", "参考价格"], 0.8],
+           ["xor_operator", [], None]],
+    "R5": [["cmp_operator", ["毛重", "净重"], None]],
+    "R6": [["diff_operator", ["申报重量", "实际重量"], 0], ["diff_operator", ["申报重量", "实际重量"], 0],
+           ["and_operator", [], None]],
+}
+
+
+def random_features(rng):
+    return {
+        "申报价格": rng.choice([0, 5, 10, 12, 15, 20]),
+        "参考价格": rng.choice([0, 8, 10]),
+        "申报重量": rng.randint(0, 20),
+        "实际重量": rng.randint(0, 20),
+        "毛重": rng.randint(0, 3),
+        "净重": rng.randint(0, 3),
+    }
+
+
+def expected(rules, risk_features):
+    try:
+        return compile_rules(rules).evaluate_indicator(risk_features), None
+    except Exception as e:
+        return None, str(e)
+
+
+def test_dag_matches_single_rule_evaluation():
+    """规则DAG共享操作数后，结果与出错情况都与逐条求值相同"""
+    dag = RuleDAG.build(RULES.items())
+    assert dag.stats()["distinct_operands"] < dag.stats()["total_steps"]
+    rng = random.Random(0)
+    for _ in range(300):
+        risk_features = random_features(rng)
+        results, errors = dag.evaluate(risk_features)
+        for rule_id, rules in RULES.items():
+            result, error = expected(rules, risk_features)
+            assert results.get(rule_id) == result, (rule_id, risk_features)
+            assert (rule_id in errors) == (error is not None), (rule_id, risk_features)
+
+
+def test_missing_feature_and_invalid_rule():
+    dag = RuleDAG.build([*RULES.items(), ("BAD", [["unknown_operator", ["申报价格"], 1]])])
+    assert "BAD" in dag.invalid and dag.position("BAD") is None
+    results, errors = dag.evaluate({"申报价格": 15, "参考价格": 10})
+    assert results == {"R1": 1, "R2": 1}
+    assert "缺少特征" in errors["R3"]
+
+
+def test_threshold_index_matches_dag():
+    """阈值有序索引找出的触发规则与错误，与规则DAG逐条求值一致"""
+    attributes = {rule_id: frozenset(name for step in rules if step[1] for name in step[1])
+                  for rule_id, rules in RULES.items()}
+    attributes["BAD"] = frozenset({"申报价格"})
+    dag = RuleDAG.build([*RULES.items(), ("BAD", [["unknown_operator", ["申报价格"], 1]])])
+    index = ThresholdIndex(dag, attributes.get)
+    rng = random.Random(1)
+    for _ in range(300):
+        risk_features = random_features(rng)
+        for name in rng.sample(sorted(risk_features), rng.randint(0, 2)):
+            del risk_features[name]
+        results, errors = dag.evaluate(risk_features)
+        fired, index_errors = index.fired_rules(risk_features)
+        covered = {rule_id for rule_id, needed in attributes.items() if needed <= risk_features.keys()}
+        assert set(fired) == {rule_id for rule_id, result in results.items() if result == 1}, risk_features
+        assert set(index_errors) == {rule_id for rule_id in errors if rule_id in covered} \
+            | ({"BAD"} if "BAD" in covered else set()), risk_features
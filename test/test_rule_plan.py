@@ -0,0 +1,35 @@
+import numpy as np
+
+import rulePlan
+import ruleTree
+from rulePlan import PlanCache, rules_signature
+
+TREE = {"op": "and_operator", "args": [["diff_operator", ["a", "b"], 0], ["ratio_operator", ["c", "d"], 1.2]]}
+
+
+def test_signature_ignores_key_order():
+    """字典键顺序不同、元组与列表形式的同一规则共用一个编译计划"""
+    reordered = {"args": [("diff_operator", ("a", "b"), 0), ["ratio_operator", ["c", "d"], 1.2]], "op": "and_operator"}
+    assert rules_signature(reordered) == rules_signature(TREE)
+    cache = PlanCache()
+    assert cache.get(TREE) is cache.get(reordered)
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 1
+
+
+def test_evaluate_batch_uses_compiled_operators(monkeypatch):
+    """批量算子在编译时解析，批量求值时不再按名称查找；结果与逐行求值一致"""
+    rules = [["diff_operator", ["a", "b"], 0], ["ratio_operator", ["c", "d"], 1.2], ["or_operator", [], None]]
+    plans = [rulePlan.compile_rules(rules), rulePlan.compile_rules(TREE)]
+
+    def fail(*args):
+        raise AssertionError("批量求值时不应查找算子")
+    monkeypatch.setattr(rulePlan, "resolve_operator", fail)
+    monkeypatch.setattr(ruleTree, "resolve_operator", fail)
+
+    rows = [{"a": 5.0, "b": 1.0, "c": 1.0, "d": 1.0}, {"a": 1.0, "b": 5.0, "c": 3.0, "d": 1.0},
+            {"a": 1.0, "b": 5.0, "c": 1.0, "d": 1.0}]
+    table = {name: np.array([row[name] for row in rows]) for name in "abcd"}
+    for plan, plan_rules in zip(plans, (rules, TREE)):
+        batch = plan.evaluate_batch(table, plan_rules)
+        expected = [plan.evaluate_indicator(row) for row in rows]
+        assert batch["final_risk_indicator"].tolist() == expected
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from ruleCorpus import write_rule_corpus
+from ruleSnapshot import RuleSnapshots
+from ruleStore import RuleStore
+
+FEATURES = {"申报价格": 12.0, "参考价格": 10.0}
+
+
+def rule_row(rule_id, threshold):
+    return {"rule_id": rule_id, "rule_name": rule_id, "rule_description": "", "rule_type": "价格风险",
+            "rule_status": "启用", "calculation_method": "", "operator": "ratio_operator",
+            "rule_structure": [["ratio_operator", ["申报价格", "参考价格"], threshold]],
+            "created_time": 0, "updated_time": 0}
+
+
+def write_corpus(path, thresholds):
+    write_rule_corpus([rule_row(f"R{i}", threshold) for i, threshold in enumerate(thresholds)], str(path))
+    return str(path)
+
+
+def test_reload_builds_index_when_previous_was_warm(tmp_path):
+    """内存映射规则库：上一版本已建好阈值索引时，重新加载后在发布前建好，否则仍按需构建"""
+    first = write_corpus(tmp_path / "first.bin", [1.1, 1.5])
+    second = write_corpus(tmp_path / "second.bin", [1.1, 1.3, 1.5])
+    snapshots = RuleSnapshots(lambda path: RuleStore.load(path or first), first)
+    assert snapshots.current.store._threshold_index is None
+
+    snapshots.wait(snapshots.reload(second))
+    assert snapshots.current.store._threshold_index is None
+
+    fired, _ = snapshots.current.store.fired_rules(FEATURES)
+    assert {rule.rule_id for rule in fired} == {"R0"}
+    snapshots.wait(snapshots.reload(first))
+    store = snapshots.current.store
+    assert store._dag is not None and store._threshold_index is not None
+    assert {rule.rule_id for rule in store.fired_rules(FEATURES)[0]} == {"R0"}
+
+
+def test_warm_index(tmp_path):
+    path = write_corpus(tmp_path / "rules.bin", [1.1])
+    snapshots = RuleSnapshots(lambda _: RuleStore.load(path), path, warm_index=True)
+    assert snapshots.current.store._threshold_index is not None
+
+
+def test_edit_rejected_after_reload(tmp_path):
+    """编辑在重新加载之前校验、之后构建时构建失败，新加载的规则库不受影响"""
+    first = write_corpus(tmp_path / "first.bin", [1.1, 1.5])
+    second = write_corpus(tmp_path / "second.bin", [1.3, 1.6])
+    loading = threading.Event()
+    release = threading.Event()
+
+    def loader(path):
+        if path is not None:
+            loading.set()
+            release.wait(5)
+        return RuleStore.load(path or first)
+
+    snapshots = RuleSnapshots(loader, first)
+    reload_id = snapshots.reload(second)
+    assert loading.wait(5)
+    edit_id = snapshots.edit([{"rule_id": "R1", "rule_status": "禁用"}])  # 基于 v1 校验
+    release.set()
+
+    assert snapshots.wait(reload_id, 5)["status"] == "done"
+    record = snapshots.wait(edit_id, 5)
+    assert record["status"] == "failed" and record["base_version"] == 1
+    assert snapshots.current.version == 2 and snapshots.current.source == second
+    assert snapshots.current.store.get("R1").rule_status == "启用"
+
+
+def test_consecutive_edits_and_base_version(tmp_path):
+    path = write_corpus(tmp_path / "rules.bin", [1.1, 1.5])
+    snapshots = RuleSnapshots(lambda _: RuleStore.load(path), path)
+    first = snapshots.edit([{"rule_id": "R0", "thresholds": [1.3]}])
+    second = snapshots.edit([{"rule_id": "R1", "rule_status": "禁用"}])  # 同样基于 v1，之间只有编辑
+    assert snapshots.wait(first, 5)["status"] == "done"
+    assert snapshots.wait(second, 5)["status"] == "done"
+    store = snapshots.current.store
+    assert store.get("R0").structure[0][2] == 1.3 and store.get("R1").rule_status == "禁用"
+    assert snapshots.current.loaded_version == 1
+
+    with pytest.raises(ValueError):
+        snapshots.edit([{"rule_id": "R0", "thresholds": [1.4]}], base_version=1)
+    build_id = snapshots.edit([{"rule_id": "R0", "thresholds": [1.4]}], base_version=3)
+    assert snapshots.wait(build_id, 5)["status"] == "done"
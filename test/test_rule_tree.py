@@ -0,0 +1,63 @@
+import json
+
+from ruleTree import REORDER_INTERVAL, compile_tree
+
+# 与节点：声明顺序先算比值（除数可能为0），再算差值
+RULES = {"op": "and_operator", "args": [["ratio_operator", ["a", "b"], 1.0], ["diff_operator", ["c", "d"], 0]]}
+
+INPUTS = [
+    {"a": 1, "b": 0, "c": 0, "d": 5},  # 比值出错，差值为0
+    {"a": 2, "b": 1, "d": 5},  # 差值缺少特征
+    {"a": 1, "c": 0, "d": 5},  # 比值缺少特征
+    {"a": 2, "b": 1, "c": 0, "d": 5},
+    {"a": 0, "b": 1, "c": 9, "d": 5},
+    {"a": 2, "b": 1, "c": 9, "d": 5},
+]
+
+
+def outcome(func, *args):
+    """结果或错误信息，便于比较"""
+    try:
+        return json.dumps(func(*args), ensure_ascii=False, sort_keys=True, default=repr)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def train():
+    """差值总为0、比值总为1：按统计差值应先算"""
+    plan = compile_tree(RULES)
+    for _ in range(REORDER_INTERVAL * 5):
+        plan.evaluate_indicator({"a": 2, "b": 1, "c": 0, "d": 5})
+    plan.reorder()
+    return plan
+
+
+def final_outcome(plan, risk_features):
+    return outcome(lambda f: plan.evaluate(f, RULES)["final_risk_indicator"], risk_features)
+
+
+def test_reorder_keeps_result():
+    """重排子节点求值顺序前后，evaluate 与 evaluate_indicator 的最终风险指标与出错情况都不变"""
+    fresh = compile_tree(RULES)
+    trained = train()
+    assert trained.evaluation_order() != fresh.evaluation_order()
+
+    for risk_features in INPUTS:
+        expected = final_outcome(fresh, risk_features)
+        assert final_outcome(trained, risk_features) == expected
+        assert outcome(trained.evaluate_indicator, risk_features) == expected
+        assert outcome(fresh.evaluate_indicator, risk_features) == expected
+
+
+def test_evaluate_uses_learned_order():
+    """evaluate 按重排后的顺序短路，计算结构仍按步骤编号排列"""
+    trained = train()
+    result = trained.evaluate({"a": 2, "b": 1, "c": 0, "d": 5}, RULES)
+    assert [entry["step"] for entry in result["calculation_steps"]] == [1, 2, 3]
+    assert result["skipped_steps"] == [1]
+    assert result["calculation_steps"][2]["input_results"] == [None, 0]
+    assert result["intermediate_results"] == [None, 0]
+
+    # 比值的除数为0时不按重排后的顺序，与声明顺序的结果和出错情况完全相同
+    risk_features = INPUTS[0]
+    assert outcome(trained.evaluate, risk_features, RULES) == outcome(compile_tree(RULES).evaluate, risk_features, RULES)
@@ -0,0 +1,23 @@
+from ruleTree import compile_tree
+from stepStatistics import StepStatistics, step_statistics
+
+RULES = {"op": "or_operator", "args": [["diff_operator", ["x", "y"], 0], ["diff_operator", ["x", "z"], 0]]}
+
+
+def test_record_shared_between_rules():
+    statistics = StepStatistics()
+    record = statistics.record("diff_operator", ["x", "y"], 0)
+    assert statistics.record("diff_operator", ("x", "y"), 0) is record
+    assert statistics.record("diff_operator", ("x", "y"), 1) is not record
+
+
+def test_clear_keeps_compiled_plans_counting():
+    """清零后已编译的计划仍累加到 /stats 可见的同一记录"""
+    plan = compile_tree(RULES)
+    plan.evaluate_indicator({"x": 5, "y": 1, "z": 1})
+    step_statistics.clear()
+    assert plan.leaves[0].stats.evaluations == 0
+    plan.evaluate_indicator({"x": 5, "y": 1, "z": 1})
+    record = step_statistics.record("diff_operator", ("x", "y"), 0)
+    assert record is plan.leaves[0].stats and record.evaluations == 1
+    assert step_statistics.stats()["reorders"] == 0